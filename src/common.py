@@ -2,4 +2,5 @@ from collections import namedtuple
 
 Point = namedtuple('Point', ['latitude', 'longitude', 'ts'])
 
-TrackInfo = namedtuple('TrackInfo', ['length', 'duration', 'timestamp', 'points_total'])
+# rev - track revision, see the session hash in db.py
+TrackInfo = namedtuple('TrackInfo', ['length', 'duration', 'timestamp', 'points_total', 'rev'], defaults=[0])
@@ -6,7 +6,27 @@ logger = logging.getLogger('geobot-const')
 MIN_GEO_DELTA = 30.0 # Minimal delta in meters for next track point to be recorded
 MAX_SPEED = 16.0 # Maximum speed, m/s
 AFTER_PAUSE_TIME = 180.0 # Timeout after wich track is paused, if there is no movement 
+DEFAULT_DISTANCE_BACKEND = 'fast' # Distance computation of the update filter: 'fast' or 'geodesic' (DISTANCE_BACKEND env var)
+DEFAULT_INGEST_WINDOW_MS = 0 # Default time location updates are collected for one batch write (INGEST_WINDOW_MS env var, 0 - no batching)
+DEFAULT_INGEST_MAX_BATCH = 500 # Default number of pending updates that triggers a batch write before the window ends (INGEST_MAX_BATCH env var)
+DEFAULT_SESSION_CACHE_SIZE = 10000 # Default number of live sessions cached in memory (SESSION_CACHE_SIZE env var, 0 - no cache)
+SESSION_STORE_ATTEMPTS = 3 # Versioned writes of a session before it is written over a concurrent change
+INGEST_FLUSH_ATTEMPTS = 5 # Failed writes of buffered updates before they are dropped
+INGEST_RETRY_DELAY = 0.5 # Delay before the first retry of a failed batch write, doubled with every retry, seconds
+DEFAULT_WEBHOOK_LISTEN = '0.0.0.0' # Default address of the webhook server (WEBHOOK_LISTEN env var); webhook mode is on when WEBHOOK_URL is set
+DEFAULT_WEBHOOK_PORT = 8443 # Default port of the webhook server (WEBHOOK_PORT env var)
+DEFAULT_WEBHOOK_MAX_CONNECTIONS = 40 # Default number of webhook requests Telegram keeps open at once (WEBHOOK_MAX_CONNECTIONS env var)
+DEFAULT_CONCURRENT_UPDATES = 64 # Default number of updates processed at once in webhook mode (CONCURRENT_UPDATES env var)
+DEFAULT_LOG_LEVEL = 'INFO' # Default logging level (LOG_LEVEL env var)
+DEFAULT_LOG_SAMPLE = 1 # Default share of per-update log lines written: every N-th one (LOG_SAMPLE env var)
+DEFAULT_METRICS_ADDR = '127.0.0.1' # Default address of the metrics endpoint (METRICS_ADDR env var); served when METRICS_PORT is set
 DEFAULT_BASE_DIR = './geolog-bot-images' # Default map images path
+DEFAULT_MAP_WORKERS = 2 # Default number of map rendering processes (MAP_WORKERS env var)
+DEFAULT_TILE_CACHE_DIR = './geolog-tile-cache' # Default map tiles cache path (TILE_CACHE_DIR env var)
+DEFAULT_TILE_CACHE_MAX_MB = 512 # Default map tiles cache size limit (TILE_CACHE_MAX_MB env var)
+DEFAULT_GPX_CACHE_DIR = './geolog-gpx-cache' # Default path of generated GPX files (GPX_CACHE_DIR env var)
+DEFAULT_GPX_CACHE_MAX_MB = 256 # Default generated GPX files size limit (GPX_CACHE_MAX_MB env var)
+DEFAULT_TILE_URL = 'https://tile.openstreetmap.org/{z}/{x}/{y}.png' # Default tile server (TILE_URL env var)
 
 BOT_TOKEN = None
 GEOLOG_BOT_NAME = 'GeologHerwerjkdf4Bot' # Bot name
@@ -19,6 +39,13 @@ MAP_ANGULAR_SIZE_THRESHOLD2 = 0.012 # Threshold of hi/lo map detail
 MAP_DETAIL_LVL1 = 18
 MAP_DETAIL_LVL2 = 16
 MAP_DETAIL_LVL3 = 15
+DEFAULT_MAP_RENDERER = 'cartopy' # Map renderer: 'cartopy' or 'pil' (MAP_RENDERER env var)
+MAP_MAX_PIXELS = 4096 # Maximal map side for the 'pil' renderer; detail level is lowered to fit
+
+DEFAULT_MAP_JOB_LEASE_TIME = 300.0 # Default lease of a map job, renewed by its worker while rendering; given to another worker when it expires, seconds (MAP_JOB_LEASE_TIME env var)
+MAP_JOB_MAX_ATTEMPTS = 3 # Map job deliveries before the job is moved to the dead letter set
+MAP_WORKER_POLL_INTERVAL = 2.0 # Idle maps worker checks the queue this often, seconds
+MAP_WORKER_MAX_BACKOFF = 60.0 # Longest delay of a maps worker before polling again after errors, seconds
 
 
 def setup():
@@ -1,30 +1,42 @@
 import os
+import asyncio
 import logging
+import weakref
+import struct
 import redis
+import redis.asyncio
+from redis.client import NEVER_DECODE
 from redis.commands.search.field import TextField, NumericField, TagField
 from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 from redis.commands.search.query import Query
 import uuid
+import const
 import common
 import tracker
+import sesscache
+import metrics
+import logconf
 from collections import namedtuple
 
 
 Session = namedtuple('Session', ['id', 'timestamp', 'chat_name', 'points_num', 'length', 'duration'])
+# Telegram file_ids of the session files sent before, None if there are none
+SentFiles = namedtuple('SentFiles', ['map_file_id', 'gpx_file_id', 'gpx_file_ver'])
+MapQueueStats = namedtuple('MapQueueStats', ['todo', 'inprog', 'dead', 'oldest_age'])
+MapJob = namedtuple('MapJob', ['sess_id', 'attempt']) # attempt - delivery number, identifies the worker owning the job
 
 logger = logging.getLogger('geobot-db')
+update_logger = logconf.SampledLogger(logger)
+
+POINT_RECORD = struct.Struct('<dddI')
 
 redis_db = None
+redis_async_clients = weakref.WeakKeyDictionary() # event loop -> redis.asyncio.Redis
+redis_async_scripts = weakref.WeakKeyDictionary() # event loop -> {name: AsyncScript}
 
 
-# point = {
-#   sess_id = "uuid",
-#   usr_id = 100500,
-#   ts = 441818433,
-#   latitude = 33.3,
-#   longitude = 55.5,
-#   segm_id = 4,
-# }
+# track:{uuid} = packed track points of the session "session:uuid", appended in recording order.
+# One POINT_RECORD per point: latitude, longitude, ts, segm_id
 #
 # session = {
 #   usr_id = 100500,
@@ -40,22 +52,209 @@ redis_db = None
 #   last_long = 56.7,
 #   track_segm_idx = 1, # current track segment id
 #   track_segm_len = 5, # current track segment length, points
+#   points_num = 120, # number of recorded track points
+#   rev = 87, # track revision, incremented whenever points are appended; versions cached track data
+#   ver = 412, # session version, incremented on every store_update; versions cached sessions (sesscache)
+#   map_file_id = "AgACAgIAAxk...", # Telegram file_id of the uploaded map image, if it was sent
+#   gpx_file_id = "BQACAgIAAxk...", # Telegram file_id of the uploaded GPX document, if it was sent
+#   gpx_file_ver = "87.gz", # track revision (and compression) of the document behind gpx_file_id
 # }
-
-
+#
+# Map generation queue:
+# maps:todo = zset {sess_id: enqueue time} # pending jobs
+# maps:inprog = zset {sess_id: lease deadline} # jobs taken by a worker; redelivered when the lease expires
+# maps:attempts = hash {sess_id: attempts} # delivery counter of pending and taken jobs; the worker holding
+#                                           # the latest delivery (MapJob.attempt) owns the job
+# maps:dead = set {sess_id} # jobs failed MAP_JOB_MAX_ATTEMPTS times
+# maps:ready = set {sess_id} # sessions having a map image
+#
+# live:{chat_id}:{msg_id}:{usr_id} = "session:uuid" # lookup key of the session recorded from a live location message
+
+
+lua_scripts = {
+    # Session lookup by the live location key, in a single round trip.
+    # KEYS[1] - live key. Returns nil or {session id, session hash fields}
+    'get_live_session': '''
+        local sess_id = redis.call('GET', KEYS[1])
+        if not sess_id then
+            return false
+        end
+        return {sess_id, redis.call('HGETALL', sess_id)}
+    ''',
+    # Creates a session unless another update has already created it for the same live key.
+    # KEYS[1] - live key, KEYS[2] - new session hash, ARGV - session field/value pairs.
+    # Returns nil if created, otherwise {session id, session hash fields}
+    'create_live_session': '''
+        local sess_id = redis.call('GET', KEYS[1])
+        if sess_id then
+            return {sess_id, redis.call('HGETALL', sess_id)}
+        end
+        redis.call('HSET', KEYS[2], unpack(ARGV))
+        redis.call('SET', KEYS[1], KEYS[2])
+        return false
+    ''',
+    # Applies one location update in a single round trip: appends the new track points
+    # (bumping the track revision) and stores the changed session fields atomically.
+    # KEYS[1] - session hash, KEYS[2] - track points
+    # ARGV[1] - packed new points, ARGV[2] - number of new points,
+    # ARGV[3] - expected session version, or empty to store regardless of the version,
+    # ARGV[4] - number of changed session fields N, ARGV[5..2N+4] - field/value pairs.
+    # Returns the new session version, or -1 if the session is not of the expected version
+    'store_update': '''
+        if ARGV[3] ~= '' then
+            local ver = tonumber(redis.call('HGET', KEYS[1], 'ver') or '0')
+            if ver ~= tonumber(ARGV[3]) or redis.call('EXISTS', KEYS[1]) == 0 then
+                return -1
+            end
+        end
+        local n = tonumber(ARGV[4])
+        if n > 0 then
+            redis.call('HSET', KEYS[1], unpack(ARGV, 5, 2 * n + 4))
+        end
+        if tonumber(ARGV[2]) > 0 then
+            redis.call('APPEND', KEYS[2], ARGV[1])
+            redis.call('HINCRBY', KEYS[1], 'points_num', ARGV[2])
+            redis.call('HINCRBY', KEYS[1], 'rev', 1)
+        end
+        return redis.call('HINCRBY', KEYS[1], 'ver', 1)
+    ''',
+    # Queues a map job. KEYS[1] - maps:todo, ARGV[1] - session id
+    'add_map_job': '''
+        local t = redis.call('TIME')
+        return redis.call('ZADD', KEYS[1], 'NX', t[1] + t[2] / 1000000, ARGV[1])
+    ''',
+    # Takes the oldest pending job under a lease, after moving expired leases back to the queue
+    # (or to the dead letter set, when they are out of attempts).
+    # KEYS - maps:todo, maps:inprog, maps:attempts, maps:dead; ARGV[1] - lease time, ARGV[2] - max attempts.
+    # Returns nil or {session id, attempt}
+    'acquire_map_job': '''
+        local t = redis.call('TIME')
+        local now = t[1] + t[2] / 1000000
+        local max_attempts = tonumber(ARGV[2])
+        for _, sess_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+            redis.call('ZREM', KEYS[2], sess_id)
+            if tonumber(redis.call('HGET', KEYS[3], sess_id) or '0') >= max_attempts then
+                redis.call('HDEL', KEYS[3], sess_id)
+                redis.call('SADD', KEYS[4], sess_id)
+            else
+                redis.call('ZADD', KEYS[1], 'NX', now, sess_id)
+            end
+        end
+        local sess_id = redis.call('ZRANGE', KEYS[1], 0, 0)[1]
+        if not sess_id then
+            return false
+        end
+        redis.call('ZREM', KEYS[1], sess_id)
+        redis.call('ZADD', KEYS[2], now + tonumber(ARGV[1]), sess_id)
+        return {sess_id, redis.call('HINCRBY', KEYS[3], sess_id, 1)}
+    ''',
+    # Extends the lease of a job still owned by the worker.
+    # KEYS - maps:inprog, maps:attempts; ARGV[1] - session id, ARGV[2] - attempt, ARGV[3] - lease time.
+    # Returns 1 if renewed, 0 if the job is not owned by the worker anymore
+    'renew_map_job': '''
+        if not redis.call('ZSCORE', KEYS[1], ARGV[1]) or redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+            return 0
+        end
+        local t = redis.call('TIME')
+        redis.call('ZADD', KEYS[1], 'XX', t[1] + t[2] / 1000000 + tonumber(ARGV[3]), ARGV[1])
+        return 1
+    ''',
+    # Marks the map of a job owned by the worker as ready.
+    # KEYS - maps:inprog, maps:attempts, maps:ready, session hash; ARGV[1] - session id, ARGV[2] - attempt.
+    # Returns 1 if finished, 0 if the job is not owned by the worker anymore
+    'finish_map_job': '''
+        if not redis.call('ZSCORE', KEYS[1], ARGV[1]) or redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+            return 0
+        end
+        redis.call('SADD', KEYS[3], ARGV[1])
+        redis.call('ZREM', KEYS[1], ARGV[1])
+        redis.call('HDEL', KEYS[2], ARGV[1])
+        redis.call('HDEL', KEYS[4], 'map_file_id')
+        return 1
+    ''',
+    # Returns a failed job to the queue, or moves it to the dead letter set when it is out of attempts.
+    # KEYS - maps:todo, maps:inprog, maps:attempts, maps:dead; ARGV[1] - session id, ARGV[2] - max attempts,
+    # ARGV[3] - attempt. Returns 1 if the job is dead, -1 if it is not owned by the worker anymore
+    'fail_map_job': '''
+        if not redis.call('ZSCORE', KEYS[2], ARGV[1]) or redis.call('HGET', KEYS[3], ARGV[1]) ~= ARGV[3] then
+            return -1
+        end
+        redis.call('ZREM', KEYS[2], ARGV[1])
+        if tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or '0') >= tonumber(ARGV[2]) then
+            redis.call('HDEL', KEYS[3], ARGV[1])
+            redis.call('SADD', KEYS[4], ARGV[1])
+            return 1
+        end
+        local t = redis.call('TIME')
+        redis.call('ZADD', KEYS[1], 'NX', t[1] + t[2] / 1000000, ARGV[1])
+        return 0
+    ''',
+    # Returns a job the worker could not render through no fault of the job to the end of the queue,
+    # without spending an attempt. KEYS - maps:todo, maps:inprog, maps:attempts; ARGV[1] - session id,
+    # ARGV[2] - attempt. Returns 1 if released, 0 if the job is not owned by the worker anymore
+    'release_map_job': '''
+        if not redis.call('ZSCORE', KEYS[2], ARGV[1]) or redis.call('HGET', KEYS[3], ARGV[1]) ~= ARGV[2] then
+            return 0
+        end
+        redis.call('ZREM', KEYS[2], ARGV[1])
+        redis.call('HINCRBY', KEYS[3], ARGV[1], -1)
+        local t = redis.call('TIME')
+        redis.call('ZADD', KEYS[1], 'NX', t[1] + t[2] / 1000000, ARGV[1])
+        return 1
+    ''',
+}
+
+
+def get_redis_address():
+    host = os.environ.get('REDIS_HOST')
+    port = os.environ.get('REDIS_PORT')
+    host = host if host is not None else 'localhost'
+    port = port if port is not None else 6379
+    return host, port
+
+
+# Synchronous client. Used for the startup index setup, maintenance and tests only;
+# handlers must use get_redis_async()
 def get_redis():
     global redis_db
     if redis_db is None:
-        host = os.environ.get('REDIS_HOST')
-        port = os.environ.get('REDIS_PORT')
-        host = host if host is not None else 'localhost'
-        port = port if port is not None else 6379
+        host, port = get_redis_address()
         logger.info(f'get_redis. host={host}, port={port}')
         redis_db = redis.Redis(host=host, port=port, db=0, decode_responses=True)
     # todo: Check connection state and reconnect if needed
     return redis_db
 
 
+# Pooled asyncio client. Connections are bound to the event loop they were opened in,
+# so there is one client per running loop (the bot has just one; tests get a fresh loop per test)
+def get_redis_async():
+    loop = asyncio.get_running_loop()
+    r = redis_async_clients.get(loop)
+    if r is None:
+        host, port = get_redis_address()
+        pool_size = int(os.environ.get('REDIS_POOL_SIZE', 32))
+        logger.info(f'get_redis_async. host={host}, port={port}, pool_size={pool_size}')
+        pool = redis.asyncio.BlockingConnectionPool(host=host, port=port, db=0, decode_responses=True,
+            max_connections=pool_size)
+        r = redis.asyncio.Redis(connection_pool=pool)
+        redis_async_clients[loop] = r
+        redis_async_scripts[loop] = {name: r.register_script(src) for name, src in lua_scripts.items()}
+    return r
+
+
+def get_script(name: str):
+    get_redis_async()
+    return redis_async_scripts[asyncio.get_running_loop()][name]
+
+
+async def close_redis_async():
+    loop = asyncio.get_running_loop()
+    r = redis_async_clients.pop(loop, None)
+    redis_async_scripts.pop(loop, None)
+    if r is not None:
+        await r.aclose(close_connection_pool=True)
+
+
 def setup_redis():
     r = get_redis()
 
@@ -78,177 +277,286 @@ def setup_redis():
             definition=IndexDefinition(prefix=['session:'], index_type=IndexType.HASH),
         )
 
-    point_index = r.ft('idx:point')
-    try:
-        point_index.info()
-    except:
-        point_index = None
-    if point_index is None:
-        point_index = r.ft('idx:point')
-        logger.info('Creating index for points')
-        point_schema = (
-            TagField('sess_id'),
-            NumericField('ts'),
-        )
-        point_index.create_index(
-            point_schema,
-            definition=IndexDefinition(prefix=['point:'], index_type=IndexType.HASH),
-        )
-
     logger.info('Redis is ready')
 
 
-def get_or_create_session(usr_id, msg_id, tg_chat, loc, common_ts):
-    r = get_redis()
-    idx = r.ft('idx:session')
-    res = idx.search(Query(f'@usr_id:[{usr_id} {usr_id}] @chat_id:[{tg_chat.id} {tg_chat.id}] @msg_id:[{msg_id} {msg_id}]'))
-    logger.info(f'get_or_create_session. Session search: {res}')
-    if res.total == 0:
-        logger.info(f'Creating new session for usr_id={usr_id}')
-        uid = f'session:{uuid.uuid1()}'
-
-        session = tracker.new_session_data_ex(usr_id, msg_id, tg_chat, loc, common_ts)
-        # logger.info(f'get_or_create_session. DEBUG. session={session}')
-        new_res = r.hset(uid, mapping=session)
-        logger.info(f'get_or_create_session. New session. usr_id={usr_id}, uid={uid}, res={new_res}')
-        session['id'] = uid
-        return tracker.SessionData(session) # type tracker.SessionData
+def get_live_key(usr_id, chat_id, msg_id):
+    return f'live:{chat_id}:{msg_id}:{usr_id}'
+
+
+def live_session_from_reply(reply):
+    sess_id, fields = reply
+    session = dict(zip(fields[::2], fields[1::2]))
+    session['id'] = sess_id
+    return session
+
+
+# Redis round trips are timed only, not the cache hits
+async def get_or_create_session(usr_id, msg_id, tg_chat, loc, common_ts):
+    live_key = get_live_key(usr_id, tg_chat.id, msg_id)
+    cache = sesscache.get_session_cache()
+    session = cache.get(live_key)
+    if session is not None:
+        return session
+
+    with metrics.REDIS_SECONDS.timer(function='get_or_create_session'):
+        res = await get_script('get_live_session')(keys=[live_key])
+    if res is not None:
+        logger.info(f'get_or_create_session. Found old session for usr_id={usr_id}, sess_id={res[0]}')
+        session = live_session_from_reply(res)
+        cache.put(live_key, session)
+        return session
+
+    logger.info(f'Creating new session for usr_id={usr_id}')
+    uid = f'session:{uuid.uuid1()}'
+    session = tracker.new_session_data_ex(usr_id, msg_id, tg_chat, loc, common_ts)
+    args = []
+    for field, value in session.items():
+        args += [field, value]
+    with metrics.REDIS_SECONDS.timer(function='get_or_create_session'):
+        res = await get_script('create_live_session')(keys=[live_key, uid], args=args)
+    if res is not None:
+        logger.info(f'get_or_create_session. Session was created concurrently. usr_id={usr_id}, sess_id={res[0]}')
+        session = live_session_from_reply(res)
     else:
-        assert res.total == 1
-        doc = res.docs[0]
-        logger.info(f'get_or_create_session. Found old session for usr_id={usr_id}, sess={doc}')
-        return doc # type redis.Document
+        logger.info(f'get_or_create_session. New session. usr_id={usr_id}, uid={uid}')
+        session['id'] = uid
+    cache.put(live_key, session)
+    return session
 
 
-def update_session(sess_id, fields):
-    r = get_redis()
-    r.hset(sess_id, mapping=fields)
+# Sessions of several live keys, the ones not cached are read in one round trip; None for keys without a session
+async def get_live_sessions(live_keys: list):
+    cache = sesscache.get_session_cache()
+    sessions = [cache.get(live_key) for live_key in live_keys]
+    missing = [i for i, session in enumerate(sessions) if session is None]
+    if len(missing) == 0:
+        return sessions
 
+    pipe = get_redis_async().pipeline(transaction=False)
+    for i in missing:
+        await get_script('get_live_session')(keys=[live_keys[i]], client=pipe)
+    with metrics.REDIS_SECONDS.timer(function='get_live_sessions'):
+        replies = await pipe.execute()
+    for i, res in zip(missing, replies):
+        if res is not None:
+            sessions[i] = live_session_from_reply(res)
+            cache.put(live_keys[i], sessions[i])
+    update_logger.info('get_live_sessions. sessions=%s, read=%s', len(live_keys), len(missing))
+    return sessions
 
-def store_location(sess_data, usr_id, loc, common_ts):
-    sess_id = sess_data.id
-    segm_id = sess_data.track_segm_idx
 
-    r = get_redis()
-    uid = f'point:{uuid.uuid1()}'
-    point = {
-        'sess_id' : sess_id,
-        'usr_id' : usr_id,
-        'latitude' : loc.latitude,
-        'longitude' : loc.longitude,
-        'ts' : common_ts,
-        'segm_id' : segm_id
-    }
-    r.hset(uid, mapping=point)
-    logger.info(f'store_location. sess_id={sess_id}, usr_id={usr_id}')
+def get_track_key(sess_id: str):
+    return f'track:{get_uid_from_sess_id(sess_id)}'
+
 
+@metrics.REDIS_SECONDS.time('function')
+async def store_update(sess_data: tracker.SessionData, points: list, common_ts):
+    segm_id = sess_data.track_segm_idx
+    await store_records(sess_data, [(pnt.latitude, pnt.longitude, common_ts, segm_id) for pnt in points])
 
-def escape_for_exact_search(hash_id):
-    escaped = hash_id.replace(':', '\\:').replace('-', '\\-')
-    return f'{{{escaped}}}'
 
+# Stores the changed session fields and appends track points given as (lat, lon, ts, segm_id) records.
+# With check_version, nothing is stored if the session version is not the one sess_data was read with.
+# Returns the store_update script result: the new session version, or -1 if the version did not match;
+# None if there was nothing to store. With a pipeline as client, the script call is queued in it
+# and the result comes with the pipeline results
+async def store_records(sess_data: tracker.SessionData, records: list, client=None, check_version: bool = False):
+    updates = sess_data.get_updates()
+    if len(records) == 0 and len(updates) == 0:
+        return None
 
-def get_sessions(usr_id: int, offset: int, page_size: int, count_points: bool):
-    r = get_redis()
+    sess_id = sess_data.id
+    packed = b''.join(POINT_RECORD.pack(*rec) for rec in records)
+    args = [packed, len(records), getattr(sess_data, 'ver', 0) if check_version else '', len(updates)]
+    for field, value in updates.items():
+        args += [field, value]
+    res = await get_script('store_update')(keys=[sess_id, get_track_key(sess_id)], args=args, client=client)
+    update_logger.info('store_records. sess_id=%s, points=%s, fields=%s', sess_id, len(records), len(updates))
+    return res
+
+
+# Brings the cached session in line with a store_records result: the stored state if it was stored,
+# evicted if the session has changed meanwhile. Returns False in the latter case
+def cache_stored_session(live_key: str, sess_data: tracker.SessionData, points_num: int, ver: int):
+    cache = sesscache.get_session_cache()
+    if ver < 0:
+        logger.info(f'cache_stored_session. Session has changed. live_key={live_key}, sess_id={sess_data.id}')
+        cache.remove(live_key)
+        return False
+
+    session = sess_data.get_merged()
+    session['points_num'] = int(session.get('points_num', 0)) + points_num
+    if points_num > 0:
+        session['rev'] = int(session.get('rev', 0)) + 1
+    session['ver'] = ver
+    cache.put(live_key, session)
+    return True
+
+
+@metrics.REDIS_SECONDS.time('function')
+async def get_sessions(usr_id: int, offset: int, page_size: int):
+    r = get_redis_async()
     sess_idx = r.ft('idx:session')
-    point_idx = r.ft('idx:point') if count_points else None
 
     sess_q = Query(f'@usr_id:[{usr_id} {usr_id}]').sort_by('ts', asc=False).paging(offset, page_size)
-    res = sess_idx.search(sess_q)
+    res = await sess_idx.search(sess_q)
     logger.debug(f'get_sessions. total_sessions={res.total}')
 
     sessions = []
     for doc in res.docs:
-        sess_id = doc.id
-        total_points = 0
-        if count_points:
-            q = Query(f'@sess_id:{escape_for_exact_search(sess_id)}').dialect(2).paging(0, 0)
-            pnt_res = point_idx.search(q)
-            total_points = pnt_res.total
-            logger.debug(f'get_sessions. total_points={total_points}')
         sessions.append(Session(
-            sess_id,
+            doc.id,
             float(doc.ts),
             doc.chat_name,
-            total_points,
+            int(getattr(doc, 'points_num', 0)),
             round(float(doc.length), 1),
             round(float(doc.duration), 1)))
     return (sessions, res.total)
 
 
-def get_track(sess_id: str):
-    logger.info(f'get_track. sess_id={sess_id}')
-
-    r = get_redis()
-    sess_data = r.hgetall(sess_id)
-
-    point_idx = r.ft('idx:point')
-    offset = 0
-    page_size = 100
-    limit = 10000
-    raw_points = []
-    while True:
-        q = Query(f'@sess_id:{escape_for_exact_search(sess_id)}').dialect(2).sort_by('ts', asc=True).paging(offset, page_size)
-        pnt_res = point_idx.search(q)
-        logger.info(f'get_track. points={len(pnt_res.docs)}, total={pnt_res.total}')
-        raw_points += \
-            [(float(pnt.latitude), float(pnt.longitude), round(float(pnt.ts), 1),
-              pnt.segm_id if hasattr(pnt, 'segm_id') else 1)
-                for pnt in pnt_res.docs]
-        offset += page_size
-        if offset >= pnt_res.total:
-            break
-        assert len(raw_points) <= limit
-
-    by_segm_id = {}
-    for pnt in raw_points:
-        lat, lon, ts, segm_id = pnt
-        points = None
-        if segm_id in by_segm_id.keys():
-            points = by_segm_id[segm_id]
-        else:
-            points = []
-            by_segm_id[segm_id] = points
-        points.append(common.Point(lat, lon, ts))
-    
+def unpack_segments(packed: bytes):
+    # Records are stored in recording order, so segment ids never decrease
     segments = []
-    for segm_id in sorted(by_segm_id.keys()):
-        segments.append(by_segm_id[segm_id])
-
-    info = common.TrackInfo(float(sess_data['length']), float(sess_data['duration']), float(sess_data['ts']), len(raw_points))
-    return info, segments
+    points = None
+    last_segm_id = None
+    for lat, lon, ts, segm_id in POINT_RECORD.iter_unpack(packed):
+        if segm_id != last_segm_id:
+            points = []
+            segments.append(points)
+            last_segm_id = segm_id
+        points.append(common.Point(lat, lon, round(ts, 1)))
+    return segments
+
+
+# Track summary and the files sent before, from the session hash alone, without reading the track
+@metrics.REDIS_SECONDS.time('function')
+async def get_track_info(sess_id: str):
+    r = get_redis_async()
+    length, duration, ts, points_num, rev, map_file_id, gpx_file_id, gpx_file_ver = await r.hmget(sess_id,
+        'length', 'duration', 'ts', 'points_num', 'rev', 'map_file_id', 'gpx_file_id', 'gpx_file_ver')
+    logger.info(f'get_track_info. sess_id={sess_id}, points={points_num}, rev={rev}')
+    info = common.TrackInfo(float(length), float(duration), float(ts), int(points_num or 0), int(rev or 0))
+    return info, SentFiles(map_file_id, gpx_file_id, gpx_file_ver)
+
+
+@metrics.REDIS_SECONDS.time('function')
+async def set_sent_files(sess_id: str, **file_ids):
+    logger.info(f'set_sent_files. sess_id={sess_id}, fields={list(file_ids.keys())}')
+    await get_redis_async().hset(sess_id, mapping=file_ids)
+
+
+# Track as stored: packed POINT_RECORD records, for consumers decoding it in bulk (trackstats).
+# The revision is read before the track (MULTI would decode the binary reply), so the points
+# are at least as new as info.rev
+@metrics.REDIS_SECONDS.time('function')
+async def get_track_data(sess_id: str):
+    r = get_redis_async()
+    pipe = r.pipeline(transaction=False)
+    pipe.hmget(sess_id, 'length', 'duration', 'ts', 'rev')
+    pipe.execute_command('GET', get_track_key(sess_id), **{NEVER_DECODE: True})
+    (length, duration, ts, rev), packed = await pipe.execute()
+    packed = packed or b''
+    points_total = len(packed) // POINT_RECORD.size
+    logger.info(f'get_track_data. sess_id={sess_id}, points={points_total}, rev={rev}')
+
+    info = common.TrackInfo(float(length), float(duration), float(ts), points_total, int(rev or 0))
+    return info, packed
+
+
+async def get_track(sess_id: str):
+    info, packed = await get_track_data(sess_id)
+    return info, unpack_segments(packed)
+
+
+@metrics.REDIS_SECONDS.time('function')
+async def add_map_job(sess_id):
+    logger.info(f'add_map_job. sess_id={sess_id}')
+    await get_script('add_map_job')(keys=['maps:todo'], args=[sess_id])
 
 
-def add_map_job(sess_id):
-    logger.info(f'add_map_job. sess_id={sess_id}')
-    r = get_redis()
-    r.sadd('maps:todo', sess_id)
+def get_map_job_lease_time():
+    return float(os.environ.get('MAP_JOB_LEASE_TIME', const.DEFAULT_MAP_JOB_LEASE_TIME))
 
 
-def acquire_map_job():
+@metrics.REDIS_SECONDS.time('function')
+async def acquire_map_job():
     logger.info(f'acquire_map_job.')
 
-    r = get_redis()
-    sess_id = r.srandmember('maps:todo')
-    if sess_id is None:
+    res = await get_script('acquire_map_job')(keys=['maps:todo', 'maps:inprog', 'maps:attempts', 'maps:dead'],
+        args=[get_map_job_lease_time(), const.MAP_JOB_MAX_ATTEMPTS])
+    if res is None:
         return None
-    logger.info(f'acquire_map_job. new job. sess_id={sess_id}')
-    r.sadd('maps:inprog', sess_id)
-    r.srem('maps:todo', sess_id)
-    return sess_id
-
-
-def finish_map_job(sess_id: str):
-    logger.info(f'finish_map_job. sess_id={sess_id}')
-
-    r = get_redis()
-    r.sadd('maps:ready', sess_id)
-    r.srem('maps:inprog', sess_id)
-
-
-def is_map_available(sess_id: str):
-    r = get_redis()
-    return r.smismember('maps:ready', sess_id)[0] > 0
+    sess_id, attempt = res
+    logger.info(f'acquire_map_job. new job. sess_id={sess_id}, attempt={attempt}')
+    return MapJob(sess_id, int(attempt))
+
+
+# Returns False if the job is not owned by the worker anymore: its lease has expired and it was given to another worker
+@metrics.REDIS_SECONDS.time('function')
+async def renew_map_job(job: MapJob):
+    renewed = await get_script('renew_map_job')(keys=['maps:inprog', 'maps:attempts'],
+        args=[job.sess_id, job.attempt, get_map_job_lease_time()])
+    if not renewed:
+        logger.warning(f'renew_map_job. Lease is lost. sess_id={job.sess_id}, attempt={job.attempt}')
+    return bool(renewed)
+
+
+# The map file of a job not owned by the worker anymore is kept, but the job stays with its owner
+@metrics.REDIS_SECONDS.time('function')
+async def finish_map_job(job: MapJob):
+    logger.info(f'finish_map_job. sess_id={job.sess_id}, attempt={job.attempt}')
+    finished = await get_script('finish_map_job')(keys=['maps:inprog', 'maps:attempts', 'maps:ready', job.sess_id],
+        args=[job.sess_id, job.attempt])
+    if not finished:
+        logger.warning(f'finish_map_job. Job is owned by another worker. sess_id={job.sess_id}, attempt={job.attempt}')
+    return bool(finished)
+
+
+@metrics.REDIS_SECONDS.time('function')
+async def fail_map_job(job: MapJob):
+    dead = await get_script('fail_map_job')(keys=['maps:todo', 'maps:inprog', 'maps:attempts', 'maps:dead'],
+        args=[job.sess_id, const.MAP_JOB_MAX_ATTEMPTS, job.attempt])
+    logger.warning(f'fail_map_job. sess_id={job.sess_id}, attempt={job.attempt}, dead={dead}')
+
+
+@metrics.REDIS_SECONDS.time('function')
+async def release_map_job(job: MapJob):
+    released = await get_script('release_map_job')(keys=['maps:todo', 'maps:inprog', 'maps:attempts'],
+        args=[job.sess_id, job.attempt])
+    logger.warning(f'release_map_job. sess_id={job.sess_id}, attempt={job.attempt}, released={released}')
+
+
+# Jobs in the map queue by state and the age of the oldest pending job. Read with the synchronous client:
+# it is called by the metrics server thread
+def get_map_queue_stats():
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.zcard('maps:todo')
+    pipe.zcard('maps:inprog')
+    pipe.scard('maps:dead')
+    pipe.zrange('maps:todo', 0, 0, withscores=True)
+    pipe.time()
+    with metrics.REDIS_SECONDS.timer(function='get_map_queue_stats'):
+        todo, inprog, dead, oldest, (secs, usecs) = pipe.execute()
+    oldest_age = secs + usecs / 1000000.0 - oldest[0][1] if len(oldest) > 0 else 0.0
+    return MapQueueStats(todo, inprog, dead, oldest_age)
+
+
+def get_map_queue_jobs():
+    stats = get_map_queue_stats()
+    return {('todo',): stats.todo, ('inprog',): stats.inprog, ('dead',): stats.dead}
+
+
+MAP_QUEUE_JOBS = metrics.Gauge('geobot_map_queue_jobs', 'Map jobs pending (maps:todo), taken (maps:inprog) and dead (maps:dead)',
+    ('queue',), func=get_map_queue_jobs)
+MAP_QUEUE_OLDEST_AGE = metrics.Gauge('geobot_map_queue_oldest_age_seconds', 'Age of the oldest pending map job, 0 if none',
+    func=lambda: get_map_queue_stats().oldest_age)
+
+
+@metrics.REDIS_SECONDS.time('function')
+async def is_map_available(sess_id: str):
+    r = get_redis_async()
+    return (await r.smismember('maps:ready', sess_id))[0] > 0
 
 
 def get_uid_from_sess_id(sess_id: str):
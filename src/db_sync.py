@@ -0,0 +1,43 @@
+import asyncio
+import functools
+import threading
+import db
+
+# Blocking facade over the async data layer in db.py, for tests and maintenance scripts.
+# Calls are executed on a private event loop in a background thread, so it is safe to use
+# both from plain code and from inside an already running event loop (e.g. async tests).
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='db-sync', daemon=True).start()
+    return _loop
+
+
+def _blocking(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return asyncio.run_coroutine_threadsafe(func(*args, **kwargs), _get_loop()).result()
+    return wrapper
+
+
+get_or_create_session = _blocking(db.get_or_create_session)
+store_update = _blocking(db.store_update)
+get_sessions = _blocking(db.get_sessions)
+get_track_info = _blocking(db.get_track_info)
+set_sent_files = _blocking(db.set_sent_files)
+get_track_data = _blocking(db.get_track_data)
+get_track = _blocking(db.get_track)
+add_map_job = _blocking(db.add_map_job)
+acquire_map_job = _blocking(db.acquire_map_job)
+renew_map_job = _blocking(db.renew_map_job)
+finish_map_job = _blocking(db.finish_map_job)
+fail_map_job = _blocking(db.fail_map_job)
+release_map_job = _blocking(db.release_map_job)
+is_map_available = _blocking(db.is_map_available)
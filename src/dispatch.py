@@ -0,0 +1,91 @@
+import asyncio
+import contextlib
+import logging
+import telegram
+import telegram.ext
+
+# Concurrent processing of updates with the order of every live location kept.
+# Up to max_concurrent_updates updates are handled at once (python-telegram-bot's bounded semaphore);
+# updates of one live location (chat and message of the location) are handled one after another,
+# in the order they arrived, so edits of a session never reach the tracker out of order.
+# Stores of one session are serialized as well (ingest.store_now), whoever calls them: reading the session,
+# running the tracker and writing it back is never interleaved with another update of the same session.
+
+logger = logging.getLogger('geobot-dispatch')
+
+
+# asyncio.Lock per key, alive while someone holds or waits for it. Waiters get the lock in arrival order
+class KeyedLocks:
+    def __init__(self):
+        self.locks = {} # key -> [asyncio.Lock, number of holders and waiters]
+
+
+    async def acquire(self, key):
+        entry = self.locks.get(key)
+        if entry is None:
+            entry = [asyncio.Lock(), 0]
+            self.locks[key] = entry
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self.forget(key, entry)
+            raise
+
+
+    def release(self, key):
+        entry = self.locks[key]
+        entry[0].release()
+        self.forget(key, entry)
+
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+
+    def forget(self, key, entry):
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.locks[key]
+
+
+    def __len__(self):
+        return len(self.locks)
+
+
+# Key of the live location an update belongs to, None for other updates
+def get_update_key(update: object):
+    if not isinstance(update, telegram.Update):
+        return None
+    msg = update.edited_message if update.edited_message is not None else update.message
+    if msg is None or msg.location is None:
+        return None
+    return (msg.chat.id, msg.message_id)
+
+
+class SessionOrderedProcessor(telegram.ext.BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.session_locks = KeyedLocks()
+
+
+    async def do_process_update(self, update: object, coroutine):
+        key = get_update_key(update)
+        if key is None:
+            await coroutine
+            return
+        async with self.session_locks.hold(key):
+            await coroutine
+
+
+    async def initialize(self):
+        pass
+
+
+    async def shutdown(self):
+        pass
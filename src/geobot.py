@@ -1,26 +1,32 @@
 import os
 import math
+import asyncio
 import logging
 import time
 import datetime
 import telegram
 import telegram.ext
-from geopy import distance
 import const
-import gpx
 import base64
 import uuid
 
 import db
+import dispatch
+import gpxcache
+import gpxstream
+import ingest
+import logconf
 import maps
+import metrics
 
 import common
-import tracker
 
 
 logger = logging.getLogger('geobot-main')
+update_logger = logconf.SampledLogger(logger)
 
 
+@metrics.HANDLER_SECONDS.time('handler')
 async def cmd_message(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE):
     msg = None
     new_location = None
@@ -30,7 +36,8 @@ async def cmd_message(update: telegram.Update, context: telegram.ext.ContextType
         new_location = False
     elif update.message is not None and update.message.location is not None:
         if update.message.location.live_period is None:
-            logger.info(f'cmd_message. Static location received. Ignoring. chat_id={update.message.chat.id}, msg_id={update.message.message_id}, usr_id={update.message.from_user.id}')
+            update_logger.info('cmd_message. Static location received. Ignoring. chat_id=%s, msg_id=%s, usr_id=%s',
+                update.message.chat.id, update.message.message_id, update.message.from_user.id)
         else:
             msg = update.message
             new_location = True
@@ -38,27 +45,30 @@ async def cmd_message(update: telegram.Update, context: telegram.ext.ContextType
     if msg is None:
         return
 
-    logger.info(f'cmd_message. Location. new={new_location}, chat_id={msg.chat.id}, msg_id={msg.message_id}, usr_id={msg.from_user.id}, chat_type={msg.chat.type}, loc={msg.location}')
+    update_logger.info('cmd_message. Location. new=%s, chat_id=%s, msg_id=%s, usr_id=%s, chat_type=%s, lat=%s, long=%s',
+        new_location, msg.chat.id, msg.message_id, msg.from_user.id, msg.chat.type, msg.location.latitude, msg.location.longitude)
     dt = msg.edit_date if msg.edit_date is not None else msg.date
     common_ts = dt.timestamp() if dt else time.time()
-    sess_data = db.get_or_create_session(msg.from_user.id, msg.message_id, msg.chat, msg.location, common_ts)
-
-    sd = tracker.SessionData(sess_data)
-    points_to_write = tracker.PointsData()
-    tr = tracker.Tracker(sd, points_to_write)
-    tr.update(common.Point(msg.location.latitude, msg.location.longitude, common_ts), location_is_new=new_location)
-    for pnt in points_to_write.points:
-        db.store_location(sd, msg.from_user.id, pnt, common_ts)
-
-    if len(sd.get_updates()) > 0:
-        db.update_session(sd.id, sd.get_updates())
+    point = common.Point(msg.location.latitude, msg.location.longitude, common_ts)
+    stopped = not new_location and msg.location.live_period is None
+
+    if ingest.is_enabled():
+        # Regular edits are stored with the next batch; start and stop (and in webhook mode every update)
+        # are stored before the handler returns
+        sess_id = await ingest.get_ingestor().submit(msg.from_user.id, msg.message_id, msg.chat, point, new_location,
+            wait=new_location or stopped or context.bot_data.get('wait_stored', False))
+        if sess_id is None:
+            return
+        sess_id = await sess_id
+    else:
+        sess_id = await ingest.store_now(msg.from_user.id, msg.message_id, msg.chat, point, new_location)
 
     usr_name = update.effective_user.first_name if update.effective_user else 'User'
     if new_location:
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f'{usr_name} started location recording.')
-    elif msg.location.live_period is None:
+    elif stopped:
         logger.info(f'cmd_message. Translation stopped. chat_id={msg.chat.id}, msg_id={msg.message_id}, usr_id={msg.from_user.id}')
-        db.add_map_job(sess_data['id'])
+        await db.add_map_job(sess_id)
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f'{usr_name} stopped location recording.')
 
 
@@ -76,31 +86,22 @@ def duration_to_human(dur: float):
 
 
 def create_gpx_data(segments):
-    gpx_inst = gpx.GPX()
-    gpx_inst.name = 'Telegram GPS track'
-    gpx_inst.creator='Geograph'
-    gpx_inst.descr = 'This GPX file was created by Geograph Telegram Bot'
-    gpx_inst.tracks.append(gpx.track.Track())
-
-    for segm_points in segments:
-        gpx_inst.tracks[0].segments.append(gpx.track_segment.TrackSegment())
-        segment = gpx_inst.tracks[0].segments[-1]
-        for pnt in segm_points:
-            wp = gpx.Waypoint()
-            wp.lat = pnt.latitude
-            wp.lon = pnt.longitude
-            wp.time = datetime.datetime.fromtimestamp(pnt.ts)
-            segment.append(wp)
-    
-    return gpx_inst.to_string()
+    return ''.join(gpxstream.iter_gpx(gpxstream.segments_to_records(segments)))
+
+
+# GPX document of the track revision, generated on the first request
+async def get_gpx_file(sess_id: str, rev: int, compress: bool):
+    gpx_file = await asyncio.to_thread(gpxcache.open_gpx, sess_id, rev, compress)
+    if gpx_file is not None:
+        return gpx_file
+    info, packed = await db.get_track_data(sess_id)
+    return await asyncio.to_thread(gpxcache.create_gpx, sess_id, info.rev, packed, compress)
 
 
 async def output_track_to_chat(sess_id: str, update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE):
     logger.info(f'output_track_to_chat. sess_id={sess_id}')
 
-    info, segments = db.get_track(sess_id)
-
-    gpx_data = create_gpx_data(segments)
+    info, sent_files = await db.get_track_info(sess_id)
 
     sess_len = info.length / 1000.0
     sess_dur = info.duration
@@ -111,18 +112,46 @@ async def output_track_to_chat(sess_id: str, update: telegram.Update, context: t
         f'Length {sess_len:.1f} km, duration {duration_to_human(sess_dur)}\n' \
         f'Link to share this track: {form_deep_link(sess_id)}'
     
-    get_map_res = maps.get_map(sess_id)
-    if get_map_res is not None:
-        map_file_data, map_filename = get_map_res
-        map_file = telegram.InputFile(map_file_data, map_filename)
-        await context.bot.send_photo(update.effective_chat.id, map_file, caption=descr)
-    else:
-        await context.bot.send_message(chat_id = update.effective_chat.id, text=descr)
+    if not await resend_file(context.bot.send_photo, update.effective_chat.id, sent_files.map_file_id, caption=descr):
+        get_map_res = await maps.get_map(sess_id)
+        if get_map_res is not None:
+            map_file_data, map_filename = get_map_res
+            map_file = telegram.InputFile(map_file_data, map_filename)
+            sent = await context.bot.send_photo(update.effective_chat.id, map_file, caption=descr)
+            if isinstance(sent, telegram.Message) and sent.photo:
+                await db.set_sent_files(sess_id, map_file_id=sent.photo[-1].file_id)
+        else:
+            await context.bot.send_message(chat_id = update.effective_chat.id, text=descr)
 
     sess_tm = datetime.datetime.fromtimestamp(info.timestamp)
     file_name = f'TelegramTrack_{sess_tm.year}{sess_tm.month:02}{sess_tm.day:02}_{sess_tm.hour:02}{sess_tm.minute:02}.gpx'
-    gpx_file = telegram.InputFile(gpx_data, file_name)
-    await context.bot.send_document(update.effective_chat.id, gpx_file)
+    compress = os.environ.get('GPX_GZIP', '0') == '1'
+    gpx_file_ver = f'{info.rev}.gz' if compress else str(info.rev)
+    gpx_file_id = sent_files.gpx_file_id if sent_files.gpx_file_ver == gpx_file_ver else None
+    if await resend_file(context.bot.send_document, update.effective_chat.id, gpx_file_id):
+        return
+
+    gpx_file = await get_gpx_file(sess_id, info.rev, compress)
+    if compress:
+        file_name += '.gz'
+    with gpx_file:
+        # The file is streamed to Telegram from disk, not read into memory
+        sent = await context.bot.send_document(update.effective_chat.id,
+            telegram.InputFile(gpx_file, file_name, read_file_handle=False))
+    if isinstance(sent, telegram.Message) and sent.document is not None:
+        await db.set_sent_files(sess_id, gpx_file_id=sent.document.file_id, gpx_file_ver=gpx_file_ver)
+
+
+# Sends a file uploaded before by its Telegram file_id. Returns False if there is no file_id or it is not valid anymore
+async def resend_file(send_func, chat_id, file_id, **kwargs):
+    if file_id is None:
+        return False
+    try:
+        await send_func(chat_id, file_id, **kwargs)
+        return True
+    except telegram.error.BadRequest as err:
+        logger.warning(f'resend_file. file_id rejected, uploading again. chat_id={chat_id}, err={err}')
+        return False
 
 
 def parse_deep_link(args):
@@ -150,16 +179,16 @@ async def sessions_menu_item(sess_id: str, update: telegram.Update, context: tel
     await output_track_to_chat(sess_id, update, context)
 
 
-def sessions_menu_create(usr_id: int, offset: int, page: int):
+async def sessions_menu_create(usr_id: int, offset: int, page: int):
     logger.info(f'sessions_menu_create. offset={offset}, page={page}')
 
-    sessions, sess_total = db.get_sessions(usr_id, offset, page, False)
+    sessions, sess_total = await db.get_sessions(usr_id, offset, page)
 
     keyboard = []
     for sess in sessions:
         length = sess.length / 1000.0
         age = time.time() - sess.timestamp
-        descr = f'{duration_to_human(age)} ago, {length:.1f} km'
+        descr = f'{duration_to_human(age)} ago, {length:.1f} km, {sess.points_num} points'
         keyboard.append([telegram.InlineKeyboardButton(descr, callback_data=f'session_menu_item {sess.id}')])
 
     navig_butts = []
@@ -173,6 +202,7 @@ def sessions_menu_create(usr_id: int, offset: int, page: int):
     return (f'Records from {offset} to {min(offset + page, sess_total)} of {sess_total}', telegram.InlineKeyboardMarkup(keyboard))
 
 
+@metrics.HANDLER_SECONDS.time('handler')
 async def cmd_start(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE):
     usr_id = update.effective_user.id
     logger.info(f'cmd_start. usr_id={usr_id}, args={context.args}')
@@ -189,23 +219,26 @@ async def cmd_start(update: telegram.Update, context: telegram.ext.ContextTypes.
         await update.message.reply_text(f'Welcome to GeoGraph bot. Share your location to start recording.')
 
 
+@metrics.HANDLER_SECONDS.time('handler')
 async def cmd_tracks(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE):
     usr_id = update.effective_user.id
     logger.info(f'cmd_tracks. usr_id={usr_id}')
-    menu_text, menu = sessions_menu_create(usr_id, 0, 5)
+    menu_text, menu = await sessions_menu_create(usr_id, 0, 5)
     await update.message.reply_text(menu_text, reply_markup=menu)
 
 
 bot_start_time = time.monotonic()
+@metrics.HANDLER_SECONDS.time('handler')
 async def cmd_debug_ping(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE):
     uptime = time.monotonic() - bot_start_time
     await context.bot.send_message(chat_id=update.effective_chat.id, text=f'Bot is alive! Uptime is {uptime / 3600.0:.1f} hours')
 
 
+@metrics.HANDLER_SECONDS.time('handler')
 async def cmd_debug_tracks(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE):
     usr_id = update.effective_user.id
     logger.info(f'cmd_debug_tracks. usr_id={usr_id}')
-    sessions, sess_total = db.get_sessions(usr_id, 0, 10, True)
+    sessions, sess_total = await db.get_sessions(usr_id, 0, 10)
 
     lines = [f'Hello {update.effective_user.first_name} here is your last tracks:\n(You have {sess_total} total tracks)\n\n']
     for sess in sessions:
@@ -215,6 +248,7 @@ async def cmd_debug_tracks(update: telegram.Update, context: telegram.ext.Contex
     await context.bot.send_message(chat_id=update.effective_chat.id, text=''.join(lines))
 
 
+@metrics.HANDLER_SECONDS.time('handler')
 async def cmd_button(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
 
@@ -229,7 +263,7 @@ async def cmd_button(update: telegram.Update, context: telegram.ext.ContextTypes
     elif data[0] == 'session_menu':
         usr_id = update.effective_user.id
         logger.info(f'cmd_button. session_menu. usr_id={usr_id}')
-        menu_text, menu = sessions_menu_create(usr_id, int(data[1]), int(data[2]))
+        menu_text, menu = await sessions_menu_create(usr_id, int(data[1]), int(data[2]))
         await query.edit_message_text(text=menu_text, reply_markup=menu)
     elif data[0] == 'session_cancel':
         await context.bot.deleteMessage(message_id=update.effective_message.id, chat_id=update.effective_chat.id)
@@ -238,20 +272,21 @@ async def cmd_button(update: telegram.Update, context: telegram.ext.ContextTypes
 
 
 async def maps_generation_job(context: telegram.ext.CallbackContext):
-    await maps.try_create_map()
+    await maps.process_map_jobs()
 
 
-def mainloop():
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.INFO
-    )
+async def post_shutdown(application: telegram.ext.Application):
+    await ingest.shutdown()
+    maps.shutdown_executor()
+    await db.close_redis_async()
 
-    const.setup()
-
-    db.setup_redis()
 
-    application = telegram.ext.ApplicationBuilder().token(const.BOT_TOKEN).build()
+# concurrent_updates > 1 processes updates concurrently, keeping the order of each live location
+def create_application(token: str, concurrent_updates: int = 1):
+    builder = telegram.ext.ApplicationBuilder().token(token).post_shutdown(post_shutdown)
+    if concurrent_updates > 1:
+        builder = builder.concurrent_updates(dispatch.SessionOrderedProcessor(concurrent_updates))
+    application = builder.build()
 
     application.add_handler(telegram.ext.CommandHandler('start', cmd_start))
     application.add_handler(telegram.ext.CommandHandler('tracks', cmd_tracks))
@@ -260,9 +295,33 @@ def mainloop():
     application.add_handler(telegram.ext.CallbackQueryHandler(cmd_button))
     application.add_handler(telegram.ext.MessageHandler(telegram.ext.filters.LOCATION & (~telegram.ext.filters.COMMAND), cmd_message))
 
-    application.job_queue.run_repeating(maps_generation_job, 10.0)
+    # With MAPS_IN_BOT=0 maps are rendered by separate maps_worker processes, the bot only queues jobs
+    if os.environ.get('MAPS_IN_BOT', '1') != '0':
+        application.job_queue.run_repeating(maps_generation_job, 10.0)
 
-    application.run_polling()
+    return application
+
+
+def mainloop():
+    logconf.setup()
+
+    const.setup()
+
+    db.setup_redis()
+    metrics.start_server()
+
+    # With WEBHOOK_URL set Telegram posts updates to the bot, see webhook.py
+    webhook_url = os.environ.get('WEBHOOK_URL')
+    try:
+        if webhook_url:
+            import webhook
+            concurrent_updates = int(os.environ.get('CONCURRENT_UPDATES', const.DEFAULT_CONCURRENT_UPDATES))
+            webhook.run(create_application(const.BOT_TOKEN, concurrent_updates), webhook_url)
+        else:
+            application = create_application(const.BOT_TOKEN)
+            application.run_polling()
+    finally:
+        logconf.shutdown()
 
 
 if __name__ == '__main__':
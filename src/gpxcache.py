@@ -0,0 +1,118 @@
+import os
+import glob
+import uuid
+import logging
+import const
+import db
+import gpxstream
+import metrics
+
+# On-disk cache of generated GPX documents: {dir}/track-{uid}-{rev}.gpx[.gz].
+# A file is valid for one track revision (session field 'rev'), so documents of finished sessions
+# are generated once, and any change of the track makes the next request generate a new one.
+# File modification time is the last use time; least recently used documents are evicted when the cache
+# grows over its size limit (GPX_CACHE_MAX_MB). The directory may be shared by several bot processes.
+# Functions do blocking file IO, call them in a thread.
+
+logger = logging.getLogger('geobot-gpxcache')
+
+
+def get_dir():
+    return os.environ.get('GPX_CACHE_DIR', const.DEFAULT_GPX_CACHE_DIR)
+
+
+def get_filename(sess_id: str, rev: int, compress: bool):
+    uid = db.get_uid_from_sess_id(sess_id)
+    return os.path.join(get_dir(), f'track-{uid}-{rev}.gpx' + ('.gz' if compress else ''))
+
+
+def get_max_bytes():
+    return int(float(os.environ.get('GPX_CACHE_MAX_MB', const.DEFAULT_GPX_CACHE_MAX_MB)) * 1024 * 1024)
+
+
+# Returns the cached document opened for reading, or None
+def open_gpx(sess_id: str, rev: int, compress: bool):
+    fname = get_filename(sess_id, rev, compress)
+    try:
+        f = open(fname, 'rb')
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(fname)
+    except FileNotFoundError:
+        pass # evicted by another process; the open file is still readable
+    return f
+
+
+# Generates the document of the track revision, stores it and returns it opened for reading
+def create_gpx(sess_id: str, rev: int, packed: bytes, compress: bool):
+    fname = get_filename(sess_id, rev, compress)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    # Concurrent requests may generate the same document; readers must never see a partial file
+    tmp_fname = f'{fname}.{uuid.uuid4().hex}.tmp'
+    try:
+        with metrics.GPX_SECONDS.timer(compressed=compress), open(tmp_fname, 'wb') as f:
+            gpxstream.write_gpx(f, db.POINT_RECORD.iter_unpack(packed), compress)
+        os.replace(tmp_fname, fname)
+    except Exception:
+        try:
+            os.remove(tmp_fname)
+        except FileNotFoundError:
+            pass
+        raise
+    logger.info(f'create_gpx. sess_id={sess_id}, rev={rev}, filename={fname}')
+
+    # Opened before the eviction, which may remove the new document too if it alone is over the limit
+    f = open(fname, 'rb')
+    remove_old_revisions(sess_id, rev)
+    evict(get_max_bytes())
+    return f
+
+
+def remove_old_revisions(sess_id: str, rev: int):
+    uid = db.get_uid_from_sess_id(sess_id)
+    for fname in glob.glob(os.path.join(get_dir(), f'track-{uid}-*.gpx*')):
+        if fname.endswith('.tmp'):
+            continue
+        file_rev = os.path.basename(fname).rsplit('-', 1)[1].split('.', 1)[0]
+        # Newer revisions may have just been cached by a concurrent request
+        if int(file_rev) < rev:
+            try:
+                os.remove(fname)
+            except FileNotFoundError:
+                pass
+
+
+def list_files():
+    files = []
+    with os.scandir(get_dir()) as entries:
+        for entry in entries:
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue # evicted by another process
+            files.append((entry.path, st.st_mtime, st.st_size))
+    return files
+
+
+# Removes least recently used documents until the cache takes 90% of its limit, if it is over the limit
+def evict(max_bytes: int):
+    files = list_files()
+    size = sum(file_size for _, _, file_size in files)
+    if size <= max_bytes:
+        return
+    files.sort(key=lambda item: item[1])
+    target = max_bytes * 0.9
+    removed = 0
+    for fname, _, file_size in files:
+        if size <= target:
+            break
+        try:
+            os.remove(fname)
+        except FileNotFoundError:
+            pass
+        size -= file_size
+        removed += 1
+    logger.info(f'evict. removed={removed}, size={size}')
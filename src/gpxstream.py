@@ -0,0 +1,56 @@
+import gzip
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+# Streaming GPX 1.1 writer: the document is produced in chunks straight from point records,
+# without building an object tree or the whole document in memory.
+# Records are (lat, lon, ts, segm_id) tuples, e.g. db.POINT_RECORD.iter_unpack(packed);
+# a new track segment starts whenever segm_id changes.
+
+CREATOR = 'Geograph'
+NAME = 'Telegram GPS track'
+DESCRIPTION = 'This GPX file was created by Geograph Telegram Bot'
+CHUNK_POINTS = 1000
+
+
+def format_time(ts: float):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(round(ts)))
+
+
+def iter_gpx(records, name: str = NAME, description: str = DESCRIPTION):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<gpx version="1.1" creator={quoteattr(CREATOR)} xmlns="http://www.topografix.com/GPX/1/1">\n'
+        f'  <metadata>\n    <name>{escape(name)}</name>\n    <desc>{escape(description)}</desc>\n  </metadata>\n'
+        '  <trk>\n')
+
+    chunk = []
+    last_segm_id = None
+    for lat, lon, ts, segm_id in records:
+        if segm_id != last_segm_id:
+            if last_segm_id is not None:
+                chunk.append('    </trkseg>\n')
+            chunk.append('    <trkseg>\n')
+            last_segm_id = segm_id
+        chunk.append(f'      <trkpt lat="{lat:.7f}" lon="{lon:.7f}"><time>{format_time(ts)}</time></trkpt>\n')
+        if len(chunk) >= CHUNK_POINTS:
+            yield ''.join(chunk)
+            chunk = []
+    if last_segm_id is not None:
+        chunk.append('    </trkseg>\n')
+    chunk.append('  </trk>\n</gpx>\n')
+    yield ''.join(chunk)
+
+
+# Writes the document into a binary file object; with compress=True it is gzipped
+def write_gpx(fileobj, records, compress: bool = False):
+    out = gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=6, mtime=0) if compress else fileobj
+    for chunk in iter_gpx(records):
+        out.write(chunk.encode('utf-8'))
+    if compress:
+        out.close() # writes the gzip trailer, fileobj stays open
+
+
+def segments_to_records(segments):
+    for segm_id, points in enumerate(segments, 1):
+        for pnt in points:
+            yield pnt.latitude, pnt.longitude, pnt.ts, segm_id
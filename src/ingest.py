@@ -0,0 +1,281 @@
+import os
+import asyncio
+import logging
+import const
+import common
+import db
+import metrics
+import dispatch
+import logconf
+import tracker
+import sesscache
+
+# Ingestion buffer of location updates. Updates are collected per live location (session) for up to
+# INGEST_WINDOW_MS, or until INGEST_MAX_BATCH updates are pending, and then flushed together:
+# sessions are read in one pipeline, tracker.Tracker runs over all updates of each session,
+# and the new points and session fields of all sessions are written in one pipeline.
+# A longer window means fewer Redis writes per update and a later visible track.
+# The buffer is off by default (INGEST_WINDOW_MS=0): every update is written by its handler right away (store_now).
+# With the buffer on, regular edits are acknowledged before they are stored.
+# The buffer is bounded: while a flush is running and INGEST_MAX_BATCH updates are pending, submit() waits
+# for the flush to end, so a slow Redis slows down the handlers instead of growing the buffer.
+# A batch that fails to store is put back ahead of the updates queued meanwhile and retried with a growing
+# delay; updates of a session are dropped only after INGEST_FLUSH_ATTEMPTS failed flushes
+# (counted by geobot_ingest_dropped_updates_total). A failed flush may have been stored in part or entirely
+# (e.g. the pipeline reply is lost), so a retry skips the updates the stored session already has.
+
+logger = logging.getLogger('geobot-ingest')
+update_logger = logconf.SampledLogger(logger)
+
+DROPPED_UPDATES = metrics.Counter('geobot_ingest_dropped_updates_total',
+    'Buffered location updates dropped after INGEST_FLUSH_ATTEMPTS failed writes')
+
+ingestor = None
+session_locks = dispatch.KeyedLocks() # live key -> lock of store_now calls
+
+
+class PendingSession:
+    def __init__(self, usr_id, msg_id, tg_chat):
+        self.usr_id = usr_id
+        self.msg_id = msg_id
+        self.tg_chat = tg_chat
+        self.updates = [] # (common.Point, location_is_new)
+        self.waiters = [] # futures of submit(wait=True) calls, resolved with the session id
+        self.attempts = 0 # failed flushes of these updates
+
+
+class Ingestor:
+    def __init__(self, window: float, max_batch: int):
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = {} # live key -> PendingSession
+        self.pending_updates = 0
+        self.flush_timer = None
+        self.flush_task = None
+        self.flush_lock = asyncio.Lock() # flushes run one after another, keeping the order of updates
+        self.flush_done = asyncio.Condition() # notified when a flush ends
+        self.failures = 0 # failed flushes in a row; a retry is scheduled while it is not 0
+
+
+    # Queues an update, waiting first while the buffer is full. With wait=True returns a future resolved
+    # with the session id once the update is stored; the batch is flushed without waiting for the window then
+    async def submit(self, usr_id, msg_id, tg_chat, point: common.Point, location_is_new: bool, wait: bool = False):
+        if self.is_full():
+            async with self.flush_done:
+                await self.flush_done.wait_for(lambda: not self.is_full())
+
+        live_key = db.get_live_key(usr_id, tg_chat.id, msg_id)
+        pending = self.pending.get(live_key)
+        if pending is None:
+            pending = PendingSession(usr_id, msg_id, tg_chat)
+            self.pending[live_key] = pending
+        pending.updates.append((point, location_is_new))
+        self.pending_updates += 1
+
+        future = None
+        if wait:
+            future = asyncio.get_running_loop().create_future()
+            pending.waiters.append(future)
+
+        if self.failures > 0:
+            pass # stored with the retry
+        elif wait or self.pending_updates >= self.max_batch:
+            self.schedule_flush(0.0)
+        elif self.flush_timer is None:
+            self.schedule_flush(self.window)
+        return future
+
+
+    # The buffer is full when it has max_batch updates and they cannot be flushed right away
+    def is_full(self):
+        return self.pending_updates >= self.max_batch and (self.flush_lock.locked() or self.failures > 0)
+
+
+    def schedule_flush(self, delay: float):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+        self.flush_timer = asyncio.get_running_loop().call_later(delay, self.start_flush)
+
+
+    def start_flush(self):
+        self.flush_timer = None
+        self.flush_task = asyncio.create_task(self.flush())
+
+
+    async def flush(self):
+        try:
+            await self.flush_batch()
+        finally:
+            async with self.flush_done:
+                self.flush_done.notify_all()
+
+
+    async def flush_batch(self):
+        async with self.flush_lock:
+            batch = self.pending
+            self.pending = {}
+            self.pending_updates = 0
+            if len(batch) == 0:
+                return
+            try:
+                sess_ids = await store_batch(batch)
+            except Exception as err:
+                self.requeue(batch, err)
+                return
+            self.failures = 0
+            for pending, sess_id in zip(batch.values(), sess_ids):
+                for future in pending.waiters:
+                    if not future.done():
+                        future.set_result(sess_id)
+
+
+    # Puts a batch that failed to store back into the buffer, ahead of the updates queued meanwhile,
+    # and schedules a retry. Updates failed INGEST_FLUSH_ATTEMPTS times are dropped
+    def requeue(self, batch: dict, err: Exception):
+        self.failures += 1
+        requeued = {}
+        dropped = 0
+        for live_key, pending in batch.items():
+            pending.attempts += 1
+            if pending.attempts >= const.INGEST_FLUSH_ATTEMPTS:
+                dropped += len(pending.updates)
+                for future in pending.waiters:
+                    if not future.done():
+                        future.set_exception(err)
+                continue
+            newer = self.pending.pop(live_key, None)
+            if newer is not None:
+                pending.updates += newer.updates
+                pending.waiters += newer.waiters
+            requeued[live_key] = pending
+            # the cached session is stale if the batch was stored after all
+            sesscache.get_session_cache().remove(live_key)
+        requeued.update(self.pending)
+        self.pending = requeued
+        self.pending_updates = sum(len(pending.updates) for pending in requeued.values())
+
+        if dropped > 0:
+            logger.exception(f'flush. Updates are dropped. sessions={len(batch)}, dropped={dropped}')
+            DROPPED_UPDATES.inc(dropped)
+        else:
+            logger.warning(f'flush. Batch is not stored, retrying. sessions={len(batch)}, failures={self.failures}, err={err!r}')
+        if len(self.pending) > 0:
+            self.schedule_flush(self.get_retry_delay())
+        else:
+            self.failures = 0
+
+
+    def get_retry_delay(self):
+        attempts = max((pending.attempts for pending in self.pending.values()), default=1)
+        return const.INGEST_RETRY_DELAY * 2 ** max(attempts - 1, 0)
+
+
+    # Stores everything pending, e.g. on shutdown; failed flushes are retried until the updates are dropped
+    async def close(self):
+        while True:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            await self.flush()
+            if len(self.pending) == 0:
+                break
+            await asyncio.sleep(self.get_retry_delay())
+
+
+# Stores the updates of a batch; returns the session ids in the batch order.
+# Sessions are written with the version they were read (or cached) with; the ones changed meanwhile,
+# e.g. by another bot instance, are read again and their updates are applied once more.
+# The last attempt writes regardless of the version
+async def store_batch(batch: dict):
+    sess_ids = {}
+    todo = batch
+    for attempt in range(1, const.SESSION_STORE_ATTEMPTS + 1):
+        todo = await store_sessions(todo, sess_ids, check_version=attempt < const.SESSION_STORE_ATTEMPTS)
+        if len(todo) == 0:
+            break
+        logger.warning(f'store_batch. Sessions changed concurrently. sessions={len(todo)}, attempt={attempt}')
+    return [sess_ids[live_key] for live_key in batch.keys()]
+
+
+# Returns the part of the batch not stored because of version conflicts
+async def store_sessions(batch: dict, sess_ids: dict, check_version: bool):
+    live_keys = list(batch.keys())
+    sessions = await db.get_live_sessions(live_keys)
+
+    pipe = db.get_redis_async().pipeline(transaction=False)
+    stored = [] # (live key, session data, number of points) of the queued writes
+    total_updates = 0
+    for live_key, pending, sess_data in zip(live_keys, batch.values(), sessions):
+        if sess_data is None:
+            point = pending.updates[0][0]
+            sess_data = await db.get_or_create_session(pending.usr_id, pending.msg_id, pending.tg_chat, point, point.ts)
+
+        sd = tracker.SessionData(sess_data)
+        points = tracker.PointsData()
+        tr = tracker.Tracker(sd, points)
+        records = []
+        for point, location_is_new in pending.updates:
+            if pending.attempts > 0 and is_stored(sd, point, location_is_new):
+                continue
+            stored_points = len(points.points)
+            tr.update(point, location_is_new=location_is_new)
+            # segment id at the time the point is stored, as in db.store_update
+            records += [(pnt.latitude, pnt.longitude, pnt.ts, sd.track_segm_idx) for pnt in points.points[stored_points:]]
+        if await db.store_records(sd, records, client=pipe, check_version=check_version) is not None:
+            stored.append((live_key, sd, len(records)))
+        sess_ids[live_key] = sd.id
+        total_updates += len(pending.updates)
+
+    conflicts = {}
+    if len(stored) > 0:
+        with metrics.REDIS_SECONDS.timer(function='store_records'):
+            versions = await pipe.execute()
+        for (live_key, sd, points_num), ver in zip(stored, versions):
+            if not db.cache_stored_session(live_key, sd, points_num, ver):
+                conflicts[live_key] = batch[live_key]
+    update_logger.info('store_sessions. sessions=%s, updates=%s, conflicts=%s', len(batch), total_updates, len(conflicts))
+    return conflicts
+
+
+# Whether the stored session already has an update of a retried batch. Updates of a session are stored
+# in time order, and the tracker moves last_update to the time of every update that changes the session
+def is_stored(sd: tracker.SessionData, point: common.Point, location_is_new: bool):
+    if location_is_new:
+        # the session is created with last_update of its first point, which is stored with the batch
+        return getattr(sd, 'points_num', 0) > 0
+    return point.ts <= sd.last_update
+
+
+# Stores a single update right away, without the buffer; returns the session id.
+# Concurrent calls for one session run one after another, in the order they were made
+async def store_now(usr_id, msg_id, tg_chat, point: common.Point, location_is_new: bool):
+    live_key = db.get_live_key(usr_id, tg_chat.id, msg_id)
+    pending = PendingSession(usr_id, msg_id, tg_chat)
+    pending.updates.append((point, location_is_new))
+    async with session_locks.hold(live_key):
+        sess_ids = await store_batch({live_key: pending})
+    return sess_ids[0]
+
+
+def get_window():
+    return float(os.environ.get('INGEST_WINDOW_MS', const.DEFAULT_INGEST_WINDOW_MS)) / 1000.0
+
+
+def is_enabled():
+    return get_window() > 0
+
+
+def get_ingestor():
+    global ingestor
+    if ingestor is None:
+        max_batch = int(os.environ.get('INGEST_MAX_BATCH', const.DEFAULT_INGEST_MAX_BATCH))
+        logger.info(f'get_ingestor. window={get_window()}, max_batch={max_batch}')
+        ingestor = Ingestor(get_window(), max_batch)
+    return ingestor
+
+
+async def shutdown():
+    global ingestor
+    if ingestor is not None:
+        await ingestor.close()
+        ingestor = None
@@ -0,0 +1,79 @@
+import os
+import logging
+import logging.handlers
+import queue
+import const
+
+# Logging of the bot and maps workers. Loggers put records on a queue (QueueHandler) and a listener thread
+# formats and writes them (QueueListener), so handlers on the event loop never wait for the console or disk.
+# LOG_LEVEL sets the level, INFO by default.
+# Lines logged for every location update are sampled: they are logged through SampledLogger, and with
+# LOG_SAMPLE=N only every N-th of them is written. Their arguments are formatted lazily, by the listener
+# thread, so passing them must not be more expensive than the formatting saved: plain numbers and strings.
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+sample_every = 1 # LOG_SAMPLE; every line is logged until setup()
+listener = None
+queue_handler = None
+
+
+# Leaves the formatting to the listener thread; the standard QueueHandler formats the message in the caller
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+# Logger of per-update lines: writes every sample_every-th line, records of the others are not even created
+class SampledLogger:
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+        self.count = 0
+
+
+    def sample(self, level: int):
+        if not self.logger.isEnabledFor(level):
+            return False
+        self.count += 1
+        return self.count % sample_every == 0
+
+
+    def debug(self, msg, *args):
+        if self.sample(logging.DEBUG):
+            self.logger.debug(msg, *args, stacklevel=2)
+
+
+    def info(self, msg, *args):
+        if self.sample(logging.INFO):
+            self.logger.info(msg, *args, stacklevel=2)
+
+
+def setup(level: str = None, sample: int = None, stream=None):
+    global sample_every, listener, queue_handler
+    shutdown()
+    level = level if level is not None else os.environ.get('LOG_LEVEL', const.DEFAULT_LOG_LEVEL)
+    sample_every = max(sample if sample is not None else int(os.environ.get('LOG_SAMPLE', const.DEFAULT_LOG_SAMPLE)), 1)
+
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    queue_handler = DeferredQueueHandler(records)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+
+# Writes the queued records and stops the listener thread; nothing is logged after that
+def shutdown():
+    global listener, queue_handler
+    if queue_handler is not None:
+        logging.getLogger().removeHandler(queue_handler)
+        queue_handler = None
+    if listener is not None:
+        listener.stop()
+        listener = None
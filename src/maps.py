@@ -1,14 +1,20 @@
 import os
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
 import logging
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-import cartopy.io.img_tiles as cimgt
+import multiprocessing
+from collections import namedtuple
 import const
 import db
+import metrics
 
 
 logger = logging.getLogger('geobot-maps')
 
+executor = None # map rendering processes
+
+
 def get_filename(sess_id: str):
     base = os.environ.get('MAP_IMAGES_DIR', const.DEFAULT_BASE_DIR)
 
@@ -18,36 +24,111 @@ def get_filename(sess_id: str):
     return os.path.join(base, fname)
 
 
+def get_executor():
+    global executor
+    if executor is None:
+        workers = int(os.environ.get('MAP_WORKERS', const.DEFAULT_MAP_WORKERS))
+        logger.info(f'get_executor. workers={workers}')
+        # spawn: the bot process runs threads, forking it is not safe
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'))
+    return executor
+
+
+def shutdown_executor():
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+        executor = None
+
+
+# A pool one of whose processes has died (e.g. killed by the OOM killer during a render) fails every job
+# from then on; it is dropped, and get_executor() starts a new one. Jobs running in other pools are kept
+def discard_executor(pool: concurrent.futures.ProcessPoolExecutor):
+    global executor
+    if executor is pool:
+        logger.warning('discard_executor. Map rendering processes are broken, starting new ones')
+        executor = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Renders maps until the queue is empty, as many at a time as there are worker processes
+async def process_map_jobs():
+    workers = int(os.environ.get('MAP_WORKERS', const.DEFAULT_MAP_WORKERS))
+    await asyncio.gather(*(drain_map_jobs() for _ in range(workers)))
+
+
+async def drain_map_jobs():
+    while await try_create_map():
+        pass
+
+
+# Returns False if there was no job to take. The job lease is renewed while the map is rendered
 async def try_create_map():
     logger.info(f'try_create_map.')
-    sess_id = db.acquire_map_job()
-    if sess_id is None:
-        return
-    
-    logger.info(f'try_create_map. Creating map for track. sess_id={sess_id}')
-    track_info, segments = db.get_track(sess_id)
+    job = await db.acquire_map_job()
+    if job is None:
+        return False
+
+    renewal = asyncio.create_task(renew_lease(job))
+    try:
+        await create_map(job.sess_id)
+    except concurrent.futures.process.BrokenProcessPool:
+        # not the job's fault: it is rendered again later, by new processes
+        logger.exception(f'try_create_map. Map rendering processes are broken. sess_id={job.sess_id}')
+        await db.release_map_job(job)
+        return True
+    except Exception:
+        logger.exception(f'try_create_map. Map generation failed. sess_id={job.sess_id}')
+        await db.fail_map_job(job)
+        return True
+    finally:
+        renewal.cancel()
+    await db.finish_map_job(job)
+    return True
+
+
+# Renews the lease of a job every third of the lease time, until cancelled or the lease is lost
+async def renew_lease(job: db.MapJob):
+    interval = db.get_map_job_lease_time() / 3
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if not await db.renew_map_job(job):
+                return
+        except Exception:
+            logger.exception(f'renew_lease. Lease is not renewed. sess_id={job.sess_id}')
+
+
+async def create_map(sess_id: str):
+    logger.info(f'create_map. Creating map for track. sess_id={sess_id}')
+    track_info, packed = await db.get_track_data(sess_id)
     if track_info.points_total < const.MIN_POINTS_FOR_MAP:
-        db.finish_map_job(sess_id)
         return
 
-    base_path = os.environ.get('MAP_IMAGES_DIR', const.DEFAULT_BASE_DIR)
-    os.makedirs(base_path, exist_ok=True)
-
-    tiler = cimgt.OSM()
-    mercator = tiler.crs
-
-    lon_min = None
-    lon_max = None
-    lat_min = None
-    lat_max = None
-    for points in segments:
-        for pnt in points:
-            lat = float(pnt.lat)
-            lon = float(pnt.lon)
-            lon_min = lon if lon_min is None else min(lon_min, lon)
-            lon_max = lon if lon_max is None else max(lon_max, lon)
-            lat_min = lat if lat_min is None else min(lat_min, lat)
-            lat_max = lat if lat_max is None else max(lat_max, lat)
+    fname = get_filename(sess_id)
+    loop = asyncio.get_running_loop()
+    # The packed track is the cheapest form to pass to another process; it is decoded there
+    pool = get_executor()
+    with metrics.MAP_RENDER_SECONDS.timer(renderer=os.environ.get('MAP_RENDERER', const.DEFAULT_MAP_RENDERER)):
+        try:
+            await loop.run_in_executor(pool, render_map, packed, fname)
+        except concurrent.futures.process.BrokenProcessPool:
+            discard_executor(pool)
+            raise
+    logger.info(f'create_map. saved. sess_id={sess_id}, filename={fname}')
+
+
+# Map area of the track: bounding box enlarged to the minimal map size plus margins.
+# lat_delta/lon_delta are the angular sizes of the track itself
+MapArea = namedtuple('MapArea', ['lat_min', 'lat_max', 'lon_min', 'lon_max', 'lat_delta', 'lon_delta'])
+
+
+def get_map_area(track):
+    lat_min = float(track.lat.min())
+    lat_max = float(track.lat.max())
+    lon_min = float(track.lon.min())
+    lon_max = float(track.lon.max())
 
     lat_delta = lat_max - lat_min
     lon_delta = lon_max - lon_min
@@ -60,20 +141,6 @@ async def try_create_map():
         lon_min = mid - 0.5 * const.MIN_ANGULAR_SIZE_FOR_MAP
         lon_max = mid + 0.5 * const.MIN_ANGULAR_SIZE_FOR_MAP
 
-    aspect = 1.0
-    aspect = lon_delta / lat_delta
-    aspect = max(aspect, 0.33)
-    aspect = min(aspect, 3.0)
-
-    BASE_FIG_SIZE = 10.0
-    fig_size = None
-    if aspect > 1.0:
-        fig_size = (BASE_FIG_SIZE, BASE_FIG_SIZE / aspect)
-    else:
-        fig_size = (BASE_FIG_SIZE * aspect, BASE_FIG_SIZE)
-    fig = plt.figure(figsize=fig_size, frameon=False)
-    ax = plt.axes(projection=mercator)
-
     MARGIN = 0.04
     lon_sz = lon_max - lon_min
     lat_sz = lat_max - lat_min
@@ -82,34 +149,36 @@ async def try_create_map():
     lat_min -= lat_sz * MARGIN
     lat_max += lat_sz * MARGIN
 
-    ax.set_extent([lon_min, lon_max, lat_min, lat_max], crs=ccrs.PlateCarree())
+    return MapArea(lat_min, lat_max, lon_min, lon_max, lat_delta, lon_delta)
+
 
-    max_ang_size = max(lat_delta, lon_delta)
+# Tile zoom level for the map of the area
+def get_detail_level(area: MapArea):
+    max_ang_size = max(area.lat_delta, area.lon_delta)
     detail_lvl = const.MAP_DETAIL_LVL3
     if max_ang_size < const.MAP_ANGULAR_SIZE_THRESHOLD1:
         detail_lvl = const.MAP_DETAIL_LVL1
     elif max_ang_size < const.MAP_ANGULAR_SIZE_THRESHOLD2:
         detail_lvl = const.MAP_DETAIL_LVL2
-    ax.add_image(tiler, detail_lvl)
-
-    for points in segments:
-        lons = []
-        lats = []
-        for pnt in points:
-            lons.append(float(pnt.lon))
-            lats.append(float(pnt.lat))
-        ax.plot(lons, lats, color='blue', linewidth=2, transform=ccrs.Geodetic())
-
-    logger.debug(f'try_create_map. saving image. sess_id={sess_id}')
-    fname = get_filename(sess_id) 
-    plt.savefig(fname, dpi=300, format='jpg', bbox_inches='tight', pad_inches=0)
-    logger.info(f'try_create_map. saved. sess_id={sess_id}, filename={fname}')
-
-    db.finish_map_job(sess_id)
+    return detail_lvl
+
+
+# Runs in a worker process of get_executor(). numpy and the renderer are imported there only
+def render_map(packed: bytes, fname: str):
+    import trackstats
+    track = trackstats.from_packed(packed)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    renderer = os.environ.get('MAP_RENDERER', const.DEFAULT_MAP_RENDERER)
+    if renderer == 'pil':
+        import maps_pil
+        maps_pil.render_map(track, fname)
+    else:
+        import maps_cartopy
+        maps_cartopy.render_map(track, fname)
 
 
-def get_map(sess_id: str):
-    if not db.is_map_available(sess_id):
+async def get_map(sess_id: str):
+    if not await db.is_map_available(sess_id):
         logger.info(f'get_map. not available. sess_id={sess_id}')
         return None
     logger.info(f'get_map. loading file. sess_id={sess_id}')
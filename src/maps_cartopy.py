@@ -0,0 +1,61 @@
+import io
+import logging
+from PIL import Image
+import matplotlib.pyplot as plt
+import cartopy.crs as ccrs
+import cartopy.io.img_tiles as cimgt
+import maps
+import tiles
+import trackstats
+
+# Map renderer drawing the track with matplotlib over a cartopy GeoAxes
+
+logger = logging.getLogger('geobot-maps-cartopy')
+
+
+# OSM tiler reading tiles through the shared on-disk tile cache
+class CachedOSM(cimgt.OSM):
+    def __init__(self, tile_cache: tiles.TileCache):
+        super().__init__()
+        self.tile_cache = tile_cache
+
+
+    def get_image(self, tile):
+        x, y, z = tile
+        data = self.tile_cache.get(z, x, y)
+        if data is not None:
+            img = Image.open(io.BytesIO(data)).convert(self.desired_tile_form)
+        else:
+            img = Image.new(self.desired_tile_form, (256, 256), (250, 250, 250))
+        return img, self.tileextent(tile), 'lower'
+
+
+def render_map(track: trackstats.TrackArrays, fname: str):
+    tiler = CachedOSM(tiles.get_tile_cache())
+    mercator = tiler.crs
+
+    area = maps.get_map_area(track)
+
+    aspect = 1.0
+    aspect = area.lon_delta / area.lat_delta
+    aspect = max(aspect, 0.33)
+    aspect = min(aspect, 3.0)
+
+    BASE_FIG_SIZE = 10.0
+    fig_size = None
+    if aspect > 1.0:
+        fig_size = (BASE_FIG_SIZE, BASE_FIG_SIZE / aspect)
+    else:
+        fig_size = (BASE_FIG_SIZE * aspect, BASE_FIG_SIZE)
+    fig = plt.figure(figsize=fig_size, frameon=False)
+    ax = plt.axes(projection=mercator)
+
+    ax.set_extent([area.lon_min, area.lon_max, area.lat_min, area.lat_max], crs=ccrs.PlateCarree())
+    ax.add_image(tiler, maps.get_detail_level(area))
+
+    for start, end in trackstats.segment_bounds(track):
+        ax.plot(track.lon[start:end], track.lat[start:end], color='blue', linewidth=2, transform=ccrs.Geodetic())
+
+    logger.debug(f'render_map. saving image. filename={fname}')
+    plt.savefig(fname, dpi=300, format='jpg', bbox_inches='tight', pad_inches=0)
+    plt.close(fig)
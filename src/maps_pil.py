@@ -0,0 +1,69 @@
+import io
+import math
+import logging
+import numpy as np
+from PIL import Image, ImageDraw
+import const
+import maps
+import tiles
+import trackstats
+
+# Lightweight map renderer: stitches Web Mercator tiles of the map area and draws the track over them.
+# Produces maps at the native tile resolution, without matplotlib/cartopy
+
+logger = logging.getLogger('geobot-maps-pil')
+
+TILE_SIZE = 256
+LINE_WIDTH = 4
+LINE_COLOR = (0, 0, 255)
+BLANK_COLOR = (250, 250, 250)
+
+
+def to_pixels(lon: float, lat: float, zoom: int):
+    x, y = tiles.lonlat_to_tile(lon, lat, zoom)
+    return x * TILE_SIZE, y * TILE_SIZE
+
+
+# Vectorized to_pixels
+def track_to_pixels(lon, lat, zoom: int):
+    n = 2 ** zoom * TILE_SIZE
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2.0 * n
+    return x, y
+
+
+def render_map(track: trackstats.TrackArrays, fname: str):
+    area = maps.get_map_area(track)
+    zoom = maps.get_detail_level(area)
+
+    # Long tracks would need enormous images at the chosen detail level
+    while True:
+        x0, y0 = to_pixels(area.lon_min, area.lat_max, zoom)
+        x1, y1 = to_pixels(area.lon_max, area.lat_min, zoom)
+        if max(x1 - x0, y1 - y0) <= const.MAP_MAX_PIXELS or zoom <= 1:
+            break
+        zoom -= 1
+
+    width = max(int(math.ceil(x1 - x0)), 1)
+    height = max(int(math.ceil(y1 - y0)), 1)
+    img = Image.new('RGB', (width, height), BLANK_COLOR)
+
+    tile_cache = tiles.get_tile_cache()
+    for tx, ty in tiles.tiles_for_bbox(area.lat_min, area.lon_min, area.lat_max, area.lon_max, zoom):
+        data = tile_cache.get(zoom, tx, ty)
+        if data is None:
+            continue
+        tile = Image.open(io.BytesIO(data)).convert('RGB')
+        img.paste(tile, (int(round(tx * TILE_SIZE - x0)), int(round(ty * TILE_SIZE - y0))))
+
+    draw = ImageDraw.Draw(img)
+    px, py = track_to_pixels(track.lon, track.lat, zoom)
+    px -= x0
+    py -= y0
+    for start, end in trackstats.segment_bounds(track):
+        if end - start > 1:
+            line = list(zip(px[start:end].tolist(), py[start:end].tolist()))
+            draw.line(line, fill=LINE_COLOR, width=LINE_WIDTH, joint='curve')
+
+    logger.debug(f'render_map. saving image. filename={fname}, zoom={zoom}, size={width}x{height}')
+    img.save(fname, format='JPEG', quality=90)
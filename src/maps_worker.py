@@ -0,0 +1,66 @@
+import os
+import asyncio
+import logging
+import signal
+import const
+import db
+import logconf
+import maps
+import metrics
+
+# Standalone map generation worker. Does not depend on telegram, so any number of
+# workers can run next to the bot (started with MAPS_IN_BOT=0).
+# Run from the src folder: python3 -m maps_worker
+
+logger = logging.getLogger('geobot-maps-worker')
+
+
+# Takes jobs until stopped. Errors (e.g. Redis is not available) do not stop the worker: it polls again
+# after a delay growing with every error in a row
+async def worker_loop(stop: asyncio.Event):
+    errors = 0
+    while not stop.is_set():
+        try:
+            if await maps.try_create_map():
+                errors = 0
+                continue
+            errors = 0
+            delay = const.MAP_WORKER_POLL_INTERVAL
+        except Exception:
+            errors += 1
+            delay = min(const.MAP_WORKER_POLL_INTERVAL * 2 ** errors, const.MAP_WORKER_MAX_BACKOFF)
+            logger.exception(f'worker_loop. Map job is not processed. errors={errors}, delay={delay}')
+        try:
+            await asyncio.wait_for(stop.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    workers = int(os.environ.get('MAP_WORKERS', const.DEFAULT_MAP_WORKERS))
+    logger.info(f'run. Maps worker started. workers={workers}')
+    try:
+        # Jobs being rendered are finished before exit; a killed worker's jobs are redelivered after their lease
+        await asyncio.gather(*(worker_loop(stop) for _ in range(workers)))
+    finally:
+        maps.shutdown_executor()
+        await db.close_redis_async()
+    logger.info('run. Maps worker stopped')
+
+
+def main():
+    logconf.setup()
+    metrics.start_server()
+    try:
+        asyncio.run(run())
+    finally:
+        logconf.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+import os
+import time
+import bisect
+import logging
+import functools
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import const
+
+# Hot path metrics in the Prometheus text format, served at http://METRICS_ADDR:METRICS_PORT/metrics
+# (not served if METRICS_PORT is not set). Metrics are kept in process memory: every bot and maps worker
+# process serves its own. Observing is cheap and safe from any thread; gauges with a callback
+# are computed when the metrics are scraped, in the server thread.
+
+logger = logging.getLogger('geobot-metrics')
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+lock = threading.Lock() # guards the values of all metrics
+registry = [] # all metrics, in registration order
+server = None
+
+
+def format_labels(names: tuple, values: tuple, extra: str = ''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {} # label values -> [bucket counts..., +Inf count, sum]
+        registry.append(self)
+
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with lock:
+            series = self.series.get(key)
+            if series is None:
+                series = [0] * (len(self.buckets) + 1) + [0.0]
+                self.series[key] = series
+            series[idx] += 1
+            series[-1] += value
+
+
+    @contextlib.contextmanager
+    def timer(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+
+    # Decorator of coroutine functions observing their duration; the label name_label is set to the function name
+    def time(self, name_label: str = None, **labels):
+        def decorator(func):
+            func_labels = dict(labels, **{name_label: func.__name__}) if name_label is not None else labels
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - t0, **func_labels)
+            return wrapper
+        return decorator
+
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with lock:
+            series = [(key, list(values)) for key, values in self.series.items()]
+        for key, values in series:
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                total += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, key, le)} {total}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {values[-1]}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, key)} {total}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {} # label values -> value
+        registry.append(self)
+
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+
+    def collect(self):
+        with lock:
+            values = dict(self.values)
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for key, value in values.items():
+            lines.append(f'{self.name}{format_labels(self.labels, key)} {value}')
+        return lines
+
+
+# Gauge set by the code, or computed on scrape by func: it returns the value, or {label values: value}
+class Gauge:
+    def __init__(self, name: str, help: str, labels: tuple = (), func=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.func = func
+        self.values = {} # label values -> value
+        registry.append(self)
+
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with lock:
+            self.values[key] = value
+
+
+    def collect(self):
+        if self.func is not None:
+            try:
+                values = self.func()
+            except Exception:
+                logger.exception(f'collect. Gauge is not available. name={self.name}')
+                return []
+            values = values if isinstance(values, dict) else {(): values}
+        else:
+            with lock:
+                values = dict(self.values)
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        for key, value in values.items():
+            lines.append(f'{self.name}{format_labels(self.labels, key)} {value}')
+        return lines
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines += metric.collect()
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serves the metrics from a background thread. Returns the server, None if METRICS_PORT is not set
+def start_server(port: int = None, addr: str = None):
+    global server
+    if port is None:
+        port = os.environ.get('METRICS_PORT')
+        if not port:
+            return None
+    addr = addr if addr is not None else os.environ.get('METRICS_ADDR', const.DEFAULT_METRICS_ADDR)
+    server = ThreadingHTTPServer((addr, int(port)), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f'start_server. addr={addr}, port={server.server_address[1]}')
+    return server
+
+
+def stop_server():
+    global server
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        server = None
+
+
+HANDLER_SECONDS = Histogram('geobot_handler_seconds', 'Time to handle a Telegram update, by handler', ('handler',))
+REDIS_SECONDS = Histogram('geobot_redis_seconds', 'Redis round trips of the data layer, by function', ('function',))
+MAP_RENDER_SECONDS = Histogram('geobot_map_render_seconds', 'Time to render a map image, by renderer', ('renderer',))
+GPX_SECONDS = Histogram('geobot_gpx_seconds', 'Time to generate a GPX document', ('compressed',))
@@ -0,0 +1,156 @@
+import argparse
+import logging
+import time
+import redis
+import db
+
+# Maintenance commands for data stored by older bot versions.
+# Run from the src folder: python3 migrate.py <command>
+
+logger = logging.getLogger('geobot-migrate')
+
+BATCH_SIZE = 500
+
+
+def scan_batches(r, pattern: str):
+    batch = []
+    for key in r.scan_iter(match=pattern, count=BATCH_SIZE, _type='HASH'):
+        batch.append(key)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def backfill_live_keys(r):
+    created = 0
+    for batch in scan_batches(r, 'session:*'):
+        pipe = r.pipeline(transaction=False)
+        for sess_id in batch:
+            pipe.hmget(sess_id, 'usr_id', 'chat_id', 'msg_id')
+        ids = pipe.execute()
+
+        pipe = r.pipeline(transaction=False)
+        for sess_id, (usr_id, chat_id, msg_id) in zip(batch, ids):
+            if usr_id is None or chat_id is None or msg_id is None:
+                logger.warning(f'backfill_live_keys. Incomplete session, skipping. sess_id={sess_id}')
+                continue
+            pipe.set(db.get_live_key(usr_id, chat_id, msg_id), sess_id, nx=True)
+        created += sum(1 for res in pipe.execute() if res)
+    logger.info(f'backfill_live_keys. done. created={created}')
+    return created
+
+
+def convert_points_to_tracks(r):
+    by_sess_id = {}
+    point_keys = []
+    for batch in scan_batches(r, 'point:*'):
+        pipe = r.pipeline(transaction=False)
+        for key in batch:
+            pipe.hmget(key, 'sess_id', 'latitude', 'longitude', 'ts', 'segm_id')
+        for key, (sess_id, lat, lon, ts, segm_id) in zip(batch, pipe.execute()):
+            point_keys.append(key)
+            if sess_id is None or lat is None or lon is None or ts is None:
+                logger.warning(f'convert_points_to_tracks. Incomplete point, skipping. key={key}')
+                continue
+            points = by_sess_id.setdefault(sess_id, [])
+            points.append((float(ts), float(lat), float(lon), int(segm_id) if segm_id is not None else 1))
+
+    for sess_id, points in by_sess_id.items():
+        points.sort()
+        packed = b''.join(db.POINT_RECORD.pack(lat, lon, ts, segm_id) for ts, lat, lon, segm_id in points)
+        track_key = db.get_track_key(sess_id)
+        # Points recorded after the upgrade are newer than the converted ones
+        newer = r.execute_command('GET', track_key, **{db.NEVER_DECODE: True})
+        r.set(track_key, packed + (newer or b''))
+        logger.info(f'convert_points_to_tracks. sess_id={sess_id}, points={len(points)}')
+
+    for i in range(0, len(point_keys), BATCH_SIZE):
+        r.delete(*point_keys[i:i + BATCH_SIZE])
+    try:
+        r.ft('idx:point').dropindex(delete_documents=False)
+    except redis.exceptions.ResponseError:
+        pass # already dropped
+    logger.info(f'convert_points_to_tracks. done. sessions={len(by_sess_id)}, points={len(point_keys)}')
+    return len(point_keys)
+
+
+def backfill_points_num(r):
+    updated = 0
+    for batch in scan_batches(r, 'session:*'):
+        pipe = r.pipeline(transaction=False)
+        for sess_id in batch:
+            pipe.strlen(db.get_track_key(sess_id))
+        track_lens = pipe.execute()
+
+        pipe = r.pipeline(transaction=False)
+        for sess_id, track_len in zip(batch, track_lens):
+            pipe.hset(sess_id, 'points_num', track_len // db.POINT_RECORD.size)
+        pipe.execute()
+        updated += len(batch)
+    logger.info(f'backfill_points_num. done. sessions={updated}')
+    return updated
+
+
+# Length, duration and points_num from the stored tracks, e.g. after changes of the distance computation
+def recompute_stats(r):
+    import trackstats
+    updated = 0
+    for batch in scan_batches(r, 'session:*'):
+        pipe = r.pipeline(transaction=False)
+        for sess_id in batch:
+            pipe.execute_command('GET', db.get_track_key(sess_id), **{db.NEVER_DECODE: True})
+        tracks = pipe.execute()
+
+        pipe = r.pipeline(transaction=False)
+        for sess_id, packed in zip(batch, tracks):
+            stats = trackstats.track_stats(trackstats.from_packed(packed or b''))
+            pipe.hset(sess_id, mapping={'length': stats.length, 'duration': stats.duration, 'points_num': stats.points})
+            pipe.hincrby(sess_id, 'rev', 1) # invalidates cached track data
+            pipe.hincrby(sess_id, 'ver', 1) # and cached sessions of running bots
+        pipe.execute()
+        updated += len(batch)
+    logger.info(f'recompute_stats. done. sessions={updated}')
+    return updated
+
+
+def convert_map_queue(r):
+    # maps:todo and maps:inprog used to be plain sets. Jobs in progress have no lease, so they are queued again
+    moved = 0
+    for key in ('maps:todo', 'maps:inprog'):
+        if r.type(key) != 'set':
+            continue
+        sess_ids = r.smembers(key)
+        pipe = r.pipeline(transaction=True)
+        pipe.delete(key)
+        if len(sess_ids) > 0:
+            pipe.zadd('maps:todo', {sess_id: time.time() for sess_id in sess_ids}, nx=True)
+        pipe.execute()
+        moved += len(sess_ids)
+    logger.info(f'convert_map_queue. done. jobs={moved}')
+    return moved
+
+
+commands = {
+    'live-keys': backfill_live_keys,
+    'points-to-tracks': convert_points_to_tracks,
+    'points-num': backfill_points_num,
+    'map-queue': convert_map_queue,
+    'recompute-stats': recompute_stats,
+}
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description='Geolog bot data migrations')
+    parser.add_argument('command', choices=commands.keys())
+    args = parser.parse_args()
+    commands[args.command](db.get_redis())
+
+
+if __name__ == '__main__':
+    main()
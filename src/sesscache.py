@@ -0,0 +1,89 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+import const
+import metrics
+
+# In-process cache of live location sessions, keyed by the live key (db.get_live_key: user, chat and message).
+# Holds the session hash fields as of the last read or successful write of this process, so steady-state
+# updates of a live location skip reading the session back from Redis.
+# Writes go to Redis first (write-through) and carry the cached session version (session field 'ver');
+# the store_update script rejects them if the session has changed since, e.g. by another bot instance,
+# and the writer evicts the entry and reads the session again (see ingest.store_batch).
+# Entries expire after SESSION_CACHE_TTL seconds without use; the least recently used ones are dropped
+# when there are more than SESSION_CACHE_SIZE. SESSION_CACHE_SIZE=0 disables the cache.
+
+logger = logging.getLogger('geobot-sesscache')
+
+session_cache = None
+
+LOOKUPS = metrics.Counter('geobot_session_cache_lookups_total', 'Live session cache lookups, by result (hit or miss)',
+    ('result',))
+
+
+class SessionCache:
+    def __init__(self, max_size: int, ttl: float, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict() # live key -> (expiration time, session fields); least recently used first
+
+
+    # Returns the cached session fields (not to be modified) or None
+    def get(self, live_key: str):
+        entry = self.entries.get(live_key)
+        if entry is None:
+            LOOKUPS.inc(result='miss')
+            return None
+        now = self.clock()
+        expires, session = entry
+        if expires <= now:
+            del self.entries[live_key]
+            LOOKUPS.inc(result='miss')
+            return None
+        self.entries[live_key] = (now + self.ttl, session)
+        self.entries.move_to_end(live_key)
+        LOOKUPS.inc(result='hit')
+        return session
+
+
+    def put(self, live_key: str, session: dict):
+        if self.max_size <= 0:
+            return
+        self.entries[live_key] = (self.clock() + self.ttl, session)
+        self.entries.move_to_end(live_key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+    def remove(self, live_key: str):
+        self.entries.pop(live_key, None)
+
+
+    def clear(self):
+        self.entries.clear()
+
+
+    # Number of entries not expired yet: the live sessions updated within SESSION_CACHE_TTL
+    def count_fresh(self):
+        now = self.clock()
+        return sum(1 for expires, _ in list(self.entries.values()) if expires > now)
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+LIVE_SESSIONS = metrics.Gauge('geobot_live_sessions', 'Live sessions updated by this process within SESSION_CACHE_TTL',
+    func=lambda: get_session_cache().count_fresh())
+
+
+def get_session_cache():
+    global session_cache
+    if session_cache is None:
+        max_size = int(os.environ.get('SESSION_CACHE_SIZE', const.DEFAULT_SESSION_CACHE_SIZE))
+        ttl = float(os.environ.get('SESSION_CACHE_TTL', const.AFTER_PAUSE_TIME))
+        logger.info(f'get_session_cache. max_size={max_size}, ttl={ttl}')
+        session_cache = SessionCache(max_size, ttl)
+    return session_cache
@@ -0,0 +1,163 @@
+import os
+import math
+import logging
+import argparse
+import urllib.request
+import urllib.error
+import const
+
+# Persistent on-disk cache of map tiles, shared by all map rendering processes.
+# Tiles are stored as {dir}/{z}/{x}/{y}.png; file modification time is the last use time,
+# least recently used tiles are evicted when the cache grows over its size limit.
+# TILE_URL may point to any tile server or to a local tile directory (file:///path/{z}/{x}/{y}.png).
+
+logger = logging.getLogger('geobot-tiles')
+
+USER_AGENT = 'GeologBot/1.0 (+https://github.com/denesterov/geolog)'
+FETCH_TIMEOUT = 20.0
+
+tile_cache = None
+
+
+# Fractional Web Mercator tile coordinates of a point
+def lonlat_to_tile(lon: float, lat: float, zoom: int):
+    n = 2 ** zoom
+    lat_rad = math.radians(lat)
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n
+    return x, y
+
+
+def tiles_for_bbox(lat_min: float, lon_min: float, lat_max: float, lon_max: float, zoom: int):
+    x0, y0 = lonlat_to_tile(lon_min, lat_max, zoom)
+    x1, y1 = lonlat_to_tile(lon_max, lat_min, zoom)
+    n = 2 ** zoom
+    for x in range(max(int(x0), 0), min(int(x1), n - 1) + 1):
+        for y in range(max(int(y0), 0), min(int(y1), n - 1) + 1):
+            yield x, y
+
+
+class TileCache:
+    def __init__(self, path: str, max_bytes: int, url_template: str):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.url_template = url_template
+        self.size = None # bytes on disk, estimated; counted on first write
+
+
+    def tile_path(self, z: int, x: int, y: int):
+        return os.path.join(self.path, str(z), str(x), f'{y}.png')
+
+
+    # Returns tile image data, or None if the tile can not be fetched
+    def get(self, z: int, x: int, y: int):
+        path = self.tile_path(z, x, y)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            pass
+
+        data = self.fetch(z, x, y)
+        if data is not None:
+            self.put(z, x, y, data)
+        return data
+
+
+    def fetch(self, z: int, x: int, y: int):
+        url = self.url_template.format(z=z, x=x, y=y)
+        try:
+            request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+            with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as resp:
+                return resp.read()
+        except (urllib.error.URLError, OSError) as err:
+            logger.warning(f'fetch. Tile is not available. url={url}, err={err}')
+            return None
+
+
+    def put(self, z: int, x: int, y: int, data: bytes):
+        path = self.tile_path(z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Other processes may read the same tile; they must never see a partial file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        if self.size is None:
+            self.size = sum(size for _, _, size in self.list_files())
+        else:
+            self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+
+    def list_files(self):
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                p = os.path.join(root, name)
+                try:
+                    st = os.stat(p)
+                    yield p, st.st_mtime, st.st_size
+                except FileNotFoundError:
+                    pass # evicted by another process
+
+
+    # Removes least recently used tiles until the cache takes 90% of its limit
+    def evict(self):
+        files = sorted(self.list_files(), key=lambda item: item[1])
+        size = sum(file_size for _, _, file_size in files)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for p, _, file_size in files:
+            if size <= target:
+                break
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+            removed += 1
+        self.size = size
+        logger.info(f'evict. removed={removed}, size={size}')
+
+
+    def seed(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float, zooms: list):
+        fetched = 0
+        for zoom in zooms:
+            for x, y in tiles_for_bbox(lat_min, lon_min, lat_max, lon_max, zoom):
+                if self.get(zoom, x, y) is not None:
+                    fetched += 1
+        logger.info(f'seed. tiles={fetched}')
+        return fetched
+
+
+def get_tile_cache():
+    global tile_cache
+    if tile_cache is None:
+        path = os.environ.get('TILE_CACHE_DIR', const.DEFAULT_TILE_CACHE_DIR)
+        max_mb = float(os.environ.get('TILE_CACHE_MAX_MB', const.DEFAULT_TILE_CACHE_MAX_MB))
+        url_template = os.environ.get('TILE_URL', const.DEFAULT_TILE_URL)
+        logger.info(f'get_tile_cache. path={path}, max_mb={max_mb}, url={url_template}')
+        tile_cache = TileCache(path, int(max_mb * 1024 * 1024), url_template)
+    return tile_cache
+
+
+# Pre-seeding: python3 -m tiles --bbox 45.20 19.78 45.30 19.90 --zoom 15 16 18
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description='Fill the map tile cache for an area')
+    parser.add_argument('--bbox', type=float, nargs=4, required=True, metavar=('LAT_MIN', 'LON_MIN', 'LAT_MAX', 'LON_MAX'))
+    parser.add_argument('--zoom', type=int, nargs='+',
+        default=[const.MAP_DETAIL_LVL1, const.MAP_DETAIL_LVL2, const.MAP_DETAIL_LVL3])
+    args = parser.parse_args()
+    get_tile_cache().seed(*args.bbox, args.zoom)
+
+
+if __name__ == '__main__':
+    main()
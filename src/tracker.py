@@ -1,10 +1,17 @@
 # import telegram
 import const
 import common
-from geopy import distance
+import geodist
+import logconf
 import logging
 
 logger = logging.getLogger('tracker')
+update_logger = logconf.SampledLogger(logger)
+
+
+# thresholds: distances the result is compared with; the fast backend is precise near them
+def get_distance(lat1, lon1, lat2, lon2, thresholds=()):
+    return geodist.get_backend()(lat1, lon1, lat2, lon2, thresholds)
 
 
 def new_session_data(usr_id, chat_id, msg_id, chat_type='PRIV', chat_name='', lat=0.0, long=0.0, timestamp=0):
@@ -22,6 +29,9 @@ def new_session_data(usr_id, chat_id, msg_id, chat_type='PRIV', chat_name='', la
         'last_long' : long,
         'track_segm_idx' : 1,
         'track_segm_len' : 1, # We assume that for a new session, the first point will be stored immediately
+        'points_num' : 0,
+        'rev' : 0,
+        'ver' : 0,
     }
 
 
@@ -33,54 +43,56 @@ def new_session_data_ex(usr_id, msg_id, tg_chat, loc, timestamp):
 
 
 class SessionData:
-    valid_data_fields = set(new_session_data(1, 1, 1).keys()) | {'id'}
-    int_fields = {'track_segm_idx', 'track_segm_len'}
+    fields = tuple(new_session_data(1, 1, 1).keys()) + ('id',)
+    int_fields = {'track_segm_idx', 'track_segm_len', 'points_num', 'rev', 'ver'}
     float_fields = {'ts', 'length', 'duration', 'last_update', 'last_lat', 'last_long'}
+    field_set = frozenset(fields)
+    converters = {name: int for name in int_fields} | {name: float for name in float_fields}
+    loaders = tuple(zip(fields, map(converters.get, fields)))
+
+    # One slot per field, values are converted once, on load or write; 'updates' has the written fields
+    # with the values as they were written
+    __slots__ = fields + ('updates',)
 
 
-    # session_data can be both dict and redis.Document (data fields as attributes, write is not possible)
+    # session_data can be both dict and redis.Document (data fields as attributes).
+    # Fields missing there are left unset: reading them raises AttributeError
     def __init__(self, session_data):
-        self.__dict__['data'] = session_data
-        self.__dict__['updates'] = dict()
+        setter = object.__setattr__
+        get = session_data.get if isinstance(session_data, dict) else lambda name: getattr(session_data, name, None)
+        for name, converter in SessionData.loaders:
+            value = get(name)
+            if value is not None:
+                setter(self, name, converter(value) if converter is not None else value)
+        setter(self, 'updates', dict())
 
 
+    # Called for unset fields and unknown names only
     def __getattr__(self, name):
-        updates = self.__dict__['updates']
-        valid_data_fields = SessionData.__dict__['valid_data_fields']
-
-        # logger.info(f'SessionData.__getattr__. {name=}, {type(name)=}, {valid_data_fields=}') # debug
-
-        assert name in valid_data_fields
-
-        value = None
-        if name in updates:
-            value = updates[name]
-        else:
-            sess_data = self.__dict__['data']
-            if isinstance(sess_data, dict) and name in sess_data.keys():
-                value = sess_data[name]
-            else:
-                value = getattr(sess_data, name, None)
-
-        if value is not None:
-            int_flds = SessionData.__dict__['int_fields']
-            flt_flds = SessionData.__dict__['float_fields']
-            if name in int_flds:
-                value = int(value)
-            elif name in flt_flds:
-                value = float(value)
-            return value
-
+        assert name in SessionData.field_set
         raise AttributeError(f"SessionData object has no attribute '{name}'")
 
 
     def __setattr__(self, name, value):
-        updates = self.__dict__['updates']
-        updates[name] = value
+        assert name in SessionData.field_set
+        converter = SessionData.converters.get(name)
+        object.__setattr__(self, name, converter(value) if converter is not None else value)
+        self.updates[name] = value
 
 
+    # Written fields with the values as they were written
     def get_updates(self):
-        return self.__dict__['updates']
+        return self.updates
+
+
+    # All fields that are set, written ones included
+    def get_merged(self):
+        merged = dict()
+        for name in SessionData.fields:
+            value = getattr(self, name, None)
+            if value is not None:
+                merged[name] = value
+        return merged
 
 
 
@@ -125,20 +137,22 @@ class Tracker:
         timestamp = location.ts
 
         time_period = timestamp - self.session.last_update
-        delta = distance.distance((self.session.last_lat, self.session.last_long), (location.latitude, location.longitude)).m
+        thresholds = (const.MIN_GEO_DELTA, const.MAX_SPEED * time_period) if time_period > 0.1 else (const.MIN_GEO_DELTA,)
+        delta = get_distance(self.session.last_lat, self.session.last_long, location.latitude, location.longitude, thresholds)
         velocity = delta / time_period if time_period > 0.1 else 0.0
 
         if delta < const.MIN_GEO_DELTA:
-            logger.info(f'update. skip coord update by idle. {sess_id=}, {delta=:.1f}, dt={time_period:.1f}') # todo: log debug
+            update_logger.info('update. skip coord update by idle. sess_id=%s, delta=%.1f, dt=%.1f', sess_id, delta, time_period)
             if time_period > const.AFTER_PAUSE_TIME:
                 self.finish_segment()
                 self.session.last_update = timestamp
         elif velocity > const.MAX_SPEED:
-            logger.info(f'update. skip coord update by overspeed. {sess_id=}, {delta=:.1f}, {velocity=:.1f}') # todo: log debug
+            update_logger.info('update. skip coord update by overspeed. sess_id=%s, delta=%.1f, velocity=%.1f', sess_id, delta, velocity)
             self.finish_segment()
             self.update_last_location(location)
         else:
-            logger.info(f'update. writing update. {sess_id=}, {segm_len=}, {delta=:.1f}, {velocity=:.1f}, dt={time_period:.1f}') # todo: log debug
+            update_logger.info('update. writing update. sess_id=%s, segm_len=%s, delta=%.1f, velocity=%.1f, dt=%.1f',
+                sess_id, segm_len, delta, velocity, time_period)
             self.update_last_location(location)
             if segm_len > 0:
                 self.session.length = self.session.length + delta
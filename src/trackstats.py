@@ -0,0 +1,73 @@
+from collections import namedtuple
+import numpy as np
+import geodist
+
+# Batch computations over whole stored tracks with NumPy: statistics, bounding box, segments.
+# Points are filtered by tracker.Tracker when they are stored; nothing here filters them again.
+# Used where a whole track is at hand (map rendering, recomputation), never on the update path.
+
+# Same layout as db.POINT_RECORD ('<dddI'), so stored tracks are decoded without copying
+POINT_DTYPE = np.dtype([('lat', '<f8'), ('lon', '<f8'), ('ts', '<f8'), ('segm_id', '<u4')])
+
+TrackArrays = namedtuple('TrackArrays', ['lat', 'lon', 'ts', 'segm_id'])
+TrackStats = namedtuple('TrackStats', ['length', 'duration', 'lat_min', 'lat_max', 'lon_min', 'lon_max', 'points', 'segments'])
+
+
+def from_packed(packed: bytes):
+    records = np.frombuffer(packed, dtype=POINT_DTYPE)
+    return TrackArrays(records['lat'], records['lon'], records['ts'], records['segm_id'])
+
+
+def from_segments(segments):
+    lat = [pnt.latitude for points in segments for pnt in points]
+    lon = [pnt.longitude for points in segments for pnt in points]
+    ts = [pnt.ts for points in segments for pnt in points]
+    segm_id = [i + 1 for i, points in enumerate(segments) for _ in points]
+    return TrackArrays(np.array(lat, dtype=float), np.array(lon, dtype=float),
+        np.array(ts, dtype=float), np.array(segm_id, dtype=np.uint32))
+
+
+# Index bounds [start, end) of the segments; segment ids never decrease in a stored track
+def segment_bounds(track: TrackArrays):
+    if len(track.segm_id) == 0:
+        return []
+    starts = np.flatnonzero(np.diff(track.segm_id)) + 1
+    bounds = np.concatenate(([0], starts, [len(track.segm_id)]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+# Vectorized geodist.local_distance; see geodist for its error bound
+def distances(lat1, lon1, lat2, lon2):
+    phi = np.radians(0.5 * (lat1 + lat2))
+    w = 1.0 - geodist.ECCENTRICITY_SQ * np.sin(phi) ** 2
+    meridional = geodist.EQUATORIAL_RADIUS * (1.0 - geodist.ECCENTRICITY_SQ) / (w * np.sqrt(w))
+    prime_vertical = geodist.EQUATORIAL_RADIUS / np.sqrt(w)
+    dlon = np.remainder(lon2 - lon1 + 180.0, 360.0) - 180.0
+    return np.hypot(meridional * np.radians(lat2 - lat1), prime_vertical * np.cos(phi) * np.radians(dlon))
+
+
+# Great circle distance on the sphere of the mean Earth radius; ~0.5% off the ellipsoid
+def haversine(lat1, lon1, lat2, lon2):
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    a = np.sin(0.5 * (phi2 - phi1)) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(0.5 * np.radians(lon2 - lon1)) ** 2
+    return 2.0 * 6371008.8 * np.arcsin(np.sqrt(a))
+
+
+# Distances and time periods between consecutive points, zero between segments
+def steps(track: TrackArrays):
+    same_segment = track.segm_id[1:] == track.segm_id[:-1]
+    dist = np.where(same_segment, distances(track.lat[:-1], track.lon[:-1], track.lat[1:], track.lon[1:]), 0.0)
+    periods = np.where(same_segment, np.diff(track.ts), 0.0)
+    return dist, periods
+
+
+def track_stats(track: TrackArrays):
+    points = len(track.lat)
+    if points == 0:
+        return TrackStats(0.0, 0.0, None, None, None, None, 0, 0)
+    dist, periods = steps(track)
+    return TrackStats(float(dist.sum()), float(periods.sum()),
+        float(track.lat.min()), float(track.lat.max()), float(track.lon.min()), float(track.lon.max()),
+        points, len(segment_bounds(track)))
+
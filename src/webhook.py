@@ -0,0 +1,92 @@
+import os
+import asyncio
+import json
+import logging
+import signal
+import urllib.parse
+import telegram
+import telegram.ext
+from aiohttp import web
+import const
+
+# Webhook mode: Telegram posts updates to an aiohttp endpoint instead of the bot polling for them.
+# Updates are processed concurrently by the application's update processor (dispatch.SessionOrderedProcessor).
+# A request is answered once its update is processed, and Telegram keeps at most WEBHOOK_MAX_CONNECTIONS
+# requests open, so when handlers slow down (e.g. Redis is slow) Telegram sends updates slower too,
+# instead of them piling up in the bot. With the ingestion buffer on (INGEST_WINDOW_MS), location handlers
+# wait for their update to be stored as well (bot_data['wait_stored']): updates posted at once are still written
+# together, but a request is never answered for an update still in the buffer.
+# The endpoint takes plain Update JSON, so recorded updates can be posted to a local bot, e.g. with curl.
+
+logger = logging.getLogger('geobot-webhook')
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+async def handle_update(request: web.Request):
+    application = request.app['application']
+    secret = request.app['secret']
+    if secret and request.headers.get(SECRET_HEADER) != secret:
+        logger.warning(f'handle_update. Wrong secret token. remote={request.remote}')
+        return web.Response(status=403)
+
+    try:
+        update = telegram.Update.de_json(await request.json(), application.bot)
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        logger.warning(f'handle_update. Malformed update. remote={request.remote}')
+        return web.Response(status=400)
+
+    # Answered once the update is processed and stored. Errors of the handlers are reported by the application itself
+    await application.update_processor.process_update(update, application.process_update(update))
+    return web.Response()
+
+
+def create_web_app(application: telegram.ext.Application, path: str, secret: str = None):
+    application.bot_data['wait_stored'] = True
+    web_app = web.Application()
+    web_app['application'] = application
+    web_app['secret'] = secret
+    web_app.router.add_post(path, handle_update)
+    return web_app
+
+
+def get_path(url: str):
+    return os.environ.get('WEBHOOK_PATH') or urllib.parse.urlparse(url).path or '/'
+
+
+async def serve(application: telegram.ext.Application, url: str):
+    listen = os.environ.get('WEBHOOK_LISTEN', const.DEFAULT_WEBHOOK_LISTEN)
+    port = int(os.environ.get('WEBHOOK_PORT', const.DEFAULT_WEBHOOK_PORT))
+    max_connections = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', const.DEFAULT_WEBHOOK_MAX_CONNECTIONS))
+    secret = os.environ.get('WEBHOOK_SECRET')
+    path = get_path(url)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    runner = web.AppRunner(create_web_app(application, path, secret))
+    try:
+        async with application:
+            await application.start()
+            await runner.setup()
+            try:
+                await web.TCPSite(runner, listen, port).start()
+                await application.bot.set_webhook(url=url, secret_token=secret, max_connections=max_connections,
+                    allowed_updates=telegram.Update.ALL_TYPES)
+                logger.info(f'serve. Webhook is set. listen={listen}, port={port}, path={path}, '
+                    f'max_connections={max_connections}, concurrent_updates={application.update_processor.max_concurrent_updates}')
+                await stop.wait()
+            finally:
+                # Requests being processed are answered before the application stops
+                await runner.cleanup()
+                await application.stop()
+    finally:
+        if application.post_shutdown is not None:
+            await application.post_shutdown(application)
+    logger.info('serve. Webhook server stopped')
+
+
+def run(application: telegram.ext.Application, url: str):
+    asyncio.run(serve(application, url))
@@ -0,0 +1,65 @@
+"""Calls per second of the distance backends used by the update filter (geodist).
+
+Steps are GPS fix steps of 5..200 m at mid latitudes; with the tracker thresholds
+the fast backend falls back to the geodesic only for steps close to them.
+Vectorized trackstats.distances is shown for reference, per point.
+
+Run from the repository root:
+    PYTHONPATH=src python3 test/bench/bench_distance.py
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+import const
+import geodist
+import trackstats
+
+
+def make_steps(count: int):
+    rnd = random.Random(1)
+    steps = []
+    for _ in range(count):
+        lat = rnd.uniform(-60.0, 60.0)
+        lon = rnd.uniform(-180.0, 180.0)
+        dist = rnd.uniform(5.0, 200.0) / 111000.0
+        steps.append((lat, lon, lat + dist * rnd.uniform(-1.0, 1.0), lon + dist * rnd.uniform(-1.0, 1.0), rnd.uniform(1.0, 30.0)))
+    return steps
+
+
+def calls_per_sec(func, steps: list, with_thresholds: bool):
+    t0 = time.perf_counter()
+    if with_thresholds:
+        for lat1, lon1, lat2, lon2, period in steps:
+            func(lat1, lon1, lat2, lon2, (const.MIN_GEO_DELTA, const.MAX_SPEED * period))
+    else:
+        for lat1, lon1, lat2, lon2, _ in steps:
+            func(lat1, lon1, lat2, lon2)
+    return len(steps) / (time.perf_counter() - t0)
+
+
+def run(count: int):
+    steps = make_steps(count)
+    geodist.geodesic_distance(*steps[0][:4]) # import geopy outside of the measurement
+
+    for name, func, with_thresholds in [
+        ('geodesic', geodist.geodesic_distance, True),
+        ('fast, no thresholds', geodist.fast_distance, False),
+        ('fast, tracker thresholds', geodist.fast_distance, True),
+        ('local_distance', geodist.local_distance, False),
+    ]:
+        print(f'{name:>26}: {calls_per_sec(func, steps, with_thresholds):12,.0f} calls/s')
+
+    arr = np.array(steps)
+    t0 = time.perf_counter()
+    trackstats.distances(arr[:, 0], arr[:, 1], arr[:, 2], arr[:, 3])
+    print(f'{"trackstats.distances":>26}: {count / (time.perf_counter() - t0):12,.0f} points/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+    run(args.count)
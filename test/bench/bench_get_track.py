@@ -0,0 +1,73 @@
+"""Time to read a whole track with db.get_track for 1k/10k/100k point sessions.
+
+Also reports the cost of decoding alone, for unpack_segments and for the previous
+decoder that built a list of tuples first and then grouped it through a dict.
+
+Needs a running redis-stack (REDIS_HOST/REDIS_PORT). Run from the repository root:
+    PYTHONPATH=src:test:test/tests python3 test/bench/bench_get_track.py
+"""
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+
+import common
+import db
+import tracker
+
+
+def make_packed(points: int):
+    # a new segment every 500 points
+    return b''.join(db.POINT_RECORD.pack(45.2 + i * 1e-5, 19.8 + i * 1e-5, 1.7e9 + i, 1 + i // 500) for i in range(points))
+
+
+def unpack_segments_before(packed: bytes):
+    raw_points = [(lat, lon, round(ts, 1), segm_id) for lat, lon, ts, segm_id in db.POINT_RECORD.iter_unpack(packed)]
+    by_segm_id = {}
+    for lat, lon, ts, segm_id in raw_points:
+        by_segm_id.setdefault(segm_id, []).append(common.Point(lat, lon, ts))
+    return [by_segm_id[segm_id] for segm_id in sorted(by_segm_id.keys())]
+
+
+def best_of(repeat: int, func, *args):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+async def run(sizes: list, repeat: int):
+    r = db.get_redis_async()
+    for points in sizes:
+        sess_id = f'session:{uuid.uuid1()}'
+        packed = make_packed(points)
+        await r.hset(sess_id, mapping=tracker.new_session_data(900000001, 900000001, 1))
+        await r.set(db.get_track_key(sess_id), packed)
+
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            info, segments = await db.get_track(sess_id)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        assert info.points_total == points
+
+        decode_before = best_of(repeat, unpack_segments_before, packed)
+        decode_after = best_of(repeat, db.unpack_segments, packed)
+        print(f'{points:>7} points: get_track {best * 1000:8.1f} ms, '
+              f'decode {decode_before * 1000:7.1f} -> {decode_after * 1000:7.1f} ms')
+        await r.delete(sess_id, db.get_track_key(sess_id))
+    await db.close_redis_async()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    logging.getLogger('geobot-db').setLevel(logging.WARNING)
+    asyncio.run(run(args.sizes, args.repeat))
@@ -0,0 +1,90 @@
+"""GPX export of a 100k point track: streaming gpxstream writer against the gpx object model.
+
+Reports time and peak Python memory (tracemalloc) for
+* gpx - previous export: gpx.GPX object tree with a Waypoint per point, then to_string()
+  (needs the gpx package from test/requirements-test.txt)
+* stream/str - gpxstream chunks joined into a string (geobot.create_gpx_data)
+* stream/file, stream/gzip - gpxstream into a temporary file from packed records, as the bot does
+
+Run from the repository root:
+    PYTHONPATH=src python3 test/bench/bench_gpx.py
+"""
+import argparse
+import datetime
+import tempfile
+import time
+import tracemalloc
+
+import db
+import gpxstream
+
+
+def make_packed(points: int):
+    # a new segment every 5000 points
+    return b''.join(db.POINT_RECORD.pack(45.2 + i * 1e-5, 19.8 + i * 1e-5, 1.7e9 + i, 1 + i // 5000) for i in range(points))
+
+
+def export_gpx(packed: bytes):
+    import gpx
+    segments = db.unpack_segments(packed)
+    gpx_inst = gpx.GPX()
+    gpx_inst.name = 'Telegram GPS track'
+    gpx_inst.creator = 'Geograph'
+    gpx_inst.descr = 'This GPX file was created by Geograph Telegram Bot'
+    gpx_inst.tracks.append(gpx.track.Track())
+    for segm_points in segments:
+        gpx_inst.tracks[0].segments.append(gpx.track_segment.TrackSegment())
+        segment = gpx_inst.tracks[0].segments[-1]
+        for pnt in segm_points:
+            wp = gpx.Waypoint()
+            wp.lat = pnt.latitude
+            wp.lon = pnt.longitude
+            wp.time = datetime.datetime.fromtimestamp(pnt.ts)
+            segment.append(wp)
+    return len(gpx_inst.to_string())
+
+
+def export_stream_str(packed: bytes):
+    return len(''.join(gpxstream.iter_gpx(db.POINT_RECORD.iter_unpack(packed))))
+
+
+def export_stream_file(packed: bytes, compress: bool = False):
+    with tempfile.TemporaryFile() as f:
+        gpxstream.write_gpx(f, db.POINT_RECORD.iter_unpack(packed), compress)
+        return f.tell()
+
+
+# Time and memory are measured in separate runs, tracing slows allocations down a lot
+def measure(func, *args):
+    t0 = time.perf_counter()
+    size = func(*args)
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def run(points: int):
+    packed = make_packed(points)
+    exports = [
+        ('gpx', export_gpx, ()),
+        ('stream/str', export_stream_str, ()),
+        ('stream/file', export_stream_file, ()),
+        ('stream/gzip', export_stream_file, (True,)),
+    ]
+    for name, func, args in exports:
+        try:
+            elapsed, peak, size = measure(func, packed, *args)
+        except (ImportError, AttributeError) as err:
+            print(f'{name:>12}: skipped, the gpx package with the object model API is not installed ({err})')
+            continue
+        print(f'{name:>12}: {elapsed * 1000:8.1f} ms, peak {peak / 1024 / 1024:7.1f} MB, output {size / 1024 / 1024:6.2f} MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=100000)
+    args = parser.parse_args()
+    run(args.points)
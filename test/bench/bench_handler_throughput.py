@@ -0,0 +1,73 @@
+"""Throughput of geobot.cmd_message under concurrent edited-location updates.
+
+Every simulated rider starts a live location and then sends edits; the edits of all riders
+are processed concurrently on one event loop, the way python-telegram-bot dispatches them.
+A probe task measures event loop lag: with a blocking data layer it grows with the number
+of riders, with the async one it stays close to zero.
+
+Needs a running redis-stack (REDIS_HOST/REDIS_PORT). Run from the repository root:
+    PYTHONPATH=src:test:test/tests python3 test/bench/bench_handler_throughput.py --riders 200 --updates 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import common
+import db
+import geobot
+import test_utils
+
+
+async def loop_lag_probe(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - t0 - 0.01)
+
+
+async def timed(coro, latencies: list):
+    t0 = time.perf_counter()
+    await coro
+    latencies.append(time.perf_counter() - t0)
+
+
+async def run(riders: int, updates: int):
+    context = test_utils.create_tg_context()
+    base_ts = time.time() - updates * 10.0
+    starts = [test_utils.create_tg_rider_start_update(i, base_ts) for i in range(riders)]
+    await asyncio.gather(*(geobot.cmd_message(upd, context) for _, upd in starts))
+
+    stop = asyncio.Event()
+    lags = []
+    probe = asyncio.create_task(loop_lag_probe(stop, lags))
+    latencies = []
+    t0 = time.perf_counter()
+    for step in range(1, updates + 1):
+        batch = []
+        for start, upd in starts:
+            # ~55 m north every 10 s: each edit passes the jitter and speed filters
+            pnt = common.Point(start.latitude + step * 0.0005, start.longitude, start.ts + step * 10.0)
+            batch.append(timed(geobot.cmd_message(test_utils.create_tg_location_update(upd, pnt), context), latencies))
+        await asyncio.gather(*batch)
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await probe
+    await db.close_redis_async()
+
+    latencies.sort()
+    total = len(latencies)
+    print(f'riders={riders}, updates/rider={updates}, total={total}')
+    print(f'throughput: {total / elapsed:.0f} updates/s')
+    print(f'handler latency: p50={statistics.median(latencies) * 1000:.1f} ms, '
+          f'p95={latencies[int(total * 0.95) - 1] * 1000:.1f} ms')
+    print(f'event loop lag: max={max(lags, default=0.0) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--riders', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=20)
+    args = parser.parse_args()
+    db.setup_redis()
+    asyncio.run(run(args.riders, args.updates))
@@ -0,0 +1,72 @@
+"""Redis writes per second with and without the ingestion buffer (ingest.py).
+
+Simulated riders send live location edits through geobot.cmd_message, all on one event loop.
+For every INGEST_WINDOW_MS value the bench reports handled updates/s, Redis commands/s
+and commands per update (from INFO stats), and the delay until an edit is stored:
+longer windows write less and show the track later.
+Sessions are read from the session cache (sesscache.py); SESSION_CACHE_SIZE=0 shows the cost of reading them.
+
+Needs a running redis-stack (REDIS_HOST/REDIS_PORT). Run from the repository root:
+    PYTHONPATH=src:test:test/tests python3 test/bench/bench_ingest.py --windows 0 50 200
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import common
+import db
+import geobot
+import ingest
+import sesscache
+import test_utils
+
+
+async def run_window(window_ms: int, riders: int, updates: int, interval: float):
+    os.environ['INGEST_WINDOW_MS'] = str(window_ms)
+    ingest.ingestor = None
+    await db.get_redis_async().flushdb()
+    sesscache.get_session_cache().clear()
+    db.setup_redis()
+
+    context = test_utils.create_tg_context()
+    base_ts = time.time() - updates * 10.0
+    starts = [test_utils.create_tg_rider_start_update(i, base_ts) for i in range(riders)]
+    await asyncio.gather(*(geobot.cmd_message(upd, context) for _, upd in starts))
+
+    commands_before = await test_utils.redis_commands_processed()
+    t0 = time.perf_counter()
+    for step in range(1, updates + 1):
+        step_t0 = time.perf_counter()
+        for start, upd in starts:
+            # ~55 m north every 10 s: each edit passes the jitter and speed filters
+            pnt = common.Point(start.latitude + step * 0.0005, start.longitude, start.ts + step * 10.0)
+            await geobot.cmd_message(test_utils.create_tg_location_update(upd, pnt), context)
+        # riders send their edits spread over the interval
+        await asyncio.sleep(max(interval - (time.perf_counter() - step_t0), 0.0))
+    handled = time.perf_counter() - t0
+    await ingest.shutdown()
+    elapsed = time.perf_counter() - t0
+    commands = await test_utils.redis_commands_processed() - commands_before - 1 # the INFO call itself
+
+    total = riders * updates
+    print(f'window={window_ms:>4} ms: {total / handled:8.0f} updates/s, {commands / elapsed:8.0f} commands/s, '
+          f'{commands / total:5.2f} commands/update, max store delay ~{window_ms} ms')
+
+
+async def run(windows: list, riders: int, updates: int, interval: float):
+    for window_ms in windows:
+        await run_window(window_ms, riders, updates, interval)
+    await db.close_redis_async()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--windows', type=int, nargs='+', default=[0, 50, 200])
+    parser.add_argument('--riders', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds between edits of a rider')
+    args = parser.parse_args()
+    logging.getLogger('geobot-db').setLevel(logging.WARNING)
+    asyncio.run(run(args.windows, args.riders, args.updates, args.interval))
@@ -0,0 +1,180 @@
+"""Load generator: replays synthetic live-location traffic of many riders through geobot.cmd_message.
+
+Every rider shares a live location and moves along a random route: GPS jitter on every fix, stops
+(some longer than the pause timeout), and now and then an overspeed glitch, a fix kilometers away.
+Updates are built as Telegram sends them (Update JSON) and dispatched the way the webhook mode does:
+through dispatch.SessionOrderedProcessor, concurrently, with the edits of every rider in order.
+Replies go to a mocked bot; the data layer is the real one, against a local Redis.
+
+Reported: handler latency percentiles, handled updates/s, Redis commands per update (INFO stats),
+and memory growth of the bot process (RSS) and of Redis (used_memory).
+INGEST_WINDOW_MS, SESSION_CACHE_SIZE and the other settings are taken from the environment.
+
+Needs a running redis-stack (REDIS_HOST/REDIS_PORT); the database is flushed first, use a scratch one.
+Run from the repository root:
+    PYTHONPATH=src:test:test/tests python3 test/bench/bench_load.py --riders 2000 --updates 30
+"""
+import argparse
+import asyncio
+import heapq
+import logging
+import math
+import random
+import resource
+import statistics
+import time
+
+import telegram
+
+import common
+import const
+import db
+import dispatch
+import geobot
+import ingest
+import sesscache
+import test_utils
+
+METERS_PER_DEGREE = 111320.0
+
+
+def offset(lat: float, long: float, north: float, east: float):
+    return lat + north / METERS_PER_DEGREE, long + east / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+
+
+# Fixes of one rider: (ts, point, final); the first one starts the live location, the last one stops it
+def rider_trace(rnd: random.Random, start_ts: float, count: int, interval: float, jitter: float,
+        stop_prob: float, glitch_prob: float):
+    lat, long = 45.20 + rnd.uniform(0.0, 0.1), 19.78 + rnd.uniform(0.0, 0.1)
+    heading = rnd.uniform(0.0, 2 * math.pi)
+    speed = rnd.uniform(3.0, 8.0) # m/s: pedestrians to cyclists
+    stop_left = 0
+    ts = start_ts
+    for i in range(count):
+        if i > 0 and rnd.random() < glitch_prob:
+            fix = offset(lat, long, rnd.uniform(1000.0, 3000.0), rnd.uniform(-3000.0, 3000.0))
+        else:
+            fix = offset(lat, long, rnd.gauss(0.0, jitter), rnd.gauss(0.0, jitter))
+        yield ts, common.Point(fix[0], fix[1], ts), i == count - 1
+
+        dt = interval * rnd.uniform(0.8, 1.2)
+        ts += dt
+        if stop_left > 0:
+            stop_left -= 1
+        elif rnd.random() < stop_prob:
+            stop_left = rnd.randint(3, int(2 * const.AFTER_PAUSE_TIME / interval))
+        else:
+            heading += rnd.gauss(0.0, 0.3)
+            lat, long = offset(lat, long, speed * dt * math.cos(heading), speed * dt * math.sin(heading))
+
+
+def tagged(trace, idx: int):
+    for i, (ts, point, final) in enumerate(trace):
+        yield ts, idx, i, point, final
+
+
+# Update JSON of all riders in the order of their timestamps
+def traffic(args):
+    rnd = random.Random(args.seed)
+    base_ts = time.time() - args.updates * args.interval
+    start_ts = [base_ts + rnd.uniform(0.0, args.interval) for _ in range(args.riders)]
+    traces = []
+    for idx in range(args.riders):
+        trace = rider_trace(random.Random(rnd.random()), start_ts[idx], args.updates, args.interval,
+            args.jitter, args.stop_prob, args.glitch_prob)
+        traces.append(tagged(trace, idx))
+
+    for update_id, (ts, idx, i, point, final) in enumerate(heapq.merge(*traces)):
+        yield test_utils.create_tg_location_json(update_id + 1, point, start_ts[idx], chat_id=900000000 + idx,
+            msg_id=idx + 1, usr_id=900000000 + idx, edited=i > 0, final_point=final)
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def redis_used_mb():
+    return int((await db.get_redis_async().info('memory'))['used_memory']) / 2**20
+
+
+def percentile(values: list, pct: int):
+    return statistics.quantiles(values, n=100)[pct - 1] if len(values) > 1 else values[0]
+
+
+async def run(args):
+    await db.get_redis_async().flushdb()
+    sesscache.get_session_cache().clear()
+    db.setup_redis()
+
+    context = test_utils.create_tg_context()
+    processor = dispatch.SessionOrderedProcessor(args.concurrency)
+    admission = asyncio.Semaphore(args.concurrency * 4) # updates dispatched and not handled yet
+    latencies = []
+    tasks = set()
+
+    async def handle(update):
+        t0 = time.perf_counter()
+        await geobot.cmd_message(update, context)
+        latencies.append(time.perf_counter() - t0)
+
+    async def process(update):
+        try:
+            await processor.process_update(update, handle(update))
+        finally:
+            admission.release()
+
+    rss_before = current_rss_mb()
+    redis_before = await redis_used_mb()
+    commands_before = await test_utils.redis_commands_processed()
+    generated = 0.0 # time spent building updates, shares the event loop with the handlers
+    t0 = time.perf_counter()
+    for i, update_json in enumerate(traffic(args)):
+        if args.rate > 0:
+            await asyncio.sleep(max(t0 + i / args.rate - time.perf_counter(), 0.0))
+        await admission.acquire()
+        gen_t0 = time.perf_counter()
+        update = telegram.Update.de_json(update_json, None)
+        generated += time.perf_counter() - gen_t0
+        task = asyncio.create_task(process(update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+    handled = time.perf_counter() - t0
+    await ingest.shutdown()
+    elapsed = time.perf_counter() - t0
+    commands = await test_utils.redis_commands_processed() - commands_before - 1 # the INFO call itself
+    redis_after = await redis_used_mb()
+    rss_after = current_rss_mb()
+    await db.close_redis_async()
+
+    total = len(latencies)
+    print(f'riders={args.riders}, updates/rider={args.updates}, total={total}, concurrency={args.concurrency}, '
+          f'rate={args.rate or "max"}')
+    print(f'throughput: {total / handled:.0f} updates/s, {total / (handled - generated):.0f} updates/s without building updates '
+          f'(stored in {elapsed:.1f} s)')
+    print(f'handler latency: p50={percentile(latencies, 50) * 1000:.2f} ms, p95={percentile(latencies, 95) * 1000:.2f} ms, '
+          f'p99={percentile(latencies, 99) * 1000:.2f} ms, max={max(latencies) * 1000:.2f} ms')
+    print(f'redis: {commands / total:.2f} commands/update')
+    print(f'memory: bot RSS {rss_before:.0f} -> {rss_after:.0f} MB, redis {redis_before:.1f} -> {redis_after:.1f} MB '
+          f'({(redis_after - redis_before) * 2**20 / total:.0f} bytes/update)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--riders', type=int, default=2000)
+    parser.add_argument('--updates', type=int, default=30, help='fixes per rider, the first and the last start and stop the live location')
+    parser.add_argument('--interval', type=float, default=10.0, help='seconds between fixes of a rider, in the traces')
+    parser.add_argument('--rate', type=float, default=0.0, help='updates dispatched per second, 0 - as fast as they are handled')
+    parser.add_argument('--concurrency', type=int, default=const.DEFAULT_CONCURRENT_UPDATES, help='updates handled at once')
+    parser.add_argument('--jitter', type=float, default=4.0, help='GPS noise, meters (standard deviation)')
+    parser.add_argument('--stop-prob', type=float, default=0.03, help='chance of a stop after a fix')
+    parser.add_argument('--glitch-prob', type=float, default=0.01, help='chance of an overspeed glitch')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING', help='level of the bot loggers')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=args.log_level)
+    asyncio.run(run(args))
@@ -0,0 +1,96 @@
+"""Location handler throughput with different logging setups (logconf.py).
+
+Every update goes through geobot.cmd_message, buffered by the ingestor (the window is long enough
+for nothing to be written to Redis), and through tracker.Tracker.update, as the batch write runs it.
+Both log per-update lines; log records are written to a file in a temporary directory.
+
+Setups:
+  sync      - records formatted and written by the handler itself (logging.basicConfig, as before)
+  queue     - logconf.setup(): records formatted and written by the listener thread
+  queue 1/N - logconf.setup() with LOG_SAMPLE=N
+  warning   - LOG_LEVEL=WARNING, per-update lines are not logged
+
+Runs offline. Run from the repository root:
+    PYTHONPATH=src:test:test/tests python3 test/bench/bench_logging.py --updates 20000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import telegram
+
+import common
+import geobot
+import ingest
+import logconf
+import tracker
+import test_utils
+
+
+def reset_logging():
+    logconf.shutdown()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+
+
+def setup_sync(stream):
+    reset_logging()
+    logconf.sample_every = 1
+    logging.basicConfig(stream=stream, format=logconf.FORMAT, level=logging.INFO)
+
+
+async def run_setup(updates: int):
+    os.environ['INGEST_WINDOW_MS'] = str(3600 * 1000)
+    os.environ['INGEST_MAX_BATCH'] = str(updates + 1)
+    ingest.ingestor = None
+    context = test_utils.create_tg_context()
+    start = common.Point(45.2393, 19.8412, time.time() - updates * 10.0)
+    sess_data = tracker.new_session_data(12345, 67890, 100, lat=start.latitude, long=start.longitude, timestamp=start.ts)
+    sess_data['id'] = 'session:c93840ba-8560-4a23-940f-0c23c45b8807'
+    sd = tracker.SessionData(sess_data)
+    tr = tracker.Tracker(sd, tracker.PointsData())
+    edits = []
+    for step in range(1, updates + 1):
+        # ~55 m north every 10 s, an idle edit every fifth step
+        pnt = common.Point(start.latitude + (step - step // 5) * 0.0005, start.longitude, start.ts + step * 10.0)
+        edits.append((pnt, telegram.Update.de_json(test_utils.create_tg_location_json(step, pnt, start.ts), None)))
+
+    t0 = time.perf_counter()
+    for pnt, upd in edits:
+        await geobot.cmd_message(upd, context)
+        tr.update(pnt)
+    elapsed = time.perf_counter() - t0
+    ingest.get_ingestor().pending.clear()
+    ingest.ingestor = None
+    return elapsed
+
+
+def run(updates: int, samples: list):
+    setups = [('sync', setup_sync)]
+    setups.append(('queue', lambda stream: logconf.setup('INFO', 1, stream)))
+    setups += [(f'queue 1/{n}', lambda stream, n=n: logconf.setup('INFO', n, stream)) for n in samples]
+    setups.append(('warning', lambda stream: logconf.setup('WARNING', 1, stream)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, setup in setups:
+            with open(os.path.join(tmp_dir, 'bot.log'), 'w') as stream:
+                setup(stream)
+                elapsed = asyncio.run(run_setup(updates))
+                t0 = time.perf_counter()
+                reset_logging() # drains the queue
+                drained = time.perf_counter() - t0
+                size = stream.tell()
+            print(f'{name:>12}: {updates / elapsed:9,.0f} updates/s, queue drained in {drained * 1000:6.1f} ms, '
+                  f'{size / updates:6.0f} log bytes/update')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--samples', type=int, nargs='+', default=[10, 100], help='LOG_SAMPLE values')
+    args = parser.parse_args()
+    run(args.updates, args.samples)
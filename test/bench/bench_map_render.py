@@ -0,0 +1,90 @@
+"""Render time and peak memory of the map renderers (MAP_RENDERER=cartopy/pil).
+
+Every render runs in a fresh process, as maps are rendered in worker processes,
+so the numbers include the import time of the renderer. Tiles are generated into
+a temporary directory and served from it, no network access is needed.
+
+Run from the repository root:
+    PYTHONPATH=src python3 test/bench/bench_map_render.py
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from PIL import Image
+
+import const
+import tiles
+
+# Straight-ish track of about 1.5x3 km with a lot of points
+START_LAT = 45.2393
+START_LON = 19.8412
+
+
+def make_track(points: int):
+    return [(START_LAT + i * 0.027 / points, START_LON + i * 0.013 / points + 0.0005 * (i % 7)) for i in range(points)]
+
+
+def make_tiles(path: str, track: list):
+    lats = [lat for lat, _ in track]
+    lons = [lon for _, lon in track]
+    for zoom in (const.MAP_DETAIL_LVL1, const.MAP_DETAIL_LVL2, const.MAP_DETAIL_LVL3):
+        for x, y in tiles.tiles_for_bbox(min(lats) - 0.01, min(lons) - 0.01, max(lats) + 0.01, max(lons) + 0.01, zoom):
+            os.makedirs(os.path.join(path, str(zoom), str(x)), exist_ok=True)
+            Image.new('RGB', (256, 256), ((x * 37) % 256, (y * 59) % 256, zoom * 10)).save(
+                os.path.join(path, str(zoom), str(x), f'{y}.png'))
+
+
+# Executed in the child process
+CHILD = '''
+import json, resource, sys, time
+t0 = time.perf_counter()
+import db, maps
+with open(sys.argv[1]) as f:
+    track = json.load(f)
+packed = b''.join(db.POINT_RECORD.pack(lat, lon, 1.7e9 + i, 1) for i, (lat, lon) in enumerate(track))
+maps.render_map(packed, sys.argv[2])
+elapsed = time.perf_counter() - t0
+print(json.dumps({'time': elapsed, 'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+'''
+
+
+def render(renderer: str, track_file: str, tile_dir: str, out_dir: str):
+    env = dict(os.environ)
+    env['MAP_RENDERER'] = renderer
+    env['TILE_URL'] = f'file://{tile_dir}/{{z}}/{{x}}/{{y}}.png'
+    env['TILE_CACHE_DIR'] = os.path.join(out_dir, f'cache-{renderer}')
+    fname = os.path.join(out_dir, f'map-{renderer}.jpg')
+    proc = subprocess.run([sys.executable, '-c', CHILD, track_file, fname],
+        env=env, capture_output=True, text=True, check=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['size'] = Image.open(fname).size
+    return result
+
+
+def run(renderers: list, points: int, repeat: int):
+    track = make_track(points)
+    with tempfile.TemporaryDirectory() as tmp:
+        tile_dir = os.path.join(tmp, 'server')
+        make_tiles(tile_dir, track)
+        track_file = os.path.join(tmp, 'track.json')
+        with open(track_file, 'w') as f:
+            json.dump(track, f)
+        for renderer in renderers:
+            results = [render(renderer, track_file, tile_dir, tmp) for _ in range(repeat)]
+            best = min(res['time'] for res in results)
+            rss = max(res['maxrss_kb'] for res in results)
+            width, height = results[0]['size']
+            print(f'{renderer:>8}: {best * 1000:8.1f} ms, peak RSS {rss / 1024:6.1f} MB, image {width}x{height}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--renderers', nargs='+', default=['cartopy', 'pil'])
+    parser.add_argument('--points', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.renderers, args.points, args.repeat)
@@ -0,0 +1,72 @@
+"""Redis memory per stored track point: indexed point:* hashes vs packed track:* records.
+
+Writes the same points in both layouts and compares the used_memory delta. The hash layout
+gets its own RediSearch index, like idx:point had, so the index memory is included.
+
+Needs a running redis-stack (REDIS_HOST/REDIS_PORT). Uses only bench:* keys and removes
+them afterwards. Run from the repository root:
+    PYTHONPATH=src:test:test/tests python3 test/bench/bench_point_memory.py --sessions 20 --points 1000
+"""
+import argparse
+import time
+import uuid
+
+from redis.commands.search.field import NumericField, TagField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+
+import db
+
+
+def used_memory(r):
+    return r.info('memory')['used_memory']
+
+
+def write_hashes(r, sessions: int, points: int, ts0: float):
+    r.ft('idx:bench_point').create_index(
+        (TagField('sess_id'), NumericField('ts')),
+        definition=IndexDefinition(prefix=['bench:point:'], index_type=IndexType.HASH))
+    for s in range(sessions):
+        sess_id = f'session:{uuid.uuid1()}'
+        pipe = r.pipeline(transaction=False)
+        for i in range(points):
+            pipe.hset(f'bench:point:{uuid.uuid1()}', mapping={
+                'sess_id': sess_id, 'usr_id': 900000001, 'latitude': 45.2 + i * 0.0005, 'longitude': 19.8 + s * 0.001,
+                'ts': ts0 + i * 10.0, 'segm_id': 1})
+        pipe.execute()
+
+
+def write_tracks(r, sessions: int, points: int, ts0: float):
+    for s in range(sessions):
+        key = f'bench:track:{uuid.uuid1()}'
+        pipe = r.pipeline(transaction=False)
+        for i in range(points):
+            pipe.append(key, db.POINT_RECORD.pack(45.2 + i * 0.0005, 19.8 + s * 0.001, ts0 + i * 10.0, 1))
+        pipe.execute()
+
+
+def cleanup(r):
+    try:
+        r.ft('idx:bench_point').dropindex(delete_documents=False)
+    except Exception:
+        pass
+    for key in r.scan_iter(match='bench:*', count=1000):
+        r.delete(key)
+
+
+def measure(r, name: str, writer, sessions: int, points: int):
+    cleanup(r)
+    before = used_memory(r)
+    writer(r, sessions, points, time.time())
+    delta = used_memory(r) - before
+    print(f'{name:>7}: {delta / (sessions * points):7.1f} bytes/point')
+    cleanup(r)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--points', type=int, default=1000)
+    args = parser.parse_args()
+    r = db.get_redis()
+    measure(r, 'hashes', write_hashes, args.sessions, args.points)
+    measure(r, 'tracks', write_tracks, args.sessions, args.points)
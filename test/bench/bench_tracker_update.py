@@ -0,0 +1,97 @@
+"""Updates per second of tracker.Tracker.update with the slotted tracker.SessionData
+against the previous dict-backed implementation (DictSessionData below).
+
+Sessions are loaded from string fields, as they come from Redis HGETALL; each session gets
+a few edits, as one ingestion batch does, then get_updates() is called. The distance backend
+is the fast one and logging is off, so the figures are dominated by the session record and the filter.
+
+Run from the repository root:
+    PYTHONPATH=src python3 test/bench/bench_tracker_update.py
+"""
+import argparse
+import logging
+import time
+
+import common
+import tracker
+
+
+# Previous SessionData: updates dict on top of the loaded data, conversion on every read
+class DictSessionData:
+    valid_data_fields = set(tracker.new_session_data(1, 1, 1).keys()) | {'id'}
+    int_fields = tracker.SessionData.int_fields
+    float_fields = tracker.SessionData.float_fields
+
+    def __init__(self, session_data):
+        self.__dict__['data'] = session_data
+        self.__dict__['updates'] = dict()
+
+    def __getattr__(self, name):
+        updates = self.__dict__['updates']
+        assert name in DictSessionData.__dict__['valid_data_fields']
+        value = None
+        if name in updates:
+            value = updates[name]
+        else:
+            sess_data = self.__dict__['data']
+            if isinstance(sess_data, dict) and name in sess_data.keys():
+                value = sess_data[name]
+            else:
+                value = getattr(sess_data, name, None)
+        if value is not None:
+            if name in DictSessionData.__dict__['int_fields']:
+                value = int(value)
+            elif name in DictSessionData.__dict__['float_fields']:
+                value = float(value)
+            return value
+        raise AttributeError(f"SessionData object has no attribute '{name}'")
+
+    def __setattr__(self, name, value):
+        self.__dict__['updates'][name] = value
+
+    def get_updates(self):
+        return self.__dict__['updates']
+
+
+def make_session(start: common.Point):
+    data = tracker.new_session_data(900000001, 900000001, 1, lat=start.latitude, long=start.longitude, timestamp=start.ts)
+    data = {field: str(value) for field, value in data.items()} # as read from Redis
+    data['id'] = 'session:c93840ba-8560-4a23-940f-0c23c45b8807'
+    return data
+
+
+def make_edits(start: common.Point, count: int):
+    # ~55 m north every 10 s, with an idle edit every fifth step
+    edits = []
+    for i in range(1, count + 1):
+        step = i - i // 5
+        edits.append(common.Point(start.latitude + step * 0.0005, start.longitude, start.ts + i * 10.0))
+    return edits
+
+
+def updates_per_sec(session_class, sessions: int, edits: list, start: common.Point):
+    data = make_session(start)
+    t0 = time.perf_counter()
+    for _ in range(sessions):
+        sd = session_class(data)
+        tr = tracker.Tracker(sd, tracker.PointsData())
+        for pnt in edits:
+            tr.update(pnt)
+        sd.get_updates()
+    return sessions * len(edits) / (time.perf_counter() - t0)
+
+
+def run(sessions: int, edits_per_session: int):
+    start = common.Point(45.2393, 19.8412, 1747498800.0)
+    edits = make_edits(start, edits_per_session)
+    for name, session_class in [('dict (previous)', DictSessionData), ('slots', tracker.SessionData)]:
+        print(f'{name:>16}: {updates_per_sec(session_class, sessions, edits, start):10,.0f} updates/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=20000)
+    parser.add_argument('--edits', type=int, default=5, help='edits per session')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    run(args.sessions, args.edits)
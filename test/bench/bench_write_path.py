@@ -0,0 +1,75 @@
+"""Updates/sec of the per-edit write path: sequential commands vs one db.store_update script call.
+
+"sequential" replays what cmd_message used to do for an accepted edit (HSET of the point hash,
+then HSET of the changed session fields), "script" is the single round trip of db.store_update.
+The session lookup is not part of this measurement.
+
+Needs a running redis-stack (REDIS_HOST/REDIS_PORT). Run from the repository root:
+    PYTHONPATH=src:test:test/tests python3 test/bench/bench_write_path.py --updates 5000
+"""
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+
+import common
+import db
+import tracker
+
+
+def make_session(sess_id: str):
+    data = tracker.new_session_data(900000001, 900000001, 1, lat=45.2, long=19.8, timestamp=time.time())
+    data['id'] = sess_id
+    return data
+
+
+def next_update(data: dict, step: int):
+    sd = tracker.SessionData(data)
+    pnt = common.Point(45.2 + step * 0.0005, 19.8, data['ts'] + step * 10.0)
+    sd.last_lat = pnt.latitude
+    sd.last_long = pnt.longitude
+    sd.last_update = pnt.ts
+    sd.length = step * 55.6
+    sd.duration = step * 10.0
+    sd.track_segm_len = step + 1
+    return sd, pnt
+
+
+async def write_sequential(r, sd: tracker.SessionData, pnt: common.Point):
+    await r.hset(f'point:{uuid.uuid1()}', mapping={
+        'sess_id': sd.id, 'usr_id': sd.usr_id, 'latitude': pnt.latitude, 'longitude': pnt.longitude,
+        'ts': pnt.ts, 'segm_id': sd.track_segm_idx})
+    await r.hset(sd.id, mapping=sd.get_updates())
+
+
+async def write_script(r, sd: tracker.SessionData, pnt: common.Point):
+    await db.store_update(sd, [pnt], pnt.ts)
+
+
+async def measure(name: str, writer, updates: int):
+    r = db.get_redis_async()
+    sess_id = f'session:{uuid.uuid1()}'
+    data = make_session(sess_id)
+    await r.hset(sess_id, mapping=data)
+    t0 = time.perf_counter()
+    for step in range(1, updates + 1):
+        sd, pnt = next_update(data, step)
+        await writer(r, sd, pnt)
+    elapsed = time.perf_counter() - t0
+    print(f'{name:>10}: {updates / elapsed:8.0f} updates/s')
+
+
+async def run(updates: int):
+    await measure('sequential', write_sequential, updates)
+    await measure('script', write_script, updates)
+    await db.close_redis_async()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=5000)
+    args = parser.parse_args()
+    logging.getLogger('geobot-db').setLevel(logging.WARNING)
+    db.setup_redis()
+    asyncio.run(run(args.updates))
@@ -14,6 +14,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 import db
+import sesscache
 from redis.commands.search.field import TextField, NumericField, TagField
 from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 
@@ -43,17 +44,25 @@ def redis_connection():
 def setup_test_db(redis_connection):
     logger.info("SETTING UP TEST DATABASE")
     redis_connection.flushall()
+    sesscache.get_session_cache().clear()
     db.setup_redis()
     yield redis_connection
     logger.info("CLEANING UP TEST DATABASE")
     redis_connection.flushall()
 
 
+# Generated GPX files are cached on disk; keep them out of the working directory
+@pytest.fixture(autouse=True)
+def gpx_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('GPX_CACHE_DIR', str(tmp_path / 'gpx-cache'))
+
+
 @pytest.fixture
 def mock_context():
     context = MagicMock(spec=telegram.ext.ContextTypes.DEFAULT_TYPE)
     context.bot = AsyncMock(spec=telegram.Bot)
     context.args = []
+    context.bot_data = {}
     return context
 
 
@@ -1,7 +1,17 @@
 import pytest
 import geobot
-import db
+import db_sync
 import cases_data
+import ingest
+
+
+# Every test runs with updates written by the handler and with the ingestion buffer on
+@pytest.fixture(autouse=True, params=['0', '200'], ids=['store_now', 'buffered'])
+async def ingest_window(request, monkeypatch):
+    monkeypatch.setenv('INGEST_WINDOW_MS', request.param)
+    monkeypatch.setattr(ingest, 'ingestor', None)
+    yield request.param
+    await ingest.shutdown()
 
 
 @pytest.mark.asyncio
@@ -11,7 +21,7 @@ async def test_new_session(mock_update_factory, mock_context, mock_location_fact
 
     await geobot.cmd_message(update, mock_context)
 
-    sessions, total = db.get_sessions(update.effective_user.id, 0, 10, True)
+    sessions, total = db_sync.get_sessions(update.effective_user.id, 0, 10)
     assert total == 1
     assert len(sessions) == 1
     
@@ -32,7 +42,7 @@ async def test_static_location(mock_update_factory, mock_context, mock_location_
 
     await geobot.cmd_message(update, mock_context)
 
-    sessions, total = db.get_sessions(update.effective_user.id, 0, 10, True)
+    sessions, total = db_sync.get_sessions(update.effective_user.id, 0, 10)
     assert total == 0
     
     mock_context.bot.send_message.assert_not_called()
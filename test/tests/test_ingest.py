@@ -0,0 +1,111 @@
+import asyncio
+import random
+import pytest
+import cases_data
+import common
+import db
+import db_sync
+import geobot
+import ingest
+import test_utils
+import tracker
+
+
+@pytest.fixture
+def batching(monkeypatch):
+    monkeypatch.setenv('INGEST_WINDOW_MS', '1000')
+    monkeypatch.setattr(ingest, 'ingestor', None)
+
+
+def get_sess_id(start_upd):
+    live_key = db.get_live_key(start_upd.effective_user.id, start_upd.message.chat.id, start_upd.message.message_id)
+    return db.get_redis().get(live_key)
+
+
+async def send_track(context, track, final: bool):
+    start_upd = test_utils.create_tg_start_update(track[0][0])
+    await geobot.cmd_message(start_upd, context)
+    for segment in track:
+        for point in segment:
+            if point is track[0][0]:
+                continue
+            final_point = final and point is track[-1][-1]
+            await geobot.cmd_message(test_utils.create_tg_location_update(start_upd, point, final_point=final_point), context)
+    return start_upd
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('cs', [cases_data.smoke, cases_data.general_idling, cases_data.speeding])
+async def test_batched_track(mock_context, batching, cs):
+    start_upd = await send_track(mock_context, cs.track, final=True)
+    await ingest.shutdown()
+
+    info, segments = db_sync.get_track(get_sess_id(start_upd))
+    assert info.length == pytest.approx(cs.expect_length, 1.0)
+    assert info.duration == pytest.approx(cs.expect_duration, 0.1)
+    assert info.points_total == cs.expect_gpx_points
+    # start and the final update are stored right away, all edits in between in one batch
+    assert info.rev == 2
+    assert db.get_redis().zscore('maps:todo', get_sess_id(start_upd)) is not None
+
+
+@pytest.mark.asyncio
+async def test_flush_on_shutdown(mock_context, batching):
+    start_upd = await send_track(mock_context, cases_data.smoke.track, final=False)
+    info, _ = db_sync.get_track(get_sess_id(start_upd))
+    assert info.points_total == 1
+
+    await ingest.shutdown()
+    info, _ = db_sync.get_track(get_sess_id(start_upd))
+    assert info.points_total == cases_data.smoke.expect_gpx_points
+
+
+# A batch stored with its reply lost is retried without storing its updates twice
+@pytest.mark.asyncio
+@pytest.mark.parametrize('cs', [cases_data.smoke, cases_data.general_idling, cases_data.speeding])
+async def test_stored_batch_retried(mock_context, batching, monkeypatch, cs):
+    monkeypatch.setattr(ingest.const, 'INGEST_RETRY_DELAY', 0.01)
+    store_batch = ingest.store_batch
+    calls = []
+    async def store_batch_lost_reply(batch: dict):
+        sess_ids = await store_batch(batch)
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise ConnectionError('Connection closed by server')
+        return sess_ids
+    monkeypatch.setattr(ingest, 'store_batch', store_batch_lost_reply)
+
+    start_upd = await send_track(mock_context, cs.track, final=False)
+    await ingest.shutdown()
+
+    info, _ = db_sync.get_track(get_sess_id(start_upd))
+    assert info.length == pytest.approx(cs.expect_length, 1.0)
+    assert info.duration == pytest.approx(cs.expect_duration, 0.1)
+    assert info.points_total == cs.expect_gpx_points
+
+
+# Interleaved edits of many sessions stored concurrently give the same sessions as the tracker run over each track
+@pytest.mark.asyncio
+async def test_concurrent_store_now():
+    rnd = random.Random(4)
+    tracks = {100 + i: test_utils.random_track(rnd, common.Point(45.2393 + i * 0.01, 19.8412, 1747498800.0), 50)
+        for i in range(40)}
+    chat = test_utils.create_tg_update().message.chat
+    await asyncio.gather(*(ingest.store_now(12345, msg_id, chat, point, point is tracks[msg_id][0])
+        for msg_id, point in test_utils.interleave_tracks(rnd, tracks)))
+
+    for msg_id, track in tracks.items():
+        sd = tracker.SessionData(tracker.new_session_data(12345, chat.id, msg_id, lat=track[0].latitude,
+            long=track[0].longitude, timestamp=track[0].ts) | {'id': 'session:serial'})
+        pd = tracker.PointsData()
+        tr = tracker.Tracker(sd, pd)
+        for point in track:
+            tr.update(point, location_is_new=point is track[0])
+
+        sess_id = db.get_redis().get(db.get_live_key(12345, chat.id, msg_id))
+        info, segments = db_sync.get_track(sess_id)
+        assert info.length == pytest.approx(sd.length)
+        assert info.duration == pytest.approx(sd.duration)
+        assert info.points_total == len(pd.points)
+        assert [(pnt.latitude, pnt.longitude) for segm in segments for pnt in segm] == \
+            [(pnt.latitude, pnt.longitude) for pnt in pd.points]
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import signal
+import types
+import pytest
+import const
+import db
+import db_sync
+import maps
+import metrics
+import migrate
+
+SESS_ID1 = 'session:c93840ba-8560-4a23-940f-0c23c45b8807'
+SESS_ID2 = 'session:d04951cb-8560-4a23-940f-0c23c45b8807'
+
+
+def acquire():
+    job = db_sync.acquire_map_job()
+    return job.sess_id if job is not None else None
+
+
+def test_acquire_finish():
+    db_sync.add_map_job(SESS_ID1)
+    db_sync.add_map_job(SESS_ID1)
+    assert db.get_map_queue_stats().todo == 1
+
+    job = db_sync.acquire_map_job()
+    assert job == (SESS_ID1, 1)
+    assert acquire() is None
+    stats = db.get_map_queue_stats()
+    assert (stats.todo, stats.inprog, stats.dead) == (0, 1, 0)
+
+    assert db_sync.finish_map_job(job)
+    assert db_sync.is_map_available(SESS_ID1)
+    stats = db.get_map_queue_stats()
+    assert (stats.todo, stats.inprog, stats.dead) == (0, 0, 0)
+
+
+
+def test_queue_metrics():
+    db_sync.add_map_job(SESS_ID1)
+    lines = metrics.render().splitlines()
+    assert 'geobot_map_queue_jobs{queue="todo"} 1' in lines
+    assert 'geobot_map_queue_jobs{queue="inprog"} 0' in lines
+    age = [line for line in lines if line.startswith('geobot_map_queue_oldest_age_seconds ')]
+    assert len(age) == 1 and float(age[0].split()[1]) >= 0.0
+
+def test_jobs_in_order():
+    db_sync.add_map_job(SESS_ID1)
+    db_sync.add_map_job(SESS_ID2)
+    assert acquire() == SESS_ID1
+    assert acquire() == SESS_ID2
+
+
+def test_expired_lease_redelivery(monkeypatch):
+    monkeypatch.setenv('MAP_JOB_LEASE_TIME', '-1')
+    db_sync.add_map_job(SESS_ID1)
+    for _ in range(const.MAP_JOB_MAX_ATTEMPTS):
+        assert acquire() == SESS_ID1
+
+    # Out of attempts: the expired lease goes to the dead letter set
+    assert acquire() is None
+    stats = db.get_map_queue_stats()
+    assert (stats.todo, stats.inprog, stats.dead) == (0, 0, 1)
+
+
+def test_failed_job_retries():
+    db_sync.add_map_job(SESS_ID1)
+    for _ in range(const.MAP_JOB_MAX_ATTEMPTS):
+        job = db_sync.acquire_map_job()
+        assert job.sess_id == SESS_ID1
+        db_sync.fail_map_job(job)
+    assert acquire() is None
+    assert db.get_map_queue_stats().dead == 1
+
+
+# A worker renewing its lease keeps the job; after the lease expires the job is given to another worker,
+# and the first one can neither renew nor finish it
+def test_lease_renewal(monkeypatch):
+    db_sync.add_map_job(SESS_ID1)
+    job = db_sync.acquire_map_job()
+    assert db_sync.renew_map_job(job)
+    assert acquire() is None
+
+    monkeypatch.setenv('MAP_JOB_LEASE_TIME', '-1')
+    assert db_sync.renew_map_job(job) # the lease expires right away
+    other = db_sync.acquire_map_job()
+    assert other == (SESS_ID1, 2)
+    assert not db_sync.renew_map_job(job)
+    assert not db_sync.finish_map_job(job)
+    db_sync.fail_map_job(job)
+    assert db.get_map_queue_stats().inprog == 1
+    assert not db_sync.is_map_available(SESS_ID1)
+
+    assert db_sync.finish_map_job(other)
+    assert db_sync.is_map_available(SESS_ID1)
+
+
+def test_convert_map_queue(setup_test_db):
+    r = setup_test_db
+    r.sadd('maps:todo', SESS_ID1)
+    r.sadd('maps:inprog', SESS_ID2)
+
+    assert migrate.convert_map_queue(r) == 2
+    assert db.get_map_queue_stats().todo == 2
+    assert {acquire(), acquire()} == {SESS_ID1, SESS_ID2}
+
+
+# The worker renews the lease while the map is rendered, so the job is not given to another worker
+@pytest.mark.asyncio
+async def test_lease_renewed_while_rendering(monkeypatch):
+    monkeypatch.setenv('MAP_JOB_LEASE_TIME', '0.3')
+    rendering = asyncio.Event()
+    async def create_map(sess_id):
+        rendering.set()
+        await asyncio.sleep(1.0)
+    monkeypatch.setattr(maps, 'create_map', create_map)
+
+    db_sync.add_map_job(SESS_ID1)
+    task = asyncio.create_task(maps.try_create_map())
+    await rendering.wait()
+    await asyncio.sleep(0.5)
+    assert await db.acquire_map_job() is None
+    assert await task
+    assert db_sync.is_map_available(SESS_ID1)
+
+
+# Stand-in of maps.render_map, run in the rendering processes
+def render_stub(packed: bytes, fname: str):
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname, 'wb') as f:
+        f.write(packed)
+
+
+# A rendering process killed (e.g. by the OOM killer) breaks the pool: the job is returned to the queue
+# without spending an attempt and the next one is rendered by new processes
+@pytest.mark.asyncio
+async def test_broken_pool(monkeypatch, tmp_path):
+    monkeypatch.setenv('MAP_IMAGES_DIR', str(tmp_path))
+    monkeypatch.setenv('MAP_WORKERS', '1')
+    monkeypatch.setattr(maps, 'render_map', render_stub)
+    async def get_track_data(sess_id):
+        return types.SimpleNamespace(points_total=const.MIN_POINTS_FOR_MAP), b'map'
+    monkeypatch.setattr(db, 'get_track_data', get_track_data)
+
+    pool = maps.get_executor()
+    pid = await asyncio.get_running_loop().run_in_executor(pool, os.getpid)
+    os.kill(pid, signal.SIGKILL)
+    while not pool._broken:
+        await asyncio.sleep(0.01)
+
+    try:
+        db_sync.add_map_job(SESS_ID1)
+        assert await maps.try_create_map()
+        stats = db.get_map_queue_stats()
+        assert (stats.todo, stats.inprog, stats.dead) == (1, 0, 0)
+        assert not db_sync.is_map_available(SESS_ID1)
+
+        assert await maps.try_create_map()
+        assert db_sync.is_map_available(SESS_ID1)
+        assert maps.get_executor() is not pool
+        with open(maps.get_filename(SESS_ID1), 'rb') as f:
+            assert f.read() == b'map'
+    finally:
+        maps.shutdown_executor()
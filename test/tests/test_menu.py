@@ -1,4 +1,6 @@
+import datetime
 import pytest
+import telegram
 import geobot
 import test_utils
 import const
@@ -21,6 +23,10 @@ async def test_cmd_start_deeplink(mock_update_factory, mock_context):
     payload = deep_link.split('start=')[1]
     mock_context.args = [payload]
 
+    # The document is a temporary file, closed once it is sent
+    sent_documents = []
+    mock_context.bot.send_document.side_effect = lambda chat_id, document: sent_documents.append(document.input_file_content.read())
+
     start_update = mock_update_factory()
     start_update.message.from_user.id = start_upd.effective_user.id
     await geobot.cmd_start(start_update, mock_context)
@@ -29,7 +35,7 @@ async def test_cmd_start_deeplink(mock_update_factory, mock_context):
     assert mock_context.bot.deleteMessage.call_count == 1
     assert mock_context.bot.send_document.call_count == 1
 
-    gpx_from_deeplink = mock_context.bot.send_document.call_args[0][1].input_file_content.decode('utf-8')
+    gpx_from_deeplink = sent_documents[0].decode('utf-8')
     assert gpx_from_deeplink == expected_gpx
 
     track_info = mock_context.bot.send_message.call_args[1]['text']
@@ -37,3 +43,29 @@ async def test_cmd_start_deeplink(mock_update_factory, mock_context):
     assert 'Length' in track_info
     assert 'duration' in track_info
     assert deep_link in track_info
+
+
+@pytest.mark.asyncio
+async def test_resend_by_file_id(mock_context, mock_update_factory):
+    track = [
+        [
+            test_utils.make_point(45.23996, 19.84185, "2025-05-11 21:44:20"),
+            test_utils.make_point(45.24060, 19.84200, "2025-05-11 21:44:50"),
+        ],
+    ]
+    _, _, session_id = await test_utils.help_test_gpx_data(mock_context, track, 2, 71.2, 30.0)
+
+    uploaded = []
+    async def send_document(chat_id, document):
+        uploaded.append(document)
+        return telegram.Message(1, datetime.datetime.now(), telegram.Chat(chat_id, 'private'),
+            document=telegram.Document('gpx-file-id', 'gpx-unique-id'))
+    mock_context.bot.send_document.side_effect = send_document
+
+    update = mock_update_factory()
+    await geobot.output_track_to_chat(session_id, update, mock_context)
+    await geobot.output_track_to_chat(session_id, update, mock_context)
+
+    assert mock_context.bot.send_document.call_count == 2
+    assert isinstance(uploaded[0], telegram.InputFile)
+    assert uploaded[1] == 'gpx-file-id'
@@ -0,0 +1,79 @@
+import pytest
+import geobot
+import db
+import db_sync
+import common
+import migrate
+import tracker
+import test_utils
+import cases_data
+
+
+@pytest.mark.asyncio
+async def test_live_key_created_with_session(mock_context, mock_location_start_factory):
+    start_upd = mock_location_start_factory(test_utils.make_point(45.23930, 19.84120, "2025-05-17 16:20:00"))
+    await geobot.cmd_message(start_upd, mock_context)
+
+    sessions, total = db_sync.get_sessions(start_upd.effective_user.id, 0, 10)
+    assert total == 1
+    live_key = db.get_live_key(start_upd.effective_user.id, start_upd.message.chat.id, start_upd.message.message_id)
+    assert db.get_redis().get(live_key) == sessions[0].id
+
+
+def test_backfill_live_keys(setup_test_db):
+    r = setup_test_db
+    r.hset('session:c93840ba-8560-4a23-940f-0c23c45b8807', mapping=tracker.new_session_data(11, 22, 33))
+    r.hset('session:d04951cb-8560-4a23-940f-0c23c45b8807', mapping=tracker.new_session_data(11, 22, 34))
+    r.set(db.get_live_key(11, 22, 34), 'session:d04951cb-8560-4a23-940f-0c23c45b8807')
+
+    assert migrate.backfill_live_keys(r) == 1
+    assert r.get(db.get_live_key(11, 22, 33)) == 'session:c93840ba-8560-4a23-940f-0c23c45b8807'
+    assert migrate.backfill_live_keys(r) == 0
+
+
+def test_convert_points_to_tracks(setup_test_db):
+    r = setup_test_db
+    sess_id = 'session:c93840ba-8560-4a23-940f-0c23c45b8807'
+    r.hset(sess_id, mapping=tracker.new_session_data(11, 22, 33))
+    r.hset('point:1', mapping={'sess_id': sess_id, 'usr_id': 11, 'latitude': 45.24060, 'longitude': 19.84200, 'ts': 1747498830.0, 'segm_id': 1})
+    r.hset('point:2', mapping={'sess_id': sess_id, 'usr_id': 11, 'latitude': 45.23930, 'longitude': 19.84120, 'ts': 1747498800.0, 'segm_id': 1})
+    r.hset('point:3', mapping={'sess_id': sess_id, 'usr_id': 11, 'latitude': 45.24122, 'longitude': 19.84237, 'ts': 1747498870.0})
+
+    assert migrate.convert_points_to_tracks(r) == 3
+    assert r.keys('point:*') == []
+
+    info, segments = db_sync.get_track(sess_id)
+    assert info.points_total == 3
+    assert segments == [[
+        common.Point(45.23930, 19.84120, 1747498800.0),
+        common.Point(45.24060, 19.84200, 1747498830.0),
+        common.Point(45.24122, 19.84237, 1747498870.0),
+    ]]
+
+
+def test_backfill_points_num(setup_test_db):
+    r = setup_test_db
+    sess_id = 'session:c93840ba-8560-4a23-940f-0c23c45b8807'
+    fields = tracker.new_session_data(11, 22, 33)
+    del fields['points_num']
+    r.hset(sess_id, mapping=fields)
+    r.set(db.get_track_key(sess_id), db.POINT_RECORD.pack(45.2393, 19.8412, 1747498800.0, 1) * 7)
+
+    assert migrate.backfill_points_num(r) == 1
+    sessions, total = db_sync.get_sessions(11, 0, 10)
+    assert total == 1
+    assert sessions[0].points_num == 7
+
+
+def test_recompute_stats(setup_test_db):
+    r = setup_test_db
+    sess_id = 'session:c93840ba-8560-4a23-940f-0c23c45b8807'
+    r.hset(sess_id, mapping=tracker.new_session_data(11, 22, 33))
+    segments = cases_data.smoke.track
+    r.set(db.get_track_key(sess_id), b''.join(db.POINT_RECORD.pack(p.latitude, p.longitude, p.ts, i + 1)
+        for i, segm in enumerate(segments) for p in segm))
+
+    assert migrate.recompute_stats(r) == 1
+    assert float(r.hget(sess_id, 'length')) == pytest.approx(cases_data.smoke.expect_length, 1.0)
+    assert float(r.hget(sess_id, 'duration')) == pytest.approx(cases_data.smoke.expect_duration, 0.1)
+    assert int(r.hget(sess_id, 'points_num')) == sum(len(segm) for segm in segments)
@@ -0,0 +1,76 @@
+import pytest
+import cases_data
+import db
+import geobot
+import metrics
+import sesscache
+import test_utils
+
+
+def get_live_key(start_upd):
+    return db.get_live_key(start_upd.effective_user.id, start_upd.message.chat.id, start_upd.message.message_id)
+
+
+@pytest.mark.asyncio
+async def test_cached_session(mock_context, setup_test_db):
+    r = setup_test_db
+    track = cases_data.smoke.track[0]
+    start_upd = test_utils.create_tg_start_update(track[0])
+    await geobot.cmd_message(start_upd, mock_context)
+    await geobot.cmd_message(test_utils.create_tg_location_update(start_upd, track[1]), mock_context)
+
+    sess_id = r.get(get_live_key(start_upd))
+    cached = sesscache.get_session_cache().get(get_live_key(start_upd))
+    assert cached['id'] == sess_id
+    for field in ('ver', 'rev', 'points_num', 'track_segm_len'):
+        assert int(cached[field]) == int(r.hget(sess_id, field))
+    for field in ('length', 'duration', 'last_update', 'last_lat', 'last_long'):
+        assert float(cached[field]) == pytest.approx(float(r.hget(sess_id, field)))
+
+
+@pytest.mark.asyncio
+async def test_session_changed_by_other_instance(mock_context, setup_test_db):
+    r = setup_test_db
+    track = cases_data.smoke.track[0]
+    start_upd = test_utils.create_tg_start_update(track[0])
+    await geobot.cmd_message(start_upd, mock_context)
+    await geobot.cmd_message(test_utils.create_tg_location_update(start_upd, track[1]), mock_context)
+    sess_id = r.get(get_live_key(start_upd))
+
+    # another bot instance stores an update of the same session
+    length = float(r.hget(sess_id, 'length'))
+    r.hset(sess_id, 'length', length + 1000.0)
+    r.hincrby(sess_id, 'ver', 1)
+
+    await geobot.cmd_message(test_utils.create_tg_location_update(start_upd, track[2]), mock_context)
+    assert float(r.hget(sess_id, 'length')) == pytest.approx(cases_data.smoke.expect_length + 1000.0, 1.0)
+    assert int(r.hget(sess_id, 'points_num')) == 3
+    assert int(sesscache.get_session_cache().get(get_live_key(start_upd))['ver']) == int(r.hget(sess_id, 'ver'))
+
+
+@pytest.mark.asyncio
+async def test_session_evicted(mock_context, setup_test_db, monkeypatch):
+    r = setup_test_db
+    monkeypatch.setattr(sesscache, 'session_cache', sesscache.SessionCache(0, 60.0))
+    await cases_data.help_test_gpx_data(mock_context, cases_data.smoke)
+
+
+# Sessions found in the cache are not counted as Redis round trips
+@pytest.mark.asyncio
+async def test_cache_hits_not_timed(mock_context):
+    track = cases_data.smoke.track[0]
+    start_upd = test_utils.create_tg_start_update(track[0])
+    await geobot.cmd_message(start_upd, mock_context)
+    live_key = get_live_key(start_upd)
+
+    def counts():
+        series = metrics.REDIS_SECONDS.series.get(('get_live_sessions',))
+        lookups = sesscache.LOOKUPS.values
+        return sum(series[:-1]) if series else 0, lookups.get(('hit',), 0), lookups.get(('miss',), 0)
+    before = counts()
+    assert (await db.get_live_sessions([live_key]))[0] is not None
+    assert counts() == (before[0], before[1] + 1, before[2])
+
+    sesscache.get_session_cache().clear()
+    assert (await db.get_live_sessions([live_key]))[0] is not None
+    assert counts() == (before[0] + 1, before[1] + 1, before[2] + 1)
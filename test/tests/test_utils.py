@@ -1,10 +1,14 @@
 import datetime
-import db
+import random
+import db_sync
 import geobot
 import pytest
 import telegram
+import telegram.ext
 import common
-from unittest.mock import MagicMock
+import const
+import db
+from unittest.mock import AsyncMock, MagicMock
 
 
 def create_datetime(date_str):
@@ -37,6 +41,14 @@ def create_tg_update():
     return update
 
 
+def create_tg_context():
+    context = MagicMock(spec=telegram.ext.ContextTypes.DEFAULT_TYPE)
+    context.bot = AsyncMock(spec=telegram.Bot)
+    context.args = []
+    context.bot_data = {}
+    return context
+
+
 def create_tg_location(latitude=45.2393, longitude=19.8412, live_period=3600):
     location = MagicMock(spec=telegram.Location)
     location.latitude = latitude
@@ -52,6 +64,16 @@ def create_tg_start_update(point: common.Point):
     return result
 
 
+# Start update of a rider of the benchmarks, in a chat and live location of its own
+def create_tg_rider_start_update(idx: int, base_ts: float):
+    start = common.Point(45.2 + idx * 0.001, 19.8, base_ts)
+    upd = create_tg_start_update(start)
+    upd.message.from_user.id = 900000000 + idx
+    upd.message.chat.id = 900000000 + idx
+    upd.message.message_id = idx + 1
+    return start, upd
+
+
 def create_tg_location_update(prev_update: MagicMock, point: common.Point, final_point=False):
     result = create_tg_update()
 
@@ -83,12 +105,12 @@ async def help_test_gpx_data(context, segments: list[list[common.Point]],
             final_point = point is segments[-1][-1]
             await geobot.cmd_message(create_tg_location_update(start_upd, point, final_point=final_point), context)
 
-    sessions, total = db.get_sessions(start_upd.effective_user.id, 0, 10, True)
+    sessions, total = db_sync.get_sessions(start_upd.effective_user.id, 0, 10)
     assert total == 1
     assert len(sessions) == 1
     assert sessions[0].points_num == exp_points_num
 
-    info, db_segments = db.get_track(sessions[0].id)
+    info, db_segments = db_sync.get_track(sessions[0].id)
     assert info.length == pytest.approx(exp_length, 1.0)
     assert info.duration == pytest.approx(exp_duration, 0.1)
     gpx_data = geobot.create_gpx_data(db_segments)
@@ -103,3 +125,64 @@ async def help_test_gpx_data(context, segments: list[list[common.Point]],
     exp_gpx_data = geobot.create_gpx_data(filtered_segments)
     assert gpx_data == exp_gpx_data
     return exp_gpx_data, start_upd, sessions[0].id
+
+
+# Update JSON as Telegram posts it to the webhook
+def create_tg_location_json(update_id: int, point: common.Point, start_ts: float, chat_id=67890, msg_id=100, usr_id=12345,
+        edited=True, final_point=False):
+    location = {'latitude': point.latitude, 'longitude': point.longitude}
+    if not final_point:
+        location['live_period'] = 3600
+    message = {
+        'message_id': msg_id,
+        'date': int(start_ts),
+        'chat': {'id': chat_id, 'type': 'private', 'username': 'test_user'},
+        'from': {'id': usr_id, 'is_bot': False, 'first_name': 'Test User'},
+        'location': location,
+    }
+    if edited:
+        message['edit_date'] = int(point.ts)
+    return {'update_id': update_id, 'edited_message' if edited else 'message': message}
+
+
+def create_tg_track_json(track: list[list[common.Point]], chat_id=67890, msg_id=100, usr_id=12345, final=True):
+    points = [point for segment in track for point in segment]
+    result = []
+    for i, point in enumerate(points):
+        result.append(create_tg_location_json(i + 1, point, points[0].ts, chat_id, msg_id, usr_id,
+            edited=i > 0, final_point=final and i == len(points) - 1))
+    return result
+
+
+# Live location of count points: ~40 m steps every 5-15 s with idling, overspeed glitches and pauses
+def random_track(rnd: random.Random, start: common.Point, count: int):
+    points = [start]
+    lat, long, ts = start
+    for _ in range(count - 1):
+        kind = rnd.random()
+        ts += rnd.uniform(5.0, 15.0)
+        if kind < 0.1:
+            ts += const.AFTER_PAUSE_TIME
+        elif kind < 0.2:
+            lat += rnd.choice((-1, 1)) * 0.01
+        elif kind > 0.3:
+            lat += rnd.uniform(0.0003, 0.0005)
+        points.append(common.Point(lat, long, ts))
+    return points
+
+
+# (key, point) edits of all tracks in a random arrival order; points of every track stay in their order
+def interleave_tracks(rnd: random.Random, tracks: dict):
+    arrivals = [key for key, track in tracks.items() for _ in track]
+    rnd.shuffle(arrivals)
+    positions = dict.fromkeys(tracks.keys(), 0)
+    edits = []
+    for key in arrivals:
+        edits.append((key, tracks[key][positions[key]]))
+        positions[key] += 1
+    return edits
+
+
+# Commands processed by Redis so far (INFO stats), including the INFO call itself
+async def redis_commands_processed():
+    return int((await db.get_redis_async().info('stats'))['total_commands_processed'])
@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+import telegram.ext
+from aiohttp.test_utils import TestClient, TestServer
+from unittest.mock import AsyncMock
+import cases_data
+import db
+import db_sync
+import geobot
+import ingest
+import test_utils
+import webhook
+
+PATH = '/telegram'
+SECRET = 'test-secret'
+
+
+# Both with updates written by the handler and with the ingestion buffer on: updates are stored once answered
+@pytest.fixture(params=['0', '200'], ids=['store_now', 'buffered'])
+async def webhook_client(request, monkeypatch):
+    monkeypatch.setenv('INGEST_WINDOW_MS', request.param)
+    monkeypatch.setattr(ingest, 'ingestor', None)
+    # No Telegram API calls: the bot is not logged in and replies are recorded
+    monkeypatch.setattr(telegram.ext.ExtBot, 'initialize', AsyncMock())
+    monkeypatch.setattr(telegram.ext.ExtBot, 'shutdown', AsyncMock())
+    monkeypatch.setattr(telegram.ext.ExtBot, 'send_message', AsyncMock())
+    application = geobot.create_application('123456:TEST', concurrent_updates=8)
+    async with application:
+        async with TestClient(TestServer(webhook.create_web_app(application, PATH, SECRET))) as client:
+            yield client
+    await ingest.shutdown()
+
+
+async def post_updates(client, updates: list):
+    for update in updates:
+        resp = await client.post(PATH, json=update, headers={webhook.SECRET_HEADER: SECRET})
+        assert resp.status == 200
+
+
+def get_sess_id(chat_id, msg_id, usr_id=12345):
+    return db.get_redis().get(db.get_live_key(usr_id, chat_id, msg_id))
+
+
+@pytest.mark.asyncio
+async def test_webhook_track(webhook_client):
+    await post_updates(webhook_client, test_utils.create_tg_track_json(cases_data.general_idling.track))
+
+    info, segments = db_sync.get_track(get_sess_id(67890, 100))
+    assert info.length == pytest.approx(cases_data.general_idling.expect_length, 1.0)
+    assert info.duration == pytest.approx(cases_data.general_idling.expect_duration, 0.1)
+    assert telegram.ext.ExtBot.send_message.await_count == 2 # started and stopped
+
+
+@pytest.mark.asyncio
+async def test_webhook_concurrent_sessions(webhook_client):
+    cases = [cases_data.smoke, cases_data.general_idling, cases_data.speeding, cases_data.short_idling]
+    # every session posts its updates in order, sessions are posted concurrently
+    await asyncio.gather(*(post_updates(webhook_client, test_utils.create_tg_track_json(cs.track, msg_id=100 + i))
+        for i, cs in enumerate(cases)))
+
+    for i, cs in enumerate(cases):
+        info, segments = db_sync.get_track(get_sess_id(67890, 100 + i))
+        assert info.length == pytest.approx(cs.expect_length, 1.0)
+        assert info.duration == pytest.approx(cs.expect_duration, 0.1)
+
+
+@pytest.mark.asyncio
+async def test_webhook_rejects(webhook_client):
+    update = test_utils.create_tg_track_json(cases_data.smoke.track)[0]
+    resp = await webhook_client.post(PATH, json=update, headers={webhook.SECRET_HEADER: 'wrong'})
+    assert resp.status == 403
+    resp = await webhook_client.post(PATH, data='not json', headers={webhook.SECRET_HEADER: SECRET})
+    assert resp.status == 400
+    assert db.get_redis().keys('live:*') == []
+
+
+# Requests are answered once their updates are stored, also with the ingestion buffer on
+@pytest.mark.asyncio
+async def test_webhook_answered_once_stored(webhook_client):
+    await post_updates(webhook_client, test_utils.create_tg_track_json(cases_data.smoke.track, final=False))
+
+    info, segments = db_sync.get_track(get_sess_id(67890, 100))
+    assert info.points_total == cases_data.smoke.expect_gpx_points
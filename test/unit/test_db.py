@@ -0,0 +1,16 @@
+import db
+import common
+
+
+def test_unpack_segments_empty():
+    assert db.unpack_segments(b'') == []
+
+
+def test_unpack_segments():
+    records = [(45.1, 19.1, 100.0, 1), (45.2, 19.2, 110.04, 1), (45.3, 19.3, 120.0, 3), (45.4, 19.4, 130.0, 4)]
+    packed = b''.join(db.POINT_RECORD.pack(*rec) for rec in records)
+    assert db.unpack_segments(packed) == [
+        [common.Point(45.1, 19.1, 100.0), common.Point(45.2, 19.2, 110.0)],
+        [common.Point(45.3, 19.3, 120.0)],
+        [common.Point(45.4, 19.4, 130.0)],
+    ]
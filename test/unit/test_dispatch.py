@@ -0,0 +1,117 @@
+import asyncio
+import random
+import pytest
+import telegram
+import common
+import dispatch
+import tracker
+import test_utils
+
+
+def location_update(update_id: int, chat_id: int, msg_id: int):
+    return telegram.Update.de_json({
+        'update_id': update_id,
+        'edited_message': {
+            'message_id': msg_id, 'date': 1747498800, 'edit_date': 1747498800 + update_id,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 12345, 'is_bot': False, 'first_name': 'Test User'},
+            'location': {'latitude': 45.2393, 'longitude': 19.8412, 'live_period': 3600},
+        },
+    }, None)
+
+
+def test_update_key():
+    assert dispatch.get_update_key(location_update(1, 67890, 100)) == (67890, 100)
+    assert dispatch.get_update_key(telegram.Update(2)) is None
+    assert dispatch.get_update_key(object()) is None
+
+
+@pytest.mark.asyncio
+async def test_session_order():
+    processor = dispatch.SessionOrderedProcessor(8)
+    processed = {} # key -> update ids in processing order
+    running = set()
+    max_running = 0
+    rnd = random.Random(1)
+
+    async def handle(update):
+        nonlocal max_running
+        key = dispatch.get_update_key(update)
+        assert key not in running # one update of a session at a time
+        running.add(key)
+        max_running = max(max_running, len(running))
+        await asyncio.sleep(rnd.uniform(0.0, 0.002))
+        processed.setdefault(key, []).append(update.update_id)
+        running.remove(key)
+
+    updates = [location_update(i, 67890, rnd.randrange(5)) for i in range(200)]
+    await asyncio.gather(*(processor.process_update(upd, handle(upd)) for upd in updates))
+
+    for key, ids in processed.items():
+        assert ids == sorted(ids)
+    assert sum(len(ids) for ids in processed.values()) == len(updates)
+    assert max_running > 1 # different sessions run in parallel
+    assert len(processor.session_locks) == 0
+
+
+@pytest.mark.asyncio
+async def test_keyed_locks_cancel():
+    locks = dispatch.KeyedLocks()
+    await locks.acquire('a')
+    waiter = asyncio.create_task(locks.acquire('a'))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    locks.release('a')
+    assert len(locks) == 0
+
+
+# Stored sessions and the handler reading, updating and writing them back with awaits in between, as over Redis
+class SessionStore:
+    def __init__(self, rnd: random.Random = None):
+        self.rnd = rnd
+        self.sessions = {} # key -> session fields
+        self.points = {} # key -> number of stored points
+
+    async def round_trip(self):
+        await asyncio.sleep(self.rnd.uniform(0.0, 0.001) if self.rnd is not None else 0.0)
+
+    async def handle(self, key, point: common.Point):
+        data = self.sessions.get(key)
+        await self.round_trip()
+        if data is None:
+            data = tracker.new_session_data(12345, key[0], key[1], lat=point.latitude, long=point.longitude, timestamp=point.ts)
+            data['id'] = f'session:{key[1]}'
+        sd = tracker.SessionData(data)
+        pd = tracker.PointsData()
+        tracker.Tracker(sd, pd).update(point, location_is_new=key not in self.sessions)
+        await self.round_trip()
+        self.sessions[key] = sd.get_merged()
+        self.points[key] = self.points.get(key, 0) + len(pd.points)
+
+
+@pytest.mark.asyncio
+async def test_interleaved_edits(monkeypatch):
+    monkeypatch.setattr(tracker.logger, 'disabled', True)
+    rnd = random.Random(2)
+    tracks = {(67890, 100 + i): test_utils.random_track(rnd, common.Point(45.2393 + i * 0.01, 19.8412, 1747498800.0), 60)
+        for i in range(50)}
+    edits = test_utils.interleave_tracks(rnd, tracks)
+
+    serial = SessionStore()
+    for key, point in edits:
+        await serial.handle(key, point)
+
+    concurrent = SessionStore(random.Random(3))
+    processor = dispatch.SessionOrderedProcessor(32)
+    await asyncio.gather(*(processor.process_update(location_update(i, *key), concurrent.handle(key, point))
+        for i, (key, point) in enumerate(edits)))
+
+    assert len(edits) == 3000
+    for key in tracks.keys():
+        expected, result = serial.sessions[key], concurrent.sessions[key]
+        assert result['length'] == pytest.approx(expected['length'])
+        assert result['duration'] == pytest.approx(expected['duration'])
+        assert result['track_segm_idx'] == expected['track_segm_idx']
+        assert concurrent.points[key] == serial.points[key]
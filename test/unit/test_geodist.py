@@ -0,0 +1,47 @@
+import pytest
+import numpy as np
+from geopy import distance
+import const
+import geodist
+
+
+def random_steps(count: int, max_lat: float, max_dist: float, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        lat = rng.uniform(-max_lat, max_lat)
+        lon = rng.uniform(-180.0, 180.0)
+        dest = distance.distance(meters=rng.uniform(1.0, max_dist)).destination((lat, lon), rng.uniform(0.0, 360.0))
+        yield lat, lon, dest.latitude, dest.longitude
+
+
+def test_error_bound():
+    for lat1, lon1, lat2, lon2 in random_steps(2000, geodist.FAST_MAX_LATITUDE, geodist.FAST_MAX_DISTANCE):
+        precise = geodist.geodesic_distance(lat1, lon1, lat2, lon2)
+        assert geodist.local_distance(lat1, lon1, lat2, lon2) == pytest.approx(precise, rel=geodist.FAST_REL_ERROR)
+
+
+def test_antimeridian():
+    assert geodist.local_distance(0.0, 179.9999, 0.0, -179.9999) == pytest.approx(22.26, abs=0.01)
+
+
+@pytest.mark.parametrize('lat1, lon1, lat2, lon2', [
+    (85.0, 10.0, 85.0001, 10.0), # polar area
+    (45.0, 19.0, 45.2, 19.0), # long distance
+])
+def test_fallback_outside_of_bounds(lat1, lon1, lat2, lon2):
+    assert geodist.fast_distance(lat1, lon1, lat2, lon2) == geodist.geodesic_distance(lat1, lon1, lat2, lon2)
+
+
+def test_fallback_near_threshold():
+    # A step of exactly MIN_GEO_DELTA along the meridian
+    dest = distance.distance(meters=const.MIN_GEO_DELTA).destination((45.0, 19.0), 0.0)
+    precise = geodist.geodesic_distance(45.0, 19.0, dest.latitude, dest.longitude)
+    assert geodist.fast_distance(45.0, 19.0, dest.latitude, dest.longitude, (const.MIN_GEO_DELTA,)) == precise
+    assert geodist.fast_distance(45.0, 19.0, dest.latitude, dest.longitude) == \
+        geodist.local_distance(45.0, 19.0, dest.latitude, dest.longitude)
+
+
+def test_get_backend(monkeypatch):
+    monkeypatch.setattr(geodist, 'backend', None)
+    monkeypatch.setenv('DISTANCE_BACKEND', 'geodesic')
+    assert geodist.get_backend() is geodist.geodesic_distance
@@ -0,0 +1,69 @@
+import gzip
+import os
+import pytest
+import common
+import db
+import gpxcache
+import gpxstream
+
+SESS_ID = 'session:c93840ba-8560-4a23-940f-0c23c45b8807'
+POINTS = [common.Point(45.2393, 19.8412, 1747498800.0), common.Point(45.2406, 19.842, 1747498830.0)]
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('GPX_CACHE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def pack(points):
+    return b''.join(db.POINT_RECORD.pack(p.latitude, p.longitude, p.ts, 1) for p in points)
+
+
+def test_create_and_open(cache_dir):
+    assert gpxcache.open_gpx(SESS_ID, 1, False) is None
+    with gpxcache.create_gpx(SESS_ID, 1, pack(POINTS), False) as f:
+        created = f.read()
+    assert created.decode() == ''.join(gpxstream.iter_gpx(gpxstream.segments_to_records([POINTS])))
+    with gpxcache.open_gpx(SESS_ID, 1, False) as f:
+        assert f.read() == created
+    assert gpxcache.open_gpx(SESS_ID, 1, True) is None
+
+    with gpxcache.create_gpx(SESS_ID, 1, pack(POINTS), True) as f:
+        assert gzip.decompress(f.read()) == created
+
+
+def test_old_revisions_removed(cache_dir):
+    gpxcache.create_gpx(SESS_ID, 1, pack(POINTS[:1]), False).close()
+    gpxcache.create_gpx(SESS_ID, 3, pack(POINTS), False).close()
+    gpxcache.create_gpx(SESS_ID, 2, pack(POINTS), True).close()
+    assert gpxcache.open_gpx(SESS_ID, 1, False) is None
+    assert sorted(os.listdir(cache_dir)) == ['track-c93840ba-8560-4a23-940f-0c23c45b8807-2.gpx.gz',
+        'track-c93840ba-8560-4a23-940f-0c23c45b8807-3.gpx']
+
+
+def test_lru_eviction(cache_dir, monkeypatch):
+    sess_ids = [f'session:{i:08d}-8560-4a23-940f-0c23c45b8807' for i in range(4)]
+    for i, sess_id in enumerate(sess_ids):
+        gpxcache.create_gpx(sess_id, 1, pack(POINTS), False).close()
+        os.utime(gpxcache.get_filename(sess_id, 1, False), (1747498800.0 + i, 1747498800.0 + i))
+    file_size = os.path.getsize(gpxcache.get_filename(sess_ids[0], 1, False))
+    gpxcache.open_gpx(sess_ids[0], 1, False).close() # the oldest one is used again
+
+    monkeypatch.setenv('GPX_CACHE_MAX_MB', str(4.2 * file_size / 1024 / 1024))
+    sess_id = 'session:00000004-8560-4a23-940f-0c23c45b8807'
+    with gpxcache.create_gpx(sess_id, 1, pack(POINTS), False) as f:
+        assert f.read()
+    assert gpxcache.open_gpx(sess_ids[1], 1, False) is None
+    assert gpxcache.open_gpx(sess_ids[2], 1, False) is None
+    assert len(os.listdir(cache_dir)) == 3 # 90% of the limit
+
+
+def test_failed_write_cleaned_up(cache_dir, monkeypatch):
+    def write_gpx(f, records, compress):
+        f.write(b'<?xml')
+        raise OSError('No space left on device')
+    monkeypatch.setattr(gpxstream, 'write_gpx', write_gpx)
+    with pytest.raises(OSError):
+        gpxcache.create_gpx(SESS_ID, 1, pack(POINTS), False)
+    assert os.listdir(cache_dir) == []
@@ -0,0 +1,50 @@
+import gzip
+import io
+import xml.etree.ElementTree as ET
+import common
+import gpxstream
+
+NS = {'g': 'http://www.topografix.com/GPX/1/1'}
+
+SEGMENTS = [
+    [common.Point(45.2393, 19.8412, 1747498800.0), common.Point(45.2406, 19.842, 1747498830.0)],
+    [common.Point(45.24122, 19.84237, 1747498870.0)],
+]
+
+
+def parse_segments(data: bytes):
+    root = ET.fromstring(data)
+    return [[(float(pt.get('lat')), float(pt.get('lon')), pt.find('g:time', NS).text) for pt in seg.findall('g:trkpt', NS)]
+        for seg in root.findall('g:trk/g:trkseg', NS)]
+
+
+def test_write_gpx():
+    out = io.BytesIO()
+    gpxstream.write_gpx(out, gpxstream.segments_to_records(SEGMENTS))
+    assert parse_segments(out.getvalue()) == [
+        [(45.2393, 19.8412, '2025-05-17T16:20:00Z'), (45.2406, 19.842, '2025-05-17T16:20:30Z')],
+        [(45.24122, 19.84237, '2025-05-17T16:21:10Z')],
+    ]
+
+
+def test_write_gpx_compressed():
+    plain = io.BytesIO()
+    gpxstream.write_gpx(plain, gpxstream.segments_to_records(SEGMENTS))
+    compressed = io.BytesIO()
+    gpxstream.write_gpx(compressed, gpxstream.segments_to_records(SEGMENTS), compress=True)
+    assert not compressed.closed
+    assert gzip.decompress(compressed.getvalue()) == plain.getvalue()
+
+
+def test_chunks():
+    records = [(45.0 + i * 1e-5, 19.0, 1747498800.0 + i, 1 + i // 1500) for i in range(3000)]
+    chunks = list(gpxstream.iter_gpx(records))
+    assert len(chunks) > 3
+    assert [len(seg) for seg in parse_segments(''.join(chunks).encode())] == [1500, 1500]
+
+
+def test_empty_track_and_escaping():
+    data = ''.join(gpxstream.iter_gpx([], name='<Track & co>'))
+    root = ET.fromstring(data.encode())
+    assert root.find('g:metadata/g:name', NS).text == '<Track & co>'
+    assert parse_segments(data.encode()) == []
@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+import telegram
+import common
+import ingest
+
+
+CHAT = telegram.Chat(67890, 'private')
+
+
+def point(i: int):
+    return common.Point(45.2393 + i * 0.001, 19.8412, 1747498800.0 + i * 10.0)
+
+
+# Redis stand-in of ingest.store_batch: stores a batch once the test releases it
+class SlowStore:
+    def __init__(self):
+        self.batches = []
+        self.release = asyncio.Event()
+
+
+    async def store_batch(self, batch: dict):
+        await self.release.wait()
+        self.batches.append({live_key: len(pending.updates) for live_key, pending in batch.items()})
+        return [f'session:{live_key}' for live_key in batch.keys()]
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = SlowStore()
+    monkeypatch.setattr(ingest, 'store_batch', store.store_batch)
+    return store
+
+
+@pytest.mark.asyncio
+async def test_submit_waits_for_flush(store):
+    ing = ingest.Ingestor(window=60.0, max_batch=4)
+    for i in range(4):
+        await ing.submit(12345, 100 + i % 2, CHAT, point(i), i < 2)
+    await asyncio.sleep(0.01) # the full buffer is flushed right away
+    assert ing.flush_lock.locked() and ing.pending_updates == 0
+
+    for i in range(4, 8):
+        await ing.submit(12345, 100 + i % 2, CHAT, point(i), False)
+    assert ing.is_full()
+    waiting = asyncio.create_task(ing.submit(12345, 100, CHAT, point(8), False))
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+    assert ing.pending_updates == 4
+
+    store.release.set()
+    await waiting
+    await ing.close()
+    assert [sum(batch.values()) for batch in store.batches] == [4, 4, 1]
+
+
+# Redis stand-in failing the first `failures` batches
+class FailingStore:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.batches = []
+
+
+    async def store_batch(self, batch: dict):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError('Redis is not available')
+        self.batches.append({live_key: [pnt.ts for pnt, _ in pending.updates] for live_key, pending in batch.items()})
+        return [f'session:{live_key}' for live_key in batch.keys()]
+
+
+@pytest.fixture
+def failing_store(monkeypatch):
+    monkeypatch.setattr(ingest.const, 'INGEST_RETRY_DELAY', 0.01)
+    monkeypatch.setattr(ingest.const, 'INGEST_FLUSH_ATTEMPTS', 3)
+    def create(failures: int):
+        store = FailingStore(failures)
+        monkeypatch.setattr(ingest, 'store_batch', store.store_batch)
+        return store
+    return create
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_retried(failing_store):
+    store = failing_store(2)
+    ing = ingest.Ingestor(window=0.01, max_batch=100)
+    await ing.submit(12345, 100, CHAT, point(0), False)
+    await asyncio.sleep(0.02) # the first flush fails
+    assert ing.failures == 1
+    started = await ing.submit(12345, 101, CHAT, point(1), True, wait=True)
+    await ing.submit(12345, 100, CHAT, point(2), False)
+    assert await started == 'session:live:67890:101:12345'
+    await ing.close()
+
+    # the failed updates are stored ahead of the newer ones of the session
+    assert store.batches == [{'live:67890:100:12345': [point(0).ts, point(2).ts], 'live:67890:101:12345': [point(1).ts]}]
+    assert ing.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_updates_dropped(failing_store):
+    store = failing_store(3)
+    dropped = ingest.DROPPED_UPDATES.values.get((), 0)
+    ing = ingest.Ingestor(window=0.01, max_batch=100)
+    started = await ing.submit(12345, 100, CHAT, point(0), True, wait=True)
+    await ing.submit(12345, 100, CHAT, point(1), False)
+    with pytest.raises(ConnectionError):
+        await started
+    await ing.submit(12345, 100, CHAT, point(2), False)
+    await ing.close()
+
+    assert ingest.DROPPED_UPDATES.values[()] == dropped + 2
+    assert store.batches == [{'live:67890:100:12345': [point(2).ts]}]
@@ -0,0 +1,58 @@
+import io
+import logging
+import pytest
+import logconf
+
+
+@pytest.fixture
+def root_logger(monkeypatch):
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    monkeypatch.setattr(logconf, 'sample_every', 1)
+    yield root
+    logconf.shutdown()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_sampled_lines(root_logger):
+    stream = io.StringIO()
+    logconf.setup('INFO', 3, stream)
+    logger = logging.getLogger('test-logconf')
+    update_logger = logconf.SampledLogger(logger)
+    for i in range(1, 10):
+        update_logger.info('update. i=%s', i)
+    logger.info('regular line')
+    logconf.shutdown()
+
+    lines = stream.getvalue().splitlines()
+    assert [line.split(' - ')[-1] for line in lines] == ['update. i=3', 'update. i=6', 'update. i=9', 'regular line']
+    assert all(' - test-logconf - INFO - ' in line for line in lines)
+
+
+def test_level(root_logger):
+    stream = io.StringIO()
+    logconf.setup('WARNING', 1, stream)
+    logger = logging.getLogger('test-logconf')
+    update_logger = logconf.SampledLogger(logger)
+    update_logger.info('update')
+    logger.warning('warning line')
+    logconf.shutdown()
+
+    assert stream.getvalue().splitlines()[0].endswith(' - WARNING - warning line')
+    assert len(stream.getvalue().splitlines()) == 1
+    assert update_logger.count == 0 # lines of disabled levels are not counted
+
+
+def test_formatted_by_listener(root_logger):
+    stream = io.StringIO()
+    logconf.setup('INFO', 1, stream)
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logging.getLogger().addHandler(handler)
+    logging.getLogger('test-logconf').info('point. lat=%.1f', 45.25)
+    logconf.shutdown()
+
+    assert records[0].args == (45.25,) # queued as is, not formatted by the caller
+    assert stream.getvalue().endswith(' - point. lat=45.2\n')
@@ -0,0 +1,57 @@
+import os
+import pytest
+from PIL import Image
+import common
+import const
+import maps
+import maps_pil
+import tiles
+import trackstats
+
+
+TILE_COLOR = (200, 220, 200)
+
+
+@pytest.fixture
+def tile_cache(tmp_path, monkeypatch):
+    src = tmp_path / 'server'
+    for zoom in (const.MAP_DETAIL_LVL1, const.MAP_DETAIL_LVL2, const.MAP_DETAIL_LVL3):
+        for x, y in tiles.tiles_for_bbox(45.20, 19.80, 45.30, 19.90, zoom):
+            os.makedirs(src / str(zoom) / str(x), exist_ok=True)
+            Image.new('RGB', (256, 256), TILE_COLOR).save(src / str(zoom) / str(x) / f'{y}.png')
+    monkeypatch.setattr(tiles, 'tile_cache',
+        tiles.TileCache(str(tmp_path / 'cache'), 100000000, f'file://{src}/{{z}}/{{x}}/{{y}}.png'))
+
+
+def make_track(lat_size: float, lon_size: float):
+    points = [common.Point(45.24 + lat_size * i / 100, 19.84 + lon_size * i / 100, 1.7e9 + i) for i in range(101)]
+    return trackstats.from_segments([points[:50], points[50:]])
+
+
+def test_map_area():
+    area = maps.get_map_area(make_track(0.001, 0.02))
+    assert area.lat_delta == pytest.approx(0.001)
+    assert area.lon_delta == pytest.approx(0.02)
+    assert area.lat_max - area.lat_min == pytest.approx(const.MIN_ANGULAR_SIZE_FOR_MAP * 1.08)
+    assert area.lon_max - area.lon_min == pytest.approx(0.02 * 1.08)
+    assert maps.get_detail_level(area) == const.MAP_DETAIL_LVL3
+    assert maps.get_detail_level(maps.get_map_area(make_track(0.004, 0.004))) == const.MAP_DETAIL_LVL1
+
+
+def test_render_map(tmp_path, tile_cache):
+    fname = str(tmp_path / 'map.jpg')
+    maps_pil.render_map(make_track(0.004, 0.008), fname)
+    img = Image.open(fname).convert('RGB')
+    width, height = img.size
+    assert width > height > 100
+    # Track is drawn over the tiles
+    blue = sum(1 for r, g, b in img.getdata() if b > 180 and r < 80 and g < 80)
+    assert blue > width * 2
+    assert img.getpixel((2, 2)) == pytest.approx(TILE_COLOR, abs=8)
+
+
+def test_render_map_size_limit(tmp_path, tile_cache, monkeypatch):
+    monkeypatch.setattr(const, 'MAP_MAX_PIXELS', 300)
+    fname = str(tmp_path / 'map.jpg')
+    maps_pil.render_map(make_track(0.03, 0.03), fname)
+    assert max(Image.open(fname).size) <= 300
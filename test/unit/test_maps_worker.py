@@ -0,0 +1,31 @@
+import asyncio
+import subprocess
+import sys
+import pytest
+import const
+import maps
+import maps_worker
+
+
+def test_no_telegram_import():
+    code = 'import sys, maps_worker; assert "telegram" not in sys.modules'
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+# Errors of a job (e.g. Redis is not available) do not stop the worker, only the stop event does
+@pytest.mark.asyncio
+async def test_worker_survives_errors(monkeypatch):
+    monkeypatch.setattr(const, 'MAP_WORKER_POLL_INTERVAL', 0.001)
+    stop = asyncio.Event()
+    results = [ConnectionError('Redis is not available'), True, ConnectionError('Redis is not available'), False]
+    async def try_create_map():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        if len(results) == 0:
+            stop.set()
+        return result
+    monkeypatch.setattr(maps, 'try_create_map', try_create_map)
+
+    await asyncio.wait_for(maps_worker.worker_loop(stop), 5.0)
+    assert results == []
@@ -0,0 +1,81 @@
+import urllib.error
+import urllib.request
+import pytest
+import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, 'registry', [])
+    return metrics.registry
+
+
+def test_histogram(registry):
+    hist = metrics.Histogram('test_seconds', 'Test durations', ('kind',), buckets=(0.1, 1.0))
+    hist.observe(0.05, kind='a')
+    hist.observe(0.5, kind='a')
+    hist.observe(5.0, kind='a')
+    hist.observe(1.0, kind='b')
+    lines = metrics.render().splitlines()
+    assert lines[:2] == ['# HELP test_seconds Test durations', '# TYPE test_seconds histogram']
+    assert 'test_seconds_bucket{kind="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{kind="a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{kind="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_sum{kind="a"} 5.55' in lines
+    assert 'test_seconds_count{kind="a"} 3' in lines
+    assert 'test_seconds_bucket{kind="b",le="1.0"} 1' in lines # upper bounds are inclusive
+
+
+@pytest.mark.asyncio
+async def test_time_decorator(registry):
+    hist = metrics.Histogram('test_seconds', 'Test durations', ('function', 'layer'))
+
+    @hist.time('function', layer='db')
+    async def get_thing(value):
+        return value
+
+    assert await get_thing(42) == 42
+    assert get_thing.__name__ == 'get_thing'
+    assert 'test_seconds_count{function="get_thing",layer="db"} 1' in metrics.render().splitlines()
+
+
+def test_gauge(registry):
+    metrics.Gauge('test_queue', 'Queue depth', ('queue',), func=lambda: {('todo',): 3, ('dead',): 0})
+    metrics.Gauge('test_sessions', 'Sessions', func=lambda: 7)
+    metrics.Gauge('test_broken', 'Not available', func=lambda: 1 / 0)
+    gauge = metrics.Gauge('test_set', 'Set by the code')
+    gauge.set(2.5)
+    lines = metrics.render().splitlines()
+    assert 'test_queue{queue="todo"} 3' in lines
+    assert 'test_queue{queue="dead"} 0' in lines
+    assert 'test_sessions 7' in lines
+    assert 'test_set 2.5' in lines
+    assert not any(line.startswith('test_broken') for line in lines)
+
+
+def test_server(registry):
+    metrics.Gauge('test_sessions', 'Sessions', func=lambda: 7)
+    server = metrics.start_server(0, '127.0.0.1')
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        with urllib.request.urlopen(f'{url}/metrics') as resp:
+            assert resp.status == 200
+            assert 'test_sessions 7' in resp.read().decode().splitlines()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f'{url}/other')
+    finally:
+        metrics.stop_server()
+
+
+def test_server_disabled(monkeypatch):
+    monkeypatch.delenv('METRICS_PORT', raising=False)
+    assert metrics.start_server() is None
+
+
+def test_counter(registry):
+    counter = metrics.Counter('test_total', 'Things counted', ('kind',))
+    counter.inc(kind='a')
+    counter.inc(2, kind='a')
+    lines = metrics.render().splitlines()
+    assert '# TYPE test_total counter' in lines
+    assert 'test_total{kind="a"} 3' in lines
@@ -0,0 +1,47 @@
+import sesscache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_expiration():
+    clock = Clock()
+    cache = sesscache.SessionCache(10, 180.0, clock=clock)
+    cache.put('live:1:2:3', {'id': 'session:a'})
+    clock.now += 179.0
+    assert cache.get('live:1:2:3') == {'id': 'session:a'}
+    clock.now += 179.0 # the expiration time is prolonged by use
+    assert cache.get('live:1:2:3') == {'id': 'session:a'}
+    clock.now += 180.0
+    assert cache.get('live:1:2:3') is None
+    assert len(cache) == 0
+
+
+def test_size_limit():
+    cache = sesscache.SessionCache(2, 180.0, clock=Clock())
+    cache.put('a', {'id': 'session:a'})
+    cache.put('b', {'id': 'session:b'})
+    cache.get('a')
+    cache.put('c', {'id': 'session:c'})
+    assert cache.get('b') is None # least recently used
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+def test_disabled():
+    cache = sesscache.SessionCache(0, 180.0)
+    cache.put('a', {'id': 'session:a'})
+    assert cache.get('a') is None
+
+
+def test_remove():
+    cache = sesscache.SessionCache(10, 180.0)
+    cache.put('a', {'id': 'session:a'})
+    cache.remove('a')
+    cache.remove('b')
+    assert cache.get('a') is None
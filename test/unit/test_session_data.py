@@ -6,9 +6,9 @@ import common
 def test_session_data_init():
     test_data = {'chat_name': 'test', 'usr_id': 123}
     sess = tracker.SessionData(test_data)
-    assert sess.__dict__['data']['chat_name'] == 'test'
-    assert sess.__dict__['data']['usr_id'] == 123
-    assert sess.__dict__['updates'] == dict()
+    assert sess.chat_name == 'test'
+    assert sess.usr_id == 123
+    assert sess.get_updates() == dict()
 
 
 def test_session_data_get():
@@ -43,11 +43,23 @@ def test_type_conversion():
     assert sess.get_updates() == {'track_segm_len': '12', 'duration': '88.0'}
 
 
+def test_load_conversion():
+    sess = tracker.SessionData({'track_segm_len': '10', 'length': '5.5', 'chat_name': 'test'})
+    assert sess.track_segm_len == 10
+    assert sess.length == 5.5
+    assert sess.get_updates() == dict()
+    assert sess.get_merged() == {'track_segm_len': 10, 'length': 5.5, 'chat_name': 'test'}
+    with pytest.raises(AttributeError):
+        _ = sess.duration
+
+
 def test_session_data_invalid_attribute():
     test_data = {'chat_name': 'test'}
     session = tracker.SessionData(test_data)
     with pytest.raises(AssertionError):
         _ = session.nonexistent
+    with pytest.raises(AssertionError):
+        session.nonexistent = 1
 
 
 def test_points_data():
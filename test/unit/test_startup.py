@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+# Bot start cost up to the first getUpdates poll: imports plus building the application.
+# Rendering, GPX and geodesy packages must not be loaded at start, they are imported on first use.
+
+STARTUP_BUDGET = 3.0 # seconds, generous for slow CI machines; a warm local start takes ~0.5 s
+HEAVY_MODULES = ['matplotlib', 'cartopy', 'numpy', 'PIL', 'gpx', 'geopy', 'aiohttp']
+
+CODE = '''
+import sys, time
+t0 = time.perf_counter()
+import geobot
+app = geobot.create_application('123456:TEST')
+print(time.perf_counter() - t0)
+print(' '.join(sorted(set(name.split('.')[0] for name in sys.modules))))
+'''
+
+
+def import_report(stderr: str, top: int = 15):
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.rstrip()))
+    rows.sort(reverse=True)
+    return '\n'.join(f'{us / 1000:8.1f} ms {name}' for us, name in rows[:top])
+
+
+def test_startup_time():
+    env = dict(os.environ, MAPS_IN_BOT='0')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', CODE],
+        env=env, capture_output=True, text=True, check=True)
+    elapsed, modules = proc.stdout.strip().splitlines()[-2:]
+    report = import_report(proc.stderr)
+    print(f'time to first poll {float(elapsed):.3f} s, slowest imports:\n{report}')
+
+    loaded = [name for name in HEAVY_MODULES if name in modules.split()]
+    assert loaded == [], f'heavy modules loaded at start: {loaded}\n{report}'
+    assert float(elapsed) < STARTUP_BUDGET, report
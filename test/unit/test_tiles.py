@@ -0,0 +1,58 @@
+import os
+import pytest
+import tiles
+
+
+@pytest.fixture
+def tile_server(tmp_path):
+    # Local tile directory in place of a tile server
+    src = tmp_path / 'server'
+    for x, y in [(0, 0), (0, 1), (1, 0)]:
+        os.makedirs(src / '1' / str(x), exist_ok=True)
+        (src / '1' / str(x) / f'{y}.png').write_bytes(f'tile-1-{x}-{y}'.encode() * 10)
+    return src
+
+
+def create_cache(tmp_path, tile_server, max_bytes=1000000):
+    return tiles.TileCache(str(tmp_path / 'cache'), max_bytes, f'file://{tile_server}/{{z}}/{{x}}/{{y}}.png')
+
+
+def test_lonlat_to_tile():
+    assert tiles.lonlat_to_tile(0.0, 0.0, 1) == pytest.approx((1.0, 1.0))
+    x, y = tiles.lonlat_to_tile(19.8412, 45.2393, 15)
+    assert (int(x), int(y)) == (18189, 11756)
+
+
+def test_tiles_for_bbox():
+    assert list(tiles.tiles_for_bbox(-10.0, -10.0, 10.0, 10.0, 1)) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+    assert list(tiles.tiles_for_bbox(45.2393, 19.8412, 45.2394, 19.8413, 15)) == [(18189, 11756)]
+
+
+def test_get_caches_tile(tmp_path, tile_server):
+    cache = create_cache(tmp_path, tile_server)
+    assert cache.get(1, 0, 1) == b'tile-1-0-1' * 10
+    os.remove(tile_server / '1' / '0' / '1.png')
+    assert cache.get(1, 0, 1) == b'tile-1-0-1' * 10
+
+
+def test_missing_tile(tmp_path, tile_server):
+    cache = create_cache(tmp_path, tile_server)
+    assert cache.get(1, 1, 1) is None
+    assert not os.path.exists(cache.tile_path(1, 1, 1))
+
+
+def test_lru_eviction(tmp_path, tile_server):
+    cache = create_cache(tmp_path, tile_server, max_bytes=250)
+    cache.get(1, 0, 0)
+    cache.get(1, 0, 1)
+    os.utime(cache.tile_path(1, 0, 0), (1, 1))
+    cache.get(1, 1, 0)
+    assert not os.path.exists(cache.tile_path(1, 0, 0))
+    assert os.path.exists(cache.tile_path(1, 0, 1))
+    assert os.path.exists(cache.tile_path(1, 1, 0))
+
+
+def test_seed(tmp_path, tile_server):
+    cache = create_cache(tmp_path, tile_server)
+    assert cache.seed(-10.0, -10.0, 10.0, 10.0, [1]) == 3
+    assert os.path.exists(cache.tile_path(1, 1, 0))
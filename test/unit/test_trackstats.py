@@ -0,0 +1,86 @@
+import pytest
+import numpy as np
+from geopy import distance
+import common
+import db
+import tracker
+import trackstats
+import tracker_test_utils
+import cases_data
+
+
+ALL_CASES = [cases_data.smoke, cases_data.short_idling, cases_data.general_idling, cases_data.speeding,
+    cases_data.speeding_then_idling, cases_data.idling_then_speeding, cases_data.right_away_speeding,
+    cases_data.long_idling_then_speeding]
+
+
+# Remembers the segment id of every stored point, as db.store_update does
+class SegmentedPoints(tracker.PointsData):
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+        self.segm_ids = []
+
+    def add(self, point: common.Point):
+        super().add(point)
+        self.segm_ids.append(self.session.track_segm_idx)
+
+
+def run_tracker(cs: cases_data.Case):
+    sd = tracker.SessionData(tracker_test_utils.get_default_sess_data(cs.track[0][0]))
+    pd = SegmentedPoints(sd)
+    tr = tracker.Tracker(sd, pd)
+    for segm in cs.track:
+        for pnt in segm:
+            tr.update(pnt, location_is_new=pnt is cs.track[0][0])
+    return sd, pd
+
+
+# Stats of the track as stored by the tracker are the ones the tracker has kept in the session
+@pytest.mark.parametrize('cs', ALL_CASES)
+def test_stats_parity(cs):
+    sd, pd = run_tracker(cs)
+    packed = b''.join(db.POINT_RECORD.pack(p.latitude, p.longitude, p.ts, segm_id) for p, segm_id in zip(pd.points, pd.segm_ids))
+    track = trackstats.from_packed(packed)
+
+    stats = trackstats.track_stats(track)
+    assert stats.length == pytest.approx(sd.length, rel=1e-6)
+    assert stats.duration == pytest.approx(sd.duration)
+    assert stats.points == len(pd.points)
+    assert stats.segments == len(set(pd.segm_ids))
+
+
+def test_distances():
+    rng = np.random.default_rng(1)
+    lat1 = rng.uniform(-70.0, 70.0, 200)
+    lon1 = rng.uniform(-180.0, 180.0, 200)
+    lat2 = lat1 + rng.uniform(-0.01, 0.01, 200)
+    lon2 = lon1 + rng.uniform(-0.01, 0.01, 200)
+    expected = [distance.distance(p1, p2).m for p1, p2 in zip(zip(lat1, lon1), zip(lat2, lon2))]
+    assert trackstats.distances(lat1, lon1, lat2, lon2) == pytest.approx(expected, rel=1e-6)
+    assert trackstats.haversine(lat1, lon1, lat2, lon2) == pytest.approx(expected, rel=1e-2)
+    # across the antimeridian
+    assert trackstats.distances(np.array([10.0]), np.array([179.999]), np.array([10.0]), np.array([-179.999])) == \
+        pytest.approx([distance.distance((10.0, 179.999), (10.0, -179.999)).m], rel=1e-6)
+
+
+def test_from_packed():
+    segments = cases_data.general_idling.track
+    packed = b''.join(db.POINT_RECORD.pack(p.latitude, p.longitude, p.ts, i + 1)
+        for i, segm in enumerate(segments) for p in segm)
+    track = trackstats.from_packed(packed)
+    for field, expected in zip(track, trackstats.from_segments(segments)):
+        assert field.tolist() == expected.tolist()
+    bounds = trackstats.segment_bounds(track)
+    assert [track.lat[start:end].tolist() for start, end in bounds] == [[p.latitude for p in segm] for segm in segments]
+
+    stats = trackstats.track_stats(track)
+    assert stats.segments == len(segments)
+    assert stats.lat_min == min(p.latitude for segm in segments for p in segm)
+    assert stats.lon_max == max(p.longitude for segm in segments for p in segm)
+
+
+def test_empty_track():
+    track = trackstats.from_packed(b'')
+    assert trackstats.segment_bounds(track) == []
+    assert trackstats.track_stats(track).points == 0